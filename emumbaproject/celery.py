@@ -4,19 +4,22 @@
 
     Task is responsible to send emails to systems users who have pending
     tasks with due_datetime on that particular day. Task/Method will be
-    invoked at 12 AM everyday (UTC Standard)
+    invoked at 12 AM everyday (UTC Standard), it queues batches of users
+    which are sent in parallel (see todofehrist.reminders)
 """
 from __future__ import absolute_import, unicode_literals
 
 import logging
 import os
-from datetime import date
+import time
+from smtplib import SMTPException
 
-from django.db.models import Count
+from django.utils import timezone
 
 # Celery imports
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
 
 # Project Settings import
 from django.conf import settings
@@ -32,6 +35,43 @@ app.config_from_object('django.conf:settings')
 app.autodiscover_tasks(settings.INSTALLED_APPS)
 
 
+# metrics of tasks running in this process, task_id -> (start time, query counter, counting context)
+_running_tasks = {}
+
+
+@task_prerun.connect
+def start_task_metrics(task_id=None, **kwargs):
+    """
+    This method starts counting time & database queries of a task
+    """
+
+    from emumbaproject import metrics
+
+    counter = metrics.QueryCounter()
+    counting = metrics.queries_counted(counter)
+    counting.__enter__()
+    _running_tasks[task_id] = (time.perf_counter(), counter, counting)
+
+
+@task_postrun.connect
+def record_task_metrics(task_id=None, task=None, state=None, **kwargs):
+    """
+    This method records time & database queries of a finished task (see emumbaproject.metrics)
+    """
+
+    from emumbaproject import metrics
+
+    if task_id not in _running_tasks:
+        return
+    started, counter, counting = _running_tasks.pop(task_id)
+    counting.__exit__(None, None, None)
+
+    labels = (task.name, state)
+    metrics.task_duration.observe(time.perf_counter() - started, *labels)
+    metrics.task_db_queries.observe(counter.count, *labels)
+    metrics.task_db_duration.inc(*labels, amount=counter.duration)
+
+
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
     """
@@ -43,6 +83,36 @@ def setup_periodic_tasks(sender, **kwargs):
         crontab(hour=0, minute=0),
         to_do_fehrist_tasks_reminder.s(),
     )
+    # Send queued emails whose dispatch couldn't be queued or which are due for a retry
+    sender.add_periodic_task(
+        crontab(),
+        send_queued_emails.s(),
+    )
+    # Remove incomplete chunked uploads every hour
+    sender.add_periodic_task(
+        crontab(minute=30),
+        remove_expired_uploads.s(),
+    )
+    # Recompute daily task rollups of changed tasks every 5 minutes
+    sender.add_periodic_task(
+        crontab(minute='*/5'),
+        refresh_daily_task_rollups.s(),
+    )
+    # Remove media files no longer attached to any task every hour
+    sender.add_periodic_task(
+        crontab(minute=45),
+        remove_unreferenced_blobs.s(),
+    )
+    # Remove emails sent or given up longer than EMAIL_RETENTION_TIME ago every hour
+    sender.add_periodic_task(
+        crontab(minute=5),
+        remove_finished_emails.s(),
+    )
+    # Remove revocations of expired signed login tokens every hour
+    sender.add_periodic_task(
+        crontab(minute=15),
+        remove_expired_revocations.s(),
+    )
     # Reference add_periodic_table call method via s method
     # https://docs.celeryproject.org/en/stable/userguide/periodic-tasks.html
     # Setting these up from within the on_after_configure handler means that
@@ -54,20 +124,128 @@ def to_do_fehrist_tasks_reminder():
     """
     This method will send reminder to every user
     by email who have some pending tasks in to-do
-    list
+    list due today, by fanning out batches of users to
+    send_tasks_reminders subtasks
+    """
+
+    from todofehrist.reminders import reminder_batches
+
+    day = timezone.localdate().isoformat()
+
+    batches = 0
+    for batch in reminder_batches(day, settings.REMINDER_BATCH_SIZE):
+        send_tasks_reminders.delay(day, batch)
+        batches += 1
+
+    logging.info(f"{batches} reminder batches queued for {day}.")
+    return batches
+
+
+@app.task(autoretry_for=(SMTPException, OSError), retry_backoff=True, max_retries=5)
+def send_tasks_reminders(day, entries):
+    """
+    This method will send reminders of a batch ([user_id, email, count] entries)
+    over one SMTP connection, retried batches skip already reminded users
+    """
+
+    from todofehrist.reminders import send_reminders
+
+    return send_reminders(day, entries)
+
+
+@app.task
+def send_queued_emails():
+    """
+    This method will send a batch of queued emails (signup, password reset)
+    over the worker's SMTP connection and queue itself again if more are pending
+    """
+
+    from todofehrist.mail_queue import send_pending_emails
+
+    sent, more_pending = send_pending_emails()
+    if more_pending:
+        send_queued_emails.delay()
+
+    return sent
+
+
+@app.task
+def remove_finished_emails():
+    """
+    This method will remove queued emails (and their contexts holding account
+    tokens) sent or given up longer than EMAIL_RETENTION_TIME seconds ago
+    """
+
+    from todofehrist.mail_queue import remove_finished_emails as remove_emails
+
+    return remove_emails()
+
+
+@worker_process_shutdown.connect
+def close_smtp_connection(**kwargs):
+    """
+    This method closes SMTP connection kept open by a worker process
+    """
+
+    from todofehrist.mail_queue import close_smtp_connection as close_connection
+
+    close_connection()
+
+
+@worker_process_shutdown.connect
+def flush_metrics(**kwargs):
+    """
+    This method stores metrics of an exiting worker process, recorded since
+    its background flush (see emumbaproject.metrics)
+    """
+
+    from emumbaproject import metrics
+
+    metrics.registry.flush()
+
+
+@app.task
+def remove_expired_uploads():
+    """
+    This method will remove incomplete chunked uploads (and their part files)
+    which aren't written since MEDIA_UPLOAD_EXPIRY_TIME seconds
+    """
+
+    from todofehrist.media import remove_expired_uploads as remove_uploads
+
+    return remove_uploads()
+
+
+@app.task
+def remove_unreferenced_blobs():
+    """
+    This method will remove stored media files which aren't attached to
+    any task since MEDIA_BLOB_GRACE_TIME seconds
+    """
+
+    from todofehrist.media import remove_unreferenced_blobs as remove_blobs
+
+    return remove_blobs()
+
+
+@app.task
+def remove_expired_revocations():
+    """
+    This method will remove revocations of signed login tokens which have expired anyway
     """
 
-    from todofehrist.models import Task, User
-    from todofehrist.utility import send_email
+    from todofehrist.auth_tokens import remove_expired_revocations as remove_revocations
 
-    result = Task.objects.filter(
-        completion_status=0, completion_datetime__date=date.today()).values("user").annotate(
-        count=Count("user"))
+    return remove_revocations()
+
+
+@app.task
+def refresh_daily_task_rollups():
+    """
+    This method will recompute daily task rollups (used by reports) marked
+    stale by task changes, at most TASK_ROLLUP_REFRESH_BATCH rows per run
+    """
 
-    for user_tasks_entry in result:
-        email_address = User.objects.get(pk=user_tasks_entry["user"]).email
-        send_email("ToDoFehrist - Pending Tasks Reminder",
-                   f"You have {user_tasks_entry['count']} pending tasks due today.",
-                   email_address)
+    from todofehrist.models import UserDailyTaskRollup
 
-        logging.debug(f"Reminder Email sent to user with email address {email_address}")
+    return UserDailyTaskRollup.objects.refresh(limit=settings.TASK_ROLLUP_REFRESH_BATCH)
@@ -0,0 +1,243 @@
+"""
+    Contains a thread safe pool of database connections
+    ===================================================
+
+    Used by emumbaproject.pooled_postgresql backend, so that a request (or
+    Celery task) borrows an open connection instead of paying for a new
+    one (TCP, TLS & authentication round trips). The pool itself doesn't
+    know about databases, connections are opened, checked & closed by
+    callables it's given.
+
+    - A borrowed connection idle for check_after seconds or more is health
+      checked first, a failing one is replaced by a new connection.
+    - Connections older than max_lifetime seconds are closed instead of
+      being reused, idle ones beyond min_size are closed after max_idle.
+    - At most max_size connections are open, a borrower waits up to timeout
+      seconds for one to be given back and then gets PoolTimeout.
+    - A pool used by a forked process (Celery prefork, preloading WSGI
+      servers) drops connections of its parent without closing them, as
+      closing a shared socket would break them in the parent.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from emumbaproject import metrics
+
+# connections inherited from a parent process, kept referenced so that
+# they're never closed (or garbage collected) by a child
+_inherited_connections = []
+
+
+class PoolTimeout(Exception):
+    """
+        No connection was given back within pool's timeout
+    """
+
+
+class _PooledConnection:
+
+    def __init__(self, connection, now):
+        self.connection = connection
+        self.created = now
+        self.returned = now
+
+
+class ConnectionPool:
+    """
+        Pool of connections opened by connect(), health checked by check()
+        (returns False for a broken connection) and closed by close()
+    """
+
+    def __init__(self, connect, check, close, name="default", min_size=0, max_size=10,
+                 max_lifetime=30 * 60, max_idle=5 * 60, check_after=30, timeout=10):
+        self.connect = connect
+        self.check = check
+        self.close_connection = close
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # most recently given back last
+        self._borrowed = {}  # id(connection) -> _PooledConnection
+        self._size = 0  # idle & borrowed connections
+        self._pid = os.getpid()
+
+    @property
+    def size(self):
+        """
+        returns number of open (idle & borrowed) connections
+        """
+        return self._size
+
+    @property
+    def idle(self):
+        """
+        returns number of idle connections
+        """
+        return len(self._idle)
+
+    def _check_fork(self):
+        # called under lock
+        if self._pid == os.getpid():
+            return
+        _inherited_connections.extend(pooled.connection for pooled in self._idle)
+        _inherited_connections.extend(pooled.connection for pooled in self._borrowed.values())
+        self._idle.clear()
+        self._borrowed.clear()
+        self._size = 0
+        self._pid = os.getpid()
+
+    def _expired(self, pooled, now):
+        return now - pooled.created >= self.max_lifetime
+
+    def _take(self, now, expired):
+        """
+        returns an idle connection or None, expired ones are moved to expired (called under lock)
+        """
+        while self._idle:
+            pooled = self._idle.pop()
+            if self._expired(pooled, now):
+                self._size -= 1
+                expired.append(pooled)
+                continue
+            return pooled
+        return None
+
+    def _close_all(self, connections, event):
+        for pooled in connections:
+            metrics.db_pool_connections.inc(self.name, event)
+            try:
+                self.close_connection(pooled.connection)
+            except Exception:  # a broken connection may fail to close, it's dropped anyway
+                pass
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def borrow(self):
+        """
+        returns a healthy connection, an idle one if any
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+
+        while True:
+            expired = []
+            pooled = None
+            with self._cond:
+                self._check_fork()
+                while True:
+                    now = time.monotonic()
+                    pooled = self._take(now, expired)
+                    if pooled is not None or self._size < self.max_size:
+                        break
+                    if now >= deadline:
+                        metrics.db_pool_connections.inc(self.name, "timeout")
+                        raise PoolTimeout(f"No connection of {self.max_size} in pool '{self.name}' was "
+                                          f"available within {self.timeout}s.")
+                    self._cond.wait(deadline - now)
+                if pooled is None:
+                    # a free slot, opened outside lock
+                    self._size += 1
+            self._close_all(expired, "expired")
+            metrics.db_pool_wait.observe(time.monotonic() - started, self.name)
+
+            if pooled is None:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+                pooled = _PooledConnection(connection, time.monotonic())
+                metrics.db_pool_connections.inc(self.name, "opened")
+            elif time.monotonic() - pooled.returned >= self.check_after and not self._healthy(pooled):
+                self._close_all([pooled], "check_failed")
+                self._release_slot()
+                continue
+            else:
+                metrics.db_pool_connections.inc(self.name, "reused")
+
+            with self._cond:
+                self._borrowed[id(pooled.connection)] = pooled
+            return pooled.connection
+
+    def _healthy(self, pooled):
+        try:
+            return self.check(pooled.connection)
+        except Exception:  # any error of a health check means a broken connection
+            return False
+
+    def give_back(self, connection, discard=False):
+        """
+        returns a borrowed connection to pool, it's closed instead if discard
+        is True (e.g. it's broken) or it's too old
+        """
+        now = time.monotonic()
+        to_close = []
+        with self._cond:
+            self._check_fork()
+            pooled = self._borrowed.pop(id(connection), None)
+            if pooled is None:
+                # borrowed by parent process
+                _inherited_connections.append(connection)
+                return
+            if discard or self._expired(pooled, now):
+                self._size -= 1
+                to_close.append(pooled)
+                self._cond.notify()
+            else:
+                pooled.returned = now
+                self._idle.append(pooled)
+                self._cond.notify()
+
+            # least recently used connections idle for too long, keeping min_size open
+            while self._idle and self._size > self.min_size and now - self._idle[0].returned >= self.max_idle:
+                to_close.append(self._idle.popleft())
+                self._size -= 1
+
+        self._close_all(to_close, "closed")
+
+    def close(self):
+        """
+        closes all idle connections, e.g. before their database is dropped
+        """
+        with self._cond:
+            self._check_fork()
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        self._close_all(idle, "closed")
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, factory):
+    """
+    returns pool registered by key, created by factory() on first use
+    """
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = factory()
+        return _pools[key]
+
+
+def close_pools(predicate=lambda key: True):
+    """
+    This method closes idle connections of pools whose key satisfies predicate.
+    """
+    with _pools_lock:
+        pools = [pool for key, pool in _pools.items() if predicate(key)]
+    for pool in pools:
+        pool.close()
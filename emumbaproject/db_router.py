@@ -0,0 +1,193 @@
+"""
+    Contains database router sending selected reads to read replicas
+    ================================================================
+
+    Only reads made within replica_reads() (reports, task listings & the
+    reminder job) go to a replica, everything else, including every write,
+    goes to the primary (default database). A read within replica_reads()
+    goes to the primary instead when:
+
+    - no replica is configured (settings.DATABASE_REPLICAS),
+    - the user wrote within last settings.REPLICA_PIN_SECONDS seconds
+      (a shared cache key, so it holds across API processes & pods) or
+      earlier in the same request, so users read their own writes,
+    - every replica lags more than settings.REPLICA_MAX_LAG seconds behind
+      the primary (checked every settings.REPLICA_LAG_CHECK_INTERVAL
+      seconds per process) or can't be reached,
+    - it's made in a transaction of the primary.
+
+    State is kept in a context variable, set per authenticated request by
+    todofehrist.utility.login_required (user_routing).
+"""
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from emumbaproject import metrics
+
+logger = logging.getLogger(__name__)
+
+PIN_KEY_PREFIX = "db:pinned:"
+
+# seconds a replica's replay is behind, 0 while it has replayed all WAL it received
+REPLICA_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+
+class _Routing:
+    """
+        Routing state of a request or job
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.read_alias = None  # replica serving reads, None for primary
+        self.wrote = False
+
+
+_routing = contextvars.ContextVar("db_routing", default=None)
+
+_lags = {}  # replica alias -> (checked at, lag in seconds)
+_lags_lock = threading.Lock()
+
+
+def _pin_key(user_id):
+    return f"{PIN_KEY_PREFIX}{user_id}"
+
+
+@contextmanager
+def user_routing(user_id):
+    """
+    returns a context manager routing queries made within on behalf of a
+    user, whose writes pin them to primary
+    """
+    token = _routing.set(_Routing(user_id))
+    try:
+        yield
+    finally:
+        _routing.reset(token)
+
+
+def _measure_lag(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(REPLICA_LAG_SQL)
+            return float(cursor.fetchone()[0])
+    except DatabaseError as exception_:
+        logger.warning("Replica '%s' is unavailable: %s", alias, exception_)
+        return float("inf")
+
+
+def replica_lag(alias):
+    """
+    returns seconds replica alias lags behind primary, measured at most once
+    in settings.REPLICA_LAG_CHECK_INTERVAL seconds (infinite if it's unreachable)
+    """
+    now = time.monotonic()
+    with _lags_lock:
+        checked_at, lag = _lags.get(alias, (None, None))
+    if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+
+    lag = _measure_lag(alias)
+    with _lags_lock:
+        _lags[alias] = (now, lag)
+    return lag
+
+
+def _choose_replica(state):
+    """
+    returns alias of a replica reads of state can be served by, None for primary
+    """
+    if not settings.DATABASE_REPLICAS:
+        return None
+
+    if state.wrote or (state.user_id is not None and cache.get(_pin_key(state.user_id))):
+        metrics.db_read_routing.inc("primary", "pinned")
+        return None
+
+    replicas = [alias for alias in settings.DATABASE_REPLICAS if replica_lag(alias) <= settings.REPLICA_MAX_LAG]
+    if not replicas:
+        metrics.db_read_routing.inc("primary", "lag")
+        return None
+
+    metrics.db_read_routing.inc("replica", "ok")
+    return random.choice(replicas)
+
+
+@contextmanager
+def replica_reads():
+    """
+    returns a context manager (or decorator) sending reads made within to a
+    replica, when it's safe to (see module docstring)
+    """
+    state = _routing.get()
+    token = None
+    if state is None:
+        # e.g. a Celery task, no user to pin
+        state = _Routing(None)
+        token = _routing.set(state)
+
+    previous_alias = state.read_alias
+    state.read_alias = _choose_replica(state)
+    try:
+        yield
+    finally:
+        state.read_alias = previous_alias
+        if token is not None:
+            _routing.reset(token)
+
+
+class ReplicaRouter:
+    """
+        Database router sending reads within replica_reads() to a replica
+    """
+
+    def db_for_read(self, model, **hints):
+        """
+        returns replica chosen by replica_reads(), None (primary) otherwise
+        """
+        state = _routing.get()
+        if state is None or state.read_alias is None:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # reads of a transaction see its own writes
+            return None
+        return state.read_alias
+
+    def db_for_write(self, model, **hints):
+        """
+        returns None (primary), pinning current user to primary
+        """
+        state = _routing.get()
+        if state is None:
+            return None
+
+        # rest of request reads its own write
+        state.read_alias = None
+        if not state.wrote and state.user_id is not None:
+            state.wrote = True
+            cache.set(_pin_key(state.user_id), 1, settings.REPLICA_PIN_SECONDS)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """
+        replicas hold same rows as primary
+        """
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """
+        replicas are migrated by replication
+        """
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
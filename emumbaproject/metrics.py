@@ -0,0 +1,326 @@
+"""
+    Contains in-house metrics (counters & histograms) in Prometheus text format
+    ===========================================================================
+
+    Web & Celery worker processes record metrics in a process local registry
+    (a dict update under a lock). Every settings.METRICS_FLUSH_INTERVAL
+    seconds a background thread of a process stores its totals as a single
+    entry of the metrics cache (settings.METRICS_CACHE, an alias of its own,
+    so that metrics never evict login tokens, revocations or throttling
+    counters of the default cache) and registers it in an index. /metrics
+    (emumbaproject.views.MetricsView) served by any process sums entries of
+    all processes. A shared cache backend (Redis/Memcached) is needed for
+    that, the default local memory cache only has own process's.
+
+    Entries of processes which stopped flushing expire after
+    settings.METRICS_PROCESS_TTL seconds, which Prometheus sees as a
+    counter reset.
+"""
+import contextvars
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = "metrics:index"  # {process key: last flushed at}
+PROCESS_KEY_PREFIX = "metrics:process:"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Metric:
+    """
+        Base class of a named metric having fixed label names
+    """
+    type_ = None
+
+    def __init__(self, registry, name, help_, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        registry.metrics[name] = self
+
+    def _labels(self, labelvalues):
+        return tuple(zip(self.labelnames, (str(value) for value in labelvalues)))
+
+
+class Counter(Metric):
+    """
+        Monotonically increasing value
+    """
+    type_ = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        """
+        increments counter of given label values
+        """
+        self.registry.add(self.name, self._labels(labelvalues), amount)
+
+
+class Histogram(Metric):
+    """
+        Counts of observed values in cumulative buckets, with their sum & count
+    """
+    type_ = "histogram"
+
+    def __init__(self, registry, name, help_, labelnames, buckets):
+        super().__init__(registry, name, help_, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        """
+        records an observed value of given label values
+        """
+        labels = self._labels(labelvalues)
+        for bound in self.buckets:
+            if value <= bound:
+                self.registry.add(f"{self.name}_bucket", labels + (("le", str(bound)),), 1)
+        self.registry.add(f"{self.name}_bucket", labels + (("le", "+Inf"),), 1)
+        self.registry.add(f"{self.name}_sum", labels, value)
+        self.registry.add(f"{self.name}_count", labels, 1)
+
+
+class MetricsRegistry:
+    """
+        Process local metric values, flushed to (and rendered from) metrics cache
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._pid = None  # process values & flusher thread belong to
+        self._process_key = None
+
+    def counter(self, name, help_, labelnames=()):
+        """
+        returns a new Counter
+        """
+        return Counter(self, name, help_, labelnames)
+
+    def histogram(self, name, help_, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        returns a new Histogram
+        """
+        return Histogram(self, name, help_, labelnames, buckets)
+
+    def _check_process(self):
+        # called under lock, a forked process starts with no values & its own flusher
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._process_key = f"{PROCESS_KEY_PREFIX}{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex}"
+        self._values = {}
+        threading.Thread(target=self._flush_periodically, name="todofehrist-metrics-flush", daemon=True).start()
+
+    def add(self, sample_name, labels, amount):
+        """
+        adds amount to a sample (a metric's series) in process local values
+        """
+        with self._lock:
+            self._check_process()
+            key = (sample_name, labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def clear(self):
+        """
+        resets values of this process, e.g. between tests
+        """
+        with self._lock:
+            self._check_process()
+            self._values = {}
+
+    def _flush_periodically(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:  # an unavailable cache must not stop the flusher, next flush retries
+                logger.warning("Metrics couldn't be flushed.", exc_info=True)
+
+    def flush(self):
+        """
+        stores values of this process (totals since it started) in metrics
+        cache and registers it in index, called every settings.METRICS_FLUSH_INTERVAL
+        seconds by a background thread
+        """
+        with self._lock:
+            self._check_process()
+            values, process_key = dict(self._values), self._process_key
+
+        metrics_cache = caches[settings.METRICS_CACHE]
+        metrics_cache.set(process_key, values, settings.METRICS_PROCESS_TTL)
+
+        # re-registered by every flush, so an index lost (evicted) or overwritten
+        # by another process's concurrent update is complete again within an interval
+        now = time.time()
+        index = {key: flushed_at for key, flushed_at in (metrics_cache.get(INDEX_KEY) or {}).items()
+                 if now - flushed_at < settings.METRICS_PROCESS_TTL}
+        index[process_key] = now
+        metrics_cache.set(INDEX_KEY, index, None)
+
+    def render(self):
+        """
+        returns metrics of all processes in Prometheus text exposition format
+        """
+        self.flush()
+
+        metrics_cache = caches[settings.METRICS_CACHE]
+        index = metrics_cache.get(INDEX_KEY) or {}
+        processes = metrics_cache.get_many(list(index))
+
+        totals = {}
+        for values in processes.values():
+            for sample, amount in values.items():
+                totals[sample] = totals.get(sample, 0) + amount
+
+        samples = {}
+        for (sample_name, labels), value in totals.items():
+            samples.setdefault(sample_name, []).append((labels, value))
+
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_}")
+            suffixes = ("_bucket", "_sum", "_count") if metric.type_ == "histogram" else ("",)
+            for suffix in suffixes:
+                for labels, value in sorted(samples.get(metric.name + suffix, []), key=_sort_key):
+                    label_text = ",".join(f'{name}="{_escape(label)}"' for name, label in labels)
+                    label_text = f"{{{label_text}}}" if label_text else ""
+                    value_text = repr(int(value)) if float(value).is_integer() else repr(value)
+                    lines.append(f"{metric.name}{suffix}{label_text} {value_text}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sort_key(item):
+    labels, _ = item
+    # buckets in ascending order of their upper bound
+    return tuple((name, float(value) if name == "le" else value) for name, value in labels)
+
+
+class QueryCounter:
+    """
+        Count of queries & their time, counted by queries_counted()
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def add(self, duration):
+        """
+        counts a query taking duration seconds
+        """
+        self.count += 1
+        self.duration += duration
+
+
+# counters of queries made in current context, a tuple as counting may be nested
+_query_counters = contextvars.ContextVar("query_counters", default=())
+
+
+def _count_query(execute, sql, params, many, context):
+    """
+    database execute wrapper adding queries to counters of current context
+    """
+    counters = _query_counters.get()
+    if not counters:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for counter in counters:
+            counter.add(duration)
+
+
+def _install_query_counting(connection):
+    # first in the list, execute_wrapper() blocks pop the last one on exit
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_query)
+
+
+@receiver(connection_created)
+def install_query_counting(sender, connection, **kwargs):
+    """
+    This method installs query counting on connections opened by any thread
+    """
+    _install_query_counting(connection)
+
+
+@contextmanager
+def queries_counted(counter):
+    """
+    returns a context manager counting queries of all database connections
+    made in current context, which includes threads the context is copied to
+    (asgiref's sync_to_async, todofehrist.async_views.run_in_db_thread)
+    """
+    for connection in connections.all():
+        _install_query_counting(connection)
+    token = _query_counters.set(_query_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _query_counters.reset(token)
+
+
+registry = MetricsRegistry()
+
+REQUEST_LABELS = ("route", "method", "status")
+TASK_LABELS = ("task", "state")
+
+request_duration = registry.histogram("todofehrist_http_request_duration_seconds",
+                                      "Time taken by a request.", REQUEST_LABELS)
+request_db_queries = registry.histogram("todofehrist_http_request_db_queries",
+                                        "Database queries made by a request.", REQUEST_LABELS, QUERY_COUNT_BUCKETS)
+request_db_duration = registry.counter("todofehrist_http_request_db_duration_seconds_total",
+                                       "Time taken by database queries of requests.", REQUEST_LABELS)
+response_size = registry.histogram("todofehrist_http_response_size_bytes",
+                                   "Size of response body.", REQUEST_LABELS, SIZE_BUCKETS)
+cache_requests = registry.counter("todofehrist_cache_requests_total",
+                                  "Lookups of application caches.", ("cache", "result"))
+db_pool_wait = registry.histogram("todofehrist_db_pool_wait_seconds",
+                                  "Time taken to borrow a pooled database connection.", ("database",))
+db_pool_connections = registry.counter("todofehrist_db_pool_connections_total",
+                                       "Pooled database connections opened, reused, closed, expired, failing "
+                                       "health check and borrows timed out.", ("database", "event"))
+db_read_routing = registry.counter("todofehrist_db_read_routing_total",
+                                   "Replica eligible reads routed to a replica or, pinned after a write or "
+                                   "replicas lagging, to primary.", ("target", "reason"))
+request_log_dropped = registry.counter("todofehrist_request_log_dropped_total",
+                                      "Request log records dropped as request log queue was full.")
+task_duration = registry.histogram("todofehrist_celery_task_duration_seconds",
+                                   "Time taken by a Celery task.", TASK_LABELS)
+task_db_queries = registry.histogram("todofehrist_celery_task_db_queries",
+                                     "Database queries made by a Celery task.", TASK_LABELS, QUERY_COUNT_BUCKETS)
+task_db_duration = registry.counter("todofehrist_celery_task_db_duration_seconds_total",
+                                    "Time taken by database queries of Celery tasks.", TASK_LABELS)
+
+
+def record_cache_lookup(cache_name, hit):
+    """
+    This method counts a lookup of an application cache as hit or miss.
+    """
+    cache_requests.inc(cache_name, "hit" if hit else "miss")
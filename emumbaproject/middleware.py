@@ -1,26 +1,160 @@
 """
     Contains all custom middleware classes written for todofehrist app.
+    Both are sync & async capable, so that async views served by ASGI
+    (see todofehrist.async_views) aren't switched to a thread by them.
 """
+import asyncio
 import logging
+import random
+import time
 
+from django.conf import settings
 
-class LoggingRequestResponse:
+from emumbaproject import metrics
+
+request_logger = logging.getLogger("emumbaproject.requests")
+
+
+def _cap(value):
     """
-        This class is implements functionality to log all requests
-        and responses to/from todofehrist RESTful endpoints.
+    returns value cut to settings.REQUEST_LOG_FIELD_MAX_LENGTH characters
     """
+    if value is not None and len(value) > settings.REQUEST_LOG_FIELD_MAX_LENGTH:
+        return value[:settings.REQUEST_LOG_FIELD_MAX_LENGTH]
+    return value
+
+
+class SyncAndAsyncMiddleware:
+    """
+        Base class of a middleware called either synchronously or, in an
+        async middleware chain, as a coroutine (like Django's MiddlewareMixin)
+    """
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # marks instance as a coroutine function for Django's handler
+            self._is_coroutine = asyncio.coroutines._is_coroutine
 
     def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.call(request)
+
+    def call(self, request):
+        """
+        handles a request synchronously
+        """
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        """
+        handles a request in an async middleware chain
+        """
+        raise NotImplementedError
+
+
+class LoggingRequestResponse(SyncAndAsyncMiddleware):
+    """
+        This class is implements functionality to log all requests
+        and responses to/from todofehrist RESTful endpoints, as compact
+        structured records (see emumbaproject.request_logging).
+    """
+
+    @staticmethod
+    def sampled(route, status_code):
+        """
+        returns True if a request is to be logged as per its route's sample
+        rate (settings.REQUEST_LOG_SAMPLE_RATES), server errors are always logged
+        """
+        if status_code >= 500:
+            return True
+
+        rate = settings.REQUEST_LOG_SAMPLE_RATES.get(route, settings.REQUEST_LOG_DEFAULT_SAMPLE_RATE)
+        return rate >= 1 or random.random() < rate
+
+    def call(self, request):
         """
         This method will be invoked by django for every request.
-        It will log request and corresponding response to default
-        root logger (set in Settings.py)
+        It will log request and corresponding response to
+        'emumbaproject.requests' logger (set in Settings.py)
         """
+        started = time.perf_counter()
         response = self.get_response(request)
+        self.log(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        # records are written by a background thread, logging doesn't block
+        self.log(request, response, time.perf_counter() - started)
+        return response
+
+    def log(self, request, response, latency):
+        """
+        logs a sampled request & its response
+        """
+        resolver_match = getattr(request, "resolver_match", None)
+        route = resolver_match.route if resolver_match else None
+        if not request_logger.isEnabledFor(logging.INFO) or not self.sampled(route, response.status_code):
+            return
+
+        if response.streaming:
+            response_bytes = int(response["Content-Length"]) if response.has_header("Content-Length") else None
+        else:
+            response_bytes = len(response.content)
 
-        logging.info({"request": request.__dict__, "response": response.__dict__})
+        content_length = request.META.get("CONTENT_LENGTH") or ""
+        request_logger.info({
+            "method": request.method,
+            "path": _cap(request.get_full_path()),
+            "route": _cap(route),
+            "status": response.status_code,
+            "user_id": getattr(request, "todofehrist_user_id", None),
+            "latency_ms": round(latency * 1000, 2),
+            "request_bytes": int(content_length) if content_length.isdigit() else 0,
+            "response_bytes": response_bytes,
+        })
 
+
+class MetricsMiddleware(SyncAndAsyncMiddleware):
+    """
+        This class records latency, database queries & time and response
+        size of every request per route, method & status (see emumbaproject.metrics).
+    """
+
+    def call(self, request):
+        counter = metrics.QueryCounter()
+        started = time.perf_counter()
+        with metrics.queries_counted(counter):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, counter)
+        return response
+
+    async def __acall__(self, request):
+        counter = metrics.QueryCounter()
+        started = time.perf_counter()
+        # queries of views' database threads are counted too, they run in a copy of this context
+        with metrics.queries_counted(counter):
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, counter)
         return response
+
+    @staticmethod
+    def record(request, response, latency, counter):
+        """
+        records metrics of a request
+        """
+        resolver_match = getattr(request, "resolver_match", None)
+        labels = (resolver_match.route if resolver_match else "unmatched", request.method, response.status_code)
+
+        metrics.request_duration.observe(latency, *labels)
+        metrics.request_db_queries.observe(counter.count, *labels)
+        metrics.request_db_duration.inc(*labels, amount=counter.duration)
+        if not response.streaming:
+            metrics.response_size.observe(len(response.content), *labels)
+        elif response.has_header("Content-Length"):
+            metrics.response_size.observe(int(response["Content-Length"]), *labels)
@@ -0,0 +1,121 @@
+"""
+    Contains PostgreSQL database backend borrowing connections from a pool
+    ======================================================================
+
+    Django's postgresql backend, except that a connection is borrowed from
+    a per process pool (emumbaproject.db_pool) on connect and given back to
+    it on close, i.e. at the end of every request & Celery task (keep
+    CONN_MAX_AGE at 0). Pool is configured by "POOL" of a DATABASES entry:
+
+        "POOL": {"MIN_SIZE": 2, "MAX_SIZE": 20, "MAX_LIFETIME": 1800,
+                 "MAX_IDLE": 300, "CHECK_AFTER": 30, "TIMEOUT": 10}
+
+    A given back connection is rolled back if it's in a transaction and
+    discarded if it's broken, so a borrower always starts from a clean
+    session.
+"""
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base, creation
+from django.utils.asyncio import async_unsafe
+
+from emumbaproject.db_pool import ConnectionPool, PoolTimeout, close_pools, get_pool
+
+POOL_DEFAULTS = {"MIN_SIZE": 0, "MAX_SIZE": 10, "MAX_LIFETIME": 30 * 60, "MAX_IDLE": 5 * 60,
+                 "CHECK_AFTER": 30, "TIMEOUT": 10}
+
+
+def _connect(conn_params):
+    connection = psycopg2.connect(**conn_params)
+    # as Django's backend does, see DatabaseWrapper.get_new_connection
+    psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+    return connection
+
+
+def _check(connection):
+    if connection.closed:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    if not connection.autocommit:
+        connection.rollback()
+    return True
+
+
+def _close(connection):
+    connection.close()
+
+
+def close_database_pools(database_name):
+    """
+    This method closes idle pooled connections to a database, e.g. before it's dropped.
+    """
+    close_pools(lambda key: key[1] == database_name)
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """
+        PostgreSQL test database creation, closing pooled connections to a
+        test database before it's dropped or cloned
+    """
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_database_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        close_database_pools(self.connection.settings_dict["NAME"])
+        super()._clone_test_db(suffix, verbosity, keepdb)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+        PostgreSQL backend borrowing connections from a pool
+    """
+    creation_class = DatabaseCreation
+    connection_pool = None
+
+    def pool(self, conn_params):
+        """
+        returns pool of connections opened with conn_params
+        """
+        key = (self.alias, conn_params["database"], repr(sorted(conn_params.items())))
+        options = {**POOL_DEFAULTS, **self.settings_dict.get("POOL", {})}
+
+        return get_pool(key, lambda: ConnectionPool(
+            lambda: _connect(conn_params), _check, _close, name=self.alias,
+            min_size=options["MIN_SIZE"], max_size=options["MAX_SIZE"], max_lifetime=options["MAX_LIFETIME"],
+            max_idle=options["MAX_IDLE"], check_after=options["CHECK_AFTER"], timeout=options["TIMEOUT"]))
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        self.connection_pool = self.pool(conn_params)
+        try:
+            connection = self.connection_pool.borrow()
+        except PoolTimeout as error:
+            raise psycopg2.OperationalError(str(error)) from error
+
+        # as base.DatabaseWrapper.get_new_connection does for a new connection
+        self.isolation_level = self.settings_dict["OPTIONS"].get(
+            "isolation_level", psycopg2.extensions.ISOLATION_LEVEL_DEFAULT)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+
+        connection = self.connection
+        try:
+            if connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # e.g. closed in an atomic block, TRANSACTION_STATUS_UNKNOWN if broken
+                connection.rollback()
+            # after a database error, only a connection passing health check is reused
+            discard = bool(connection.closed) or (self.errors_occurred and not _check(connection))
+        except psycopg2.Error:
+            discard = True
+
+        with self.wrap_database_errors:
+            self.connection_pool.give_back(connection, discard=discard)
@@ -0,0 +1,67 @@
+"""
+    Contains non blocking, structured request log pipeline
+    ======================================================
+
+    emumbaproject.middleware.LoggingRequestResponse logs a small dict per
+    request to 'emumbaproject.requests' logger. Its QueueFileHandler puts
+    records in a bounded queue and returns, a background (QueueListener)
+    thread formats them as JSON lines and writes them to file. Records are
+    dropped instead of blocking requests when queue is full, they're counted
+    by todofehrist_request_log_dropped_total metric (see emumbaproject.metrics).
+"""
+import atexit
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+class JSONFormatter(logging.Formatter):
+    """
+        Formats a record having a dict message as single line JSON
+    """
+
+    def format(self, record):
+        fields = {"time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"), "level": record.levelname}
+        if isinstance(record.msg, dict):
+            fields.update(record.msg)
+        else:
+            fields["message"] = record.getMessage()
+        return json.dumps(fields, default=str, separators=(",", ":"))
+
+
+class QueueFileHandler(QueueHandler):
+    """
+        Handler queueing records for a background thread writing them to file
+    """
+
+    def __init__(self, filename, maxsize=10000):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.dropped = 0
+
+        file_handler = logging.FileHandler(filename, delay=True)
+        file_handler.setFormatter(JSONFormatter())
+        self.listener = QueueListener(self.queue, file_handler)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        # message (a fresh dict) is formatted by writer thread, not request's thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            from emumbaproject import metrics
+
+            self.dropped += 1
+            metrics.request_log_dropped.inc()
+
+    def close(self):
+        if self.listener is not None:
+            listener, self.listener = self.listener, None
+            listener.stop()  # writes queued records
+            for handler in listener.handlers:
+                handler.close()
+        super().close()
@@ -26,12 +26,27 @@ env_config = [
         EnvVar("DB_PASSWORD", str),
         EnvVar("DB_PORT", int),
         EnvVar("DB_TEST_NAME", str, optional=True, default="testdb_todofehrist"),
+        EnvVar("DB_POOL_MIN_SIZE", int, optional=True, default=2),
+        EnvVar("DB_POOL_MAX_SIZE", int, optional=True, default=20),
+        EnvVar("DB_REPLICA_HOSTS", list, optional=True, default=[], separator=","),
         EnvVar("EMAIL_HOST", str),
         EnvVar("EMAIL_HOST_USER", str),
         EnvVar("EMAIL_HOST_PASSWORD", str),
         EnvVar("EMAIL_PORT", int),
         EnvVar("GOOGLE_OAUTH_CLIENT_ID", str),
         EnvVar("BROKER_URL", str),
+        EnvVar("LOGIN_TOKEN_MODE", str, optional=True, default="database", choices=["database", "signed"]),
+        EnvVar("CACHE_BACKEND", str, optional=True, default="django.core.cache.backends.locmem.LocMemCache"),
+        EnvVar("CACHE_LOCATION", str, optional=True, default=""),
+        EnvVar("METRICS_CACHE_LOCATION", str, optional=True, default="metrics"),
+        EnvVar("MEDIA_DOWNLOAD_OFFLOAD", str, optional=True, default="none",
+               choices=["none", "x-accel-redirect", "x-sendfile"]),
+        EnvVar("REQUEST_LOG_FILE", str, optional=True, default="todofehrist_requests.log"),
+        EnvVar("ASYNC_VIEWS", bool, optional=True, default=False),
+        EnvVar("ASYNC_DB_THREADS", int, optional=True, default=16),
+        EnvVar("PASSWORD_HASHING_EXECUTOR", str, optional=True, default="process",
+               choices=["process", "thread", "inline"]),
+        EnvVar("PASSWORD_HASHING_WORKERS", int, optional=True, default=2),
     ]
 
 # Get Env Values as class objects
@@ -41,6 +56,18 @@ env_parser = EnvParser(env_config).all
 LOG_FILE = env_parser.LOG_FILE
 LOG_LEVEL = env_parser.LOG_LEVEL
 
+# Request logs, JSON lines written by a background thread (see emumbaproject.request_logging)
+REQUEST_LOG_FILE = env_parser.REQUEST_LOG_FILE
+REQUEST_LOG_QUEUE_SIZE = 10000  # records waiting to be written, more are dropped
+REQUEST_LOG_DEFAULT_SAMPLE_RATE = 1.0  # fraction of requests logged
+REQUEST_LOG_SAMPLE_RATES = {}  # per route sample rate, e.g. {"api/v1/tasks": 0.1}
+REQUEST_LOG_FIELD_MAX_LENGTH = 256  # characters of path/route logged
+
+# Metrics served on /metrics, see emumbaproject.metrics
+METRICS_CACHE = 'metrics'  # alias in CACHES, kept apart from login tokens & throttling counters of default
+METRICS_FLUSH_INTERVAL = 10  # seconds, a background thread of a process stores its metrics in METRICS_CACHE this often
+METRICS_PROCESS_TTL = 60*60  # seconds, metrics of a process which stopped flushing (e.g. exited) are kept
+
 # Logging Configuration
 LOGGING = {
     "version": 1,
@@ -53,6 +80,12 @@ LOGGING = {
             "filename": LOG_FILE,
             "formatter": "app",
         },
+        "requests": {
+            "level": "INFO",
+            "class": "emumbaproject.request_logging.QueueFileHandler",
+            "filename": REQUEST_LOG_FILE,
+            "maxsize": REQUEST_LOG_QUEUE_SIZE,
+        },
     },
     "loggers": {
         "django": {
@@ -60,6 +93,11 @@ LOGGING = {
             "level": "INFO",
             "propagate": True
         },
+        "emumbaproject.requests": {
+            "handlers": ["requests"],
+            "level": "INFO",
+            "propagate": False
+        },
     },
     "formatters": {
         "app": {
@@ -103,6 +141,7 @@ INSTALLED_APPS = [
 INSTALLED_APPS = INSTALLED_APPS + MY_APPS
 
 MIDDLEWARE = [
+    'emumbaproject.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,7 +176,8 @@ WSGI_APPLICATION = 'emumbaproject.wsgi.application'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 DATABASES = {
     'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            # django's postgresql backend borrowing connections from a pool
+            'ENGINE': 'emumbaproject.pooled_postgresql',
             'HOST': env_parser.DB_HOST,
             'NAME': env_parser.DB_NAME,
             'USER': env_parser.DB_USER,
@@ -145,10 +185,55 @@ DATABASES = {
             'PORT': env_parser.DB_PORT,
             'TEST': {
                 'NAME': env_parser.DB_TEST_NAME
-            }
+            },
+            # per process, see emumbaproject.db_pool (keep CONN_MAX_AGE at 0, connections
+            # are given back to pool at the end of every request & Celery task)
+            'POOL': {
+                'MIN_SIZE': env_parser.DB_POOL_MIN_SIZE,  # idle connections kept open
+                'MAX_SIZE': env_parser.DB_POOL_MAX_SIZE,  # open connections, borrowers wait beyond
+                'MAX_LIFETIME': 30*60,  # seconds, older connections are closed when given back
+                'MAX_IDLE': 5*60,  # seconds, idle connections beyond MIN_SIZE are closed afterwards
+                'CHECK_AFTER': 30,  # seconds idle, after which a borrowed connection is health checked
+                'TIMEOUT': 10,  # seconds a borrower waits for a connection
+            },
     }
 }
 
+# Read replicas (streaming replicas of default, same name & credentials), serving reads
+# of reports, task listings & reminder job, see emumbaproject.db_router
+DATABASE_REPLICAS = []
+for replica_number, replica_host in enumerate(env_parser.DB_REPLICA_HOSTS, start=1):
+    DATABASE_REPLICAS.append(f'replica_{replica_number}')
+    DATABASES[f'replica_{replica_number}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        # tests read from default
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['emumbaproject.db_router.ReplicaRouter']
+REPLICA_PIN_SECONDS = 10  # seconds a user reads from primary after a write, keep above
+# REPLICA_MAX_LAG + REPLICA_LAG_CHECK_INTERVAL
+REPLICA_MAX_LAG = 2  # seconds, lagging replicas aren't read from
+REPLICA_LAG_CHECK_INTERVAL = 5  # seconds, replica lag is measured at most once per process within
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Login tokens & revocation lists are shared across processes via this cache,
+# set CACHE_BACKEND/CACHE_LOCATION to a shared cache (e.g. memcached) in production.
+CACHES = {
+    'default': {
+        'BACKEND': env_parser.CACHE_BACKEND,
+        'LOCATION': env_parser.CACHE_LOCATION,
+    },
+    # metrics of all processes (see emumbaproject.metrics), a separate store
+    # (or at least key space) so that they never evict entries of default
+    METRICS_CACHE: {
+        'BACKEND': env_parser.CACHE_BACKEND,
+        'LOCATION': env_parser.METRICS_CACHE_LOCATION,
+        'KEY_PREFIX': 'metrics',
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -197,17 +282,74 @@ EMAIL_HOST_USER = env_parser.EMAIL_HOST_USER
 EMAIL_HOST_PASSWORD = env_parser.EMAIL_HOST_PASSWORD
 EMAIL_PORT = env_parser.EMAIL_PORT
 EMAIL_USE_TLS = True
+# Outbound email queue, see todofehrist.mail_queue
+EMAIL_BATCH_SIZE = 100  # emails sent by a worker task over one SMTP connection
+EMAIL_MAX_ATTEMPTS = 6  # an email is given up after failing these many times
+EMAIL_RETRY_BACKOFF = 30  # seconds, doubled after every failed attempt
+EMAIL_CLAIM_TIMEOUT = 10*60  # seconds, an email claimed by a worker which died sending it is sent again after
+EMAIL_RETENTION_TIME = 7*24*60*60  # seconds, sent & failed emails are removed after
 
 LOGIN_TOKEN_EXPIRY_TIME = 3600  # seconds
-REPORT_CACHE_TIME = 15*60  # seconds, 15 minutes
+# "database": opaque tokens stored in user_login table
+# "signed": HMAC signed tokens verified without database lookup
+LOGIN_TOKEN_MODE = env_parser.LOGIN_TOKEN_MODE
+TOKEN_CACHE_SIZE = 10000  # entries, per process
+TOKEN_CACHE_LOCAL_TTL = 30  # seconds, in-process tier (invalidated across processes by a shared cache marker)
+TOKEN_CACHE_SHARED_TTL = 300  # seconds, shared django cache tier
+REPORT_CACHE_TIME = 15*60  # seconds, per user report cache (see todofehrist.report_cache)
+
+# Password hashing & login throttling, see todofehrist.password_hashing & todofehrist.throttling
+PASSWORD_HASHING_EXECUTOR = env_parser.PASSWORD_HASHING_EXECUTOR  # "process", "thread" or "inline"
+PASSWORD_HASHING_WORKERS = env_parser.PASSWORD_HASHING_WORKERS  # processes (or threads) hashing, per web process
+PASSWORD_HASHING_MAX_PENDING = 32  # hashes waiting or running per web process, more get 429
+LOGIN_THROTTLE_EMAIL_RATE = (10, 5*60)  # attempts, seconds - per email login, signup or reset attempts
+LOGIN_THROTTLE_IP_RATE = (100, 5*60)  # attempts, seconds - per client IP
+CLIENT_IP_HEADER = None  # e.g. 'HTTP_X_FORWARDED_FOR' set by a trusted reverse proxy, REMOTE_ADDR if None
+CLIENT_IP_PROXIES = 1  # trusted reverse proxies appending to CLIENT_IP_HEADER, client IP is Nth from right
+SUBSCRIPTION_REGISTRY_TTL = 5*60  # seconds, reload interval of subscription types & limits
+TASK_BULK_MAX_OPERATIONS = 500  # per request to tasks/bulk
+
+# Task search, see todofehrist.search
+TASK_SEARCH_TRIGRAM_THRESHOLD = 0.3  # min title similarity for a fuzzy match (PostgreSQL)
+TASK_SEARCH_FUZZY_CUTOFF = 0.75  # min word similarity for a fuzzy match (in-process index)
+TASK_SEARCH_MAX_FALLBACK_RESULTS = 500  # max matches ranked by in-process index
+TASK_SEARCH_INDEX_VERSION_TTL = 24*60*60  # seconds, lifetime of index versions, in-process indexes are rebuilt at least this often
+
+# Reports, see todofehrist.models.UserDailyTaskRollup
+TASK_ROLLUP_REFRESH_BATCH = 5000  # max stale daily rollups recomputed by a periodic refresh
+
+FILE_UPLOAD_HANDLERS = [
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "todofehrist.storage.HashingFileUploadHandler",
+]
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "mediafiles"
+# Chunked uploads, see todofehrist.media
+MEDIA_UPLOADS_ROOT = MEDIA_ROOT / "uploads"  # part files of incomplete uploads
+MEDIA_BLOB_GRACE_TIME = 60*60  # seconds, unreferenced files are removed afterwards (see todofehrist.storage)
+MEDIA_UPLOAD_CHUNK_READ_SIZE = 64 * 1024  # bytes read from request stream at once
+MEDIA_UPLOAD_EXPIRY_TIME = 24*60*60  # seconds, incomplete uploads are removed afterwards
+MEDIA_UPLOAD_WRITE_LEASE = 15*60  # seconds, a chunk being written keeps other requests off its upload at most
+# Downloads, "none": streamed by django, "x-accel-redirect": by nginx, "x-sendfile": by apache/lighttpd
+MEDIA_DOWNLOAD_OFFLOAD = env_parser.MEDIA_DOWNLOAD_OFFLOAD
+MEDIA_ACCEL_REDIRECT_LOCATION = "/protected-media/"  # nginx internal location aliased to MEDIA_ROOT
+
+# Async serving under ASGI, see todofehrist.async_views
+ASYNC_VIEWS = env_parser.ASYNC_VIEWS  # serve task, file & report endpoints by async views
+ASYNC_DB_THREADS = env_parser.ASYNC_DB_THREADS  # threads (& database connections) running their queries
 
 CELERY_TIMEZONE = 'UTC'
+REMINDER_BATCH_SIZE = 500  # users reminded by a single subtask (over one SMTP connection)
 BROKER_URL = env_parser.BROKER_URL
 
 GOOGLE_OAUTH_CLIENT_ID = env_parser.GOOGLE_OAUTH_CLIENT_ID
+# Google id_token verification, see todofehrist.oauth
+GOOGLE_OAUTH_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_OAUTH_CERTS_TIMEOUT = 5  # seconds
+GOOGLE_OAUTH_CERTS_REFRESH_AHEAD = 5*60  # seconds before their expiry, certificates are refreshed in background
+GOOGLE_OAUTH_CERTS_MIN_REFETCH = 60  # seconds between refetches for unknown keys or after failed fetches
+GOOGLE_OAUTH_TOKEN_CACHE_SIZE = 10000  # verified id_tokens memoized per process
 
 DATETIME_FORMATS = ['%Y-%m-%dT%H:%M:%S.%fZ']
 
@@ -20,7 +20,7 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
-from emumbaproject.views import RootView
+from emumbaproject.views import RootView, MetricsView
 
 # OpenAPI/Swagger based REST API Doc
 SchemaView = get_schema_view(
@@ -48,6 +48,7 @@ urlpatterns = [
          name='schema-redoc'),
 
     path('', RootView.as_view()),
+    path('metrics', MetricsView.as_view()),
     path('admin/', admin.site.urls),
     path(f'{settings.API_URL}/', include('todofehrist.urls')),
 ]
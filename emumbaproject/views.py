@@ -1,10 +1,13 @@
 """
     Views containing for overall emumbaproject
 """
+from django.http import HttpResponse
 from rest_framework.views import APIView
 from rest_framework import status
 from rest_framework.response import Response
 
+from emumbaproject.metrics import registry
+
 
 class RootView(APIView):
     """
@@ -17,3 +20,16 @@ class RootView(APIView):
         """
 
         return Response({}, status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """
+        Contains get handler for /metrics, scraped by Prometheus
+    """
+
+    def get(self, request):
+        """
+        returns metrics of all web & worker processes in Prometheus text format
+        """
+
+        return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
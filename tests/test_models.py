@@ -0,0 +1,185 @@
+"""
+    Contains unit tests to test todofehrist app's models
+    ====================================================
+"""
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from todofehrist.media import remove_unreferenced_blobs
+from todofehrist.models import User, UserSubscriptionType, UserSubscriptionLimits, UserQuotaManagement, \
+    UserSubscriptionTypesEnum, Task, TaskMediaFiles, MediaBlob, UserTaskStatistics
+from todofehrist.models_utility import get_datetime_now
+from todofehrist.subscriptions import subscription_registry
+from todofehrist.utility import ReportSource, gen_report_tasks_status, gen_report_max_created_count_day_wise
+
+
+class TaskQuotaTest(TestCase):
+    """
+        Contains unit tests for task quota enforced by Task.save
+    """
+
+    def setUp(self):
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        self.limits = UserSubscriptionLimits.objects.create(subscription_type=subscription_type,
+                                                            max_allowed_tasks=2)
+        self.app_user = User.objects.create(email="task_quota@gmail.com", username="task_quota@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+
+    def create_task(self):
+        """
+        creates a task for app_user via Task.save
+        """
+        task = Task(user=self.app_user, title="title", description="description", due_datetime=get_datetime_now())
+        task.save()
+        return task
+
+    def test_registry_serves_limits_from_memory(self):
+        """
+        This method tests that limits are loaded once and reloaded when changed.
+        """
+
+        subscription_registry.limits(self.app_user.subscription_type_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(subscription_registry.limits(self.app_user.subscription_type_id).max_allowed_tasks, 2)
+
+        self.limits.max_allowed_tasks = 3
+        self.limits.save()
+        self.assertEqual(subscription_registry.limits(self.app_user.subscription_type_id).max_allowed_tasks, 3)
+
+    def test_task_quota(self):
+        """
+        This method tests that tasks can be created till quota is reached and again after a deletion.
+        """
+
+        first_task = self.create_task()
+        self.create_task()
+        self.assertEqual(UserQuotaManagement.objects.get(user=self.app_user).total_tasks, 2)
+
+        with self.assertRaises(ValueError):
+            self.create_task()
+        self.assertEqual(Task.objects.filter(user=self.app_user).count(), 2)
+
+        first_task.delete()
+        self.create_task()
+        self.assertEqual(UserQuotaManagement.objects.get(user=self.app_user).total_tasks, 2)
+
+
+class MediaBlobTest(TestCase):
+    """
+        Contains unit tests for content addressed (deduplicated) task files
+    """
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.PREMIUM.value, price=10, currency="USD")
+        UserSubscriptionLimits.objects.create(subscription_type=subscription_type, max_allowed_tasks=5)
+        self.app_user = User.objects.create(email="media_blob@gmail.com", username="media_blob@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+
+    def attach_file(self, content):
+        """
+        creates a task with a file of given content
+        """
+        task = Task(user=self.app_user, title="title", description="description", due_datetime=get_datetime_now())
+        task.save()
+        task_file = TaskMediaFiles(task=task, name="notes.txt")
+        task_file.file.save("notes.txt", ContentFile(content))
+        return task_file
+
+    def test_same_content_stored_once(self):
+        """
+        This method tests that files of same content share a blob until both are deleted.
+        """
+
+        first_file = self.attach_file(b"same content")
+        second_file = self.attach_file(b"same content")
+        self.assertEqual(first_file.file.name, second_file.file.name)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 2)
+
+        first_file.delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+
+        # cascaded delete releases blob too
+        second_file.task.delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 0)
+
+        path = second_file.file.path
+        os.utime(path, (0, 0))
+        with override_settings(MEDIA_BLOB_GRACE_TIME=0):
+            self.assertEqual(remove_unreferenced_blobs(), 1)
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class UserTaskStatisticsTest(TestCase):
+    """
+        Contains unit tests for incrementally maintained task statistics
+    """
+
+    def setUp(self):
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        UserSubscriptionLimits.objects.create(subscription_type=subscription_type, max_allowed_tasks=10)
+        self.app_user = User.objects.create(email="task_stats@gmail.com", username="task_stats@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+
+    def statistics(self):
+        """
+        returns counts of app_user's statistics row
+        """
+        return UserTaskStatistics.objects.filter(user=self.app_user).values(
+            "total_tasks", "complete_tasks", *UserTaskStatistics.WEEKDAY_FIELDS).get()
+
+    def test_statistics_follow_task_changes(self):
+        """
+        This method tests that statistics match a rebuild after creates, completion toggles & deletes.
+        """
+
+        tasks = []
+        for _ in range(3):
+            task = Task(user=self.app_user, title="title", description="description",
+                        due_datetime=get_datetime_now())
+            task.save()
+            tasks.append(task)
+
+        task = Task.objects.get(id=tasks[0].id)
+        task.completion_status = True
+        task.completion_datetime = get_datetime_now()
+        task.update()
+        Task.objects.get(id=tasks[1].id).delete()
+
+        self.assertEqual(gen_report_tasks_status(ReportSource(self.app_user)),
+                         {"tasks_summary": {"total": 2, "complete": 1, "incomplete": 1}})
+        weekday = tasks[0].created_datetime.strftime("%a")
+        self.assertEqual(gen_report_max_created_count_day_wise(ReportSource(self.app_user))["day_wise_tasks_creation"][weekday], 2)
+
+        maintained = self.statistics()
+        UserTaskStatistics.objects.filter(user=self.app_user).update(total_tasks=100)
+        call_command("rebuild_task_statistics", "--user", str(self.app_user.id), stdout=StringIO())
+        self.assertEqual(self.statistics(), maintained)
+
+    def test_statistics_of_existing_tasks(self):
+        """
+        This method tests that statistics are computed on first read for tasks created before them.
+        """
+
+        task = Task(user=self.app_user, title="title", description="description", due_datetime=get_datetime_now())
+        task.save()
+        UserTaskStatistics.objects.all().delete()
+
+        self.assertEqual(UserTaskStatistics.objects.for_user(self.app_user.id).total_tasks, 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(gen_report_tasks_status(ReportSource(self.app_user))["tasks_summary"]["total"], 1)
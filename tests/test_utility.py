@@ -0,0 +1,867 @@
+"""
+    Contains unit tests to test todofehrist app's utility methods
+    =============================================================
+"""
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+from smtplib import SMTPException
+from unittest import mock
+
+import requests
+import rsa
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import DatabaseError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from google.auth import crypt, jwt
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from emumbaproject.celery import start_task_metrics, record_task_metrics, refresh_daily_task_rollups
+from emumbaproject.db_pool import ConnectionPool, PoolTimeout
+from emumbaproject.db_router import ReplicaRouter, replica_reads, user_routing
+from emumbaproject.metrics import MetricsRegistry, registry as metrics_registry
+from emumbaproject.request_logging import QueueFileHandler
+from todofehrist.auth_tokens import resolve_token, local_token_cache, invalidate_token, make_signed_token, \
+    revoke_token, revoke_user_tokens
+from todofehrist.benchmark import compare_with_baseline, percentile
+from todofehrist.models import User, UserSubscriptionType, UserLogin, UserSubscriptionTypesEnum, \
+    UserSubscriptionLimits, Task, TaskReminderLog, OutboundEmail, UserTaskStatistics, UserDailyTaskRollup, MediaBlob
+from todofehrist.models_utility import get_datetime_now
+from todofehrist.reminders import reminder_batches, send_reminders
+from todofehrist.mail_queue import send_pending_emails
+from todofehrist.seeding import SEED_PASSWORD, seed
+from todofehrist.password_hashing import hash_password, verify_password, _get_executor
+from todofehrist.oauth import CertificateCache, GoogleTokenVerifier
+from todofehrist.utility import send_forgot_password_email, authenticate_oauth_token
+
+
+class TokenCacheTest(APITestCase):
+    """
+        Contains unit tests for cached token resolution used by login_required
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_token_cache.clear()
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        self.app_user = User.objects.create(email="token_cache@gmail.com", username="token_cache@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+        self.token = "token-cache-test-token"
+        UserLogin.objects.create(user=self.app_user, token=self.token)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=self.token)
+
+    def test_resolve_token_hits_database_once(self):
+        """
+        This method tests that a resolved token is served from cache afterwards.
+        """
+
+        with self.assertNumQueries(1):
+            entry = resolve_token(self.token)
+        self.assertEqual(entry.user_id, self.app_user.id)
+
+        local_token_cache.clear()  # shared tier must answer now
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_token(self.token), entry)
+
+    def test_invalidated_by_other_process(self):
+        """
+        This method tests that a token invalidated by another process isn't served from local cache.
+        """
+
+        self.assertIsNotNone(resolve_token(self.token))
+        UserLogin.objects.filter(token=self.token).delete()
+        # another process only clears its own local cache
+        with mock.patch.object(local_token_cache, "delete"):
+            invalidate_token(self.token)
+
+        self.assertIsNone(resolve_token(self.token))
+
+    def test_unknown_token(self):
+        """
+        This method tests resolution of a token which doesn't exist.
+        """
+
+        self.assertIsNone(resolve_token("unknown-token"))
+        self.assertIsNone(resolve_token(""))
+
+    def test_logout_invalidates_token(self):
+        """
+        This method tests that a token can't be used after logout even when it was cached.
+        """
+
+        self.assertIsNotNone(resolve_token(self.token))
+
+        response = self.client.post("/api/v1/auth/logout")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post("/api/v1/auth/logout")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_invalidates_rotated_token_after_commit(self):
+        """
+        This method tests that a token replaced by a new login is invalidated only once the new one is committed.
+        """
+
+        self.app_user.set_password("my_password")
+        self.app_user.save()
+        self.assertIsNotNone(resolve_token(self.token))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = APIClient().post(reverse("login"), {"email": self.app_user.email,
+                                                           "password": "my_password"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # a request racing the rotation could have cached the old token again till now
+        self.assertIsNotNone(resolve_token(self.token))
+
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(resolve_token(self.token))
+        self.assertEqual(resolve_token(json.loads(response.content)["payload"]["user"]["token"]).user_id, self.app_user.id)
+
+
+@override_settings(LOGIN_TOKEN_MODE="signed")
+class SignedTokenTest(APITestCase):
+    """
+        Contains unit tests for signed login tokens and their revocation
+    """
+
+    def setUp(self):
+        cache.clear()
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        self.app_user = User.objects.create(email="signed_token@gmail.com", username="signed_token@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+
+    def test_signed_token_verified_without_database(self):
+        """
+        This method tests that a signed token resolves to its user, its revocation read through cache.
+        """
+
+        token = make_signed_token(self.app_user)
+
+        with self.assertNumQueries(2):
+            entry = resolve_token(token)
+        self.assertEqual(entry.user_id, self.app_user.id)
+        self.assertEqual(entry.subscription_type_id, self.app_user.subscription_type_id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_token(token), entry)
+
+    def test_tampered_token(self):
+        """
+        This method tests that a token with modified payload isn't accepted.
+        """
+
+        token = make_signed_token(self.app_user)
+        self.assertIsNone(resolve_token("x" + token))
+
+    def test_revoked_token(self):
+        """
+        This method tests that a revoked token isn't accepted while others remain valid.
+        """
+
+        token, other_token = make_signed_token(self.app_user), make_signed_token(self.app_user)
+        revoke_token(token)
+
+        self.assertIsNone(resolve_token(token))
+        self.assertIsNotNone(resolve_token(other_token))
+
+        # revocations outlive cache evictions
+        cache.clear()
+        self.assertIsNone(resolve_token(token))
+
+    def test_revoked_user_tokens(self):
+        """
+        This method tests that all tokens issued before password reset are rejected.
+        """
+
+        token = make_signed_token(self.app_user)
+        revoke_user_tokens(self.app_user)
+
+        self.assertIsNone(resolve_token(token))
+        self.assertIsNotNone(resolve_token(make_signed_token(self.app_user)))
+
+        cache.clear()
+        self.assertIsNone(resolve_token(token))
+
+    def test_revocation_unavailable(self):
+        """
+        This method tests that a token is rejected when its revocation can't be checked.
+        """
+
+        token = make_signed_token(self.app_user)
+        with mock.patch("todofehrist.models.RevokedToken.objects.filter", side_effect=DatabaseError("down")):
+            self.assertIsNone(resolve_token(token))
+
+
+class TaskReminderTest(TestCase):
+    """
+        Contains unit tests for batched pending tasks reminders
+    """
+
+    def setUp(self):
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        UserSubscriptionLimits.objects.create(subscription_type=subscription_type, max_allowed_tasks=10)
+
+        self.day = timezone.localdate().isoformat()
+        for index, pending_tasks in enumerate((2, 1, 0)):
+            user = User.objects.create(email=f"reminder_{index}@gmail.com", username=f"reminder_{index}@gmail.com",
+                                       subscription_type=subscription_type, is_email_verified=True)
+            for _ in range(pending_tasks):
+                Task(user=user, title="title", description="description", due_datetime=get_datetime_now()).save()
+            # completed & later tasks aren't reminded
+            Task(user=user, title="title", description="description", due_datetime=get_datetime_now(),
+                 completion_status=True).save()
+            Task(user=user, title="title", description="description",
+                 due_datetime=get_datetime_now() + timezone.timedelta(days=2)).save()
+
+    def test_batches_sent_once(self):
+        """
+        This method tests that users with tasks due today are batched and reminded only once.
+        """
+
+        batches = list(reminder_batches(self.day, 1))
+        self.assertEqual([entry[1:] for batch in batches for entry in batch],
+                         [["reminder_0@gmail.com", 2], ["reminder_1@gmail.com", 1]])
+
+        self.assertEqual(send_reminders(self.day, batches[0]), 1)
+        # a retried batch skips already reminded users
+        self.assertEqual(send_reminders(self.day, batches[0] + batches[1]), 1)
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].body, "You have 2 pending tasks due today.")
+        self.assertEqual(TaskReminderLog.objects.count(), 2)
+
+    def test_batch_failing_midway(self):
+        """
+        This method tests that reminders sent before a batch fails are logged and the failed one isn't.
+        """
+
+        entries = [entry for batch in reminder_batches(self.day, 10) for entry in batch]
+        send = mock.Mock(side_effect=[1, SMTPException("unavailable")])
+
+        with mock.patch("django.core.mail.EmailMessage.send", send), self.assertRaises(SMTPException):
+            send_reminders(self.day, entries)
+
+        self.assertEqual(list(TaskReminderLog.objects.values_list("user", flat=True)), [entries[0][0]])
+        self.assertEqual(send_reminders(self.day, entries), 1)
+
+
+class MailQueueTest(TestCase):
+    """
+        Contains unit tests for queued outbound emails
+    """
+
+    def setUp(self):
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        self.app_user = User.objects.create(email="mail_queue@gmail.com", username="mail_queue@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+
+    def test_queued_email_sent_by_worker(self):
+        """
+        This method tests that an email is only queued by request and rendered & sent by worker.
+        """
+
+        send_forgot_password_email(self.app_user)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.PENDING)
+
+        self.assertEqual(send_pending_emails(), (1, False))
+        self.assertEqual(mail.outbox[0].to, ["mail_queue@gmail.com"])
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.context), (OutboundEmail.SENT, {}))
+
+    def test_email_claimed_before_sending(self):
+        """
+        This method tests that an email is claimed before, and marked sent right after, it is sent.
+        """
+
+        send_forgot_password_email(self.app_user)
+
+        def send(message):
+            self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.SENDING)
+            return 1
+
+        with mock.patch("django.core.mail.EmailMessage.send", autospec=True, side_effect=send):
+            self.assertEqual(send_pending_emails(), (1, False))
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.SENT)
+
+    def test_abandoned_email_reclaimed(self):
+        """
+        This method tests that an email claimed by a worker which died sending it is sent again.
+        """
+
+        send_forgot_password_email(self.app_user)
+        claimed = get_datetime_now() - timezone.timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT + 1)
+        OutboundEmail.objects.update(status=OutboundEmail.SENDING, claimed_datetime=claimed, attempts=1)
+
+        self.assertEqual(send_pending_emails(), (1, False))
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.SENT, 2))
+
+    def test_failed_email_retried_with_backoff(self):
+        """
+        This method tests that an email failing to send is retried later.
+        """
+
+        send_forgot_password_email(self.app_user)
+
+        with mock.patch("django.core.mail.EmailMessage.send", side_effect=SMTPException("unavailable")):
+            self.assertEqual(send_pending_emails(), (0, False))
+
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt_datetime, get_datetime_now())
+
+        # not due yet
+        self.assertEqual(send_pending_emails(), (0, False))
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class RequestLoggingTest(APITestCase):
+    """
+        Contains unit tests for structured, sampled request logs
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_token_cache.clear()
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        self.app_user = User.objects.create(email="request_log@gmail.com", username="request_log@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+        UserLogin.objects.create(user=self.app_user, token="request-log-token")
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="request-log-token")
+
+    def test_request_record(self):
+        """
+        This method tests fields of a logged request.
+        """
+
+        with self.assertLogs("emumbaproject.requests", level="INFO") as logs:
+            self.client.get("/api/v1/tasks", {"search": "x" * 300})
+
+        record = logs.records[0].msg
+        self.assertEqual((record["method"], record["route"], record["status"], record["user_id"]),
+                         ("GET", "api/v1/tasks", status.HTTP_200_OK, self.app_user.id))
+        self.assertEqual(len(record["path"]), 256)
+        self.assertGreater(record["response_bytes"], 0)
+
+    @override_settings(REQUEST_LOG_SAMPLE_RATES={"api/v1/tasks": 0})
+    def test_route_sampling(self):
+        """
+        This method tests that a route with 0 sample rate isn't logged.
+        """
+
+        with self.assertLogs("emumbaproject.requests", level="INFO") as logs:
+            self.client.get("/api/v1/tasks")
+            self.client.get("/api/v1/reports/", {"name": "tasks-status"})
+
+        self.assertEqual([record.msg["route"] for record in logs.records], ["api/v1/reports/"])
+
+    def test_queue_file_handler(self):
+        """
+        This method tests that queued records are written as JSON lines and dropped (and counted) when queue is full.
+        """
+
+        caches[settings.METRICS_CACHE].clear()
+        metrics_registry.clear()
+        filename = os.path.join(tempfile.mkdtemp(), "requests.log")
+        handler = QueueFileHandler(filename, maxsize=1)
+        handler.listener.stop()  # keep records in queue
+        logger = logging.getLogger("tests.request_logging")
+        logger.addHandler(handler)
+        logger.propagate = False
+        try:
+            logger.warning({"path": "/first"})
+            logger.warning({"path": "/second"})
+            self.assertEqual(handler.dropped, 1)
+            self.assertIn("todofehrist_request_log_dropped_total 1", metrics_registry.render().splitlines())
+        finally:
+            logger.removeHandler(handler)
+            handler.listener.start()
+            handler.close()
+
+        with open(filename) as file_handle:
+            self.assertEqual([json.loads(line)["path"] for line in file_handle], ["/first"])
+
+
+class FakeConnection:
+    """
+        Stand-in of a database connection for ConnectionPoolTest
+    """
+
+    def __init__(self):
+        self.healthy = True
+        self.closed = False
+
+
+class ConnectionPoolTest(TestCase):
+    """
+        Contains unit tests for pool of database connections
+    """
+
+    def make_pool(self, **kwargs):
+        """
+        returns a pool of FakeConnections, opened ones are kept in self.opened
+        """
+        self.opened = []
+
+        def connect():
+            self.opened.append(FakeConnection())
+            return self.opened[-1]
+
+        def close(connection):
+            connection.closed = True
+
+        return ConnectionPool(connect, lambda connection: connection.healthy, close, name="test", **kwargs)
+
+    def test_reuse_and_limits(self):
+        """
+        This method tests that given back connections are reused and borrowers wait for max_size.
+        """
+
+        pool = self.make_pool(max_size=2, timeout=0.05)
+        first = pool.borrow()
+        pool.give_back(first)
+        self.assertIs(pool.borrow(), first)
+
+        second = pool.borrow()
+        self.assertEqual((pool.size, len(self.opened)), (2, 2))
+        with self.assertRaises(PoolTimeout):
+            pool.borrow()
+
+        pool.give_back(second, discard=True)
+        self.assertTrue(second.closed)
+        self.assertIsNot(pool.borrow(), second)
+
+    def test_health_check_and_lifetime(self):
+        """
+        This method tests that broken, expired & long idle connections are replaced.
+        """
+
+        pool = self.make_pool(check_after=0)
+        connection = pool.borrow()
+        pool.give_back(connection)
+        connection.healthy = False
+        replacement = pool.borrow()
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+
+        pool = self.make_pool(max_lifetime=0)
+        connection = pool.borrow()
+        pool.give_back(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 0)
+
+        pool = self.make_pool(min_size=1, max_idle=0)
+        connections = [pool.borrow(), pool.borrow()]
+        for connection in connections:
+            pool.give_back(connection)
+        self.assertEqual((pool.size, pool.idle), (1, 1))
+
+    def test_forked_process(self):
+        """
+        This method tests that connections of a parent process are neither reused nor closed by a child.
+        """
+
+        pool = self.make_pool()
+        idle, borrowed = pool.borrow(), pool.borrow()
+        pool.give_back(idle)
+
+        with mock.patch("os.getpid", return_value=os.getpid() + 1):
+            self.assertNotIn(pool.borrow(), (idle, borrowed))
+            pool.give_back(borrowed)
+
+        self.assertFalse(idle.closed or borrowed.closed)
+        self.assertEqual(pool.size, 1)
+
+
+@override_settings(DATABASE_REPLICAS=["replica_1"], REPLICA_MAX_LAG=2, REPLICA_PIN_SECONDS=10)
+class ReplicaRouterTest(TransactionTestCase):
+    """
+        Contains unit tests for routing reads to read replicas
+        (reads within TestCase's transaction are routed to primary)
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+
+    def test_replica_reads(self):
+        """
+        This method tests that only reads within replica_reads() go to a replica.
+        """
+
+        with mock.patch("emumbaproject.db_router.replica_lag", return_value=0):
+            self.assertIsNone(self.router.db_for_read(Task))
+            with user_routing(1):
+                self.assertIsNone(self.router.db_for_read(Task))
+                with replica_reads():
+                    self.assertEqual(self.router.db_for_read(Task), "replica_1")
+                    with transaction.atomic():
+                        self.assertIsNone(self.router.db_for_read(Task))
+                self.assertIsNone(self.router.db_for_read(Task))
+
+            # reminder job, no user
+            with replica_reads():
+                self.assertEqual(self.router.db_for_read(Task), "replica_1")
+
+    def test_pinned_after_write(self):
+        """
+        This method tests that a user reads from primary after they write, in later requests too.
+        """
+
+        with mock.patch("emumbaproject.db_router.replica_lag", return_value=0):
+            with user_routing(1), replica_reads():
+                self.assertIsNone(self.router.db_for_write(Task))
+                self.assertIsNone(self.router.db_for_read(Task))
+
+            with user_routing(1), replica_reads():
+                self.assertIsNone(self.router.db_for_read(Task))
+
+            with user_routing(2), replica_reads():
+                self.assertEqual(self.router.db_for_read(Task), "replica_1")
+
+    def test_rollups_computed_on_primary(self):
+        """
+        This method tests that rollups built for a report within replica_reads() read tasks from primary.
+        """
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        UserSubscriptionLimits.objects.create(subscription_type=subscription_type, max_allowed_tasks=5,
+                                              allowed_files_per_task=1, max_file_size=10)
+        user = User.objects.create(email="replica_rollups@gmail.com", username="replica_rollups@gmail.com",
+                                   subscription_type=subscription_type)
+        Task.objects.create(user=user, title="title", description="description", due_datetime=get_datetime_now())
+        statistics = UserTaskStatistics.objects.for_user(user.id)
+
+        # replica_1 isn't a configured database, a query routed there would fail
+        with mock.patch("emumbaproject.db_router.replica_lag", return_value=0), user_routing(user.id), \
+                replica_reads():
+            rollups = UserDailyTaskRollup.objects.for_user(user.id, statistics=statistics)
+
+        self.assertEqual(sum(rollups.values_list("created_count", flat=True)), 1)
+
+    def test_first_report_read_from_primary(self):
+        """
+        This method tests that a user's first report reads statistics & rollups it builds from primary.
+        """
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        UserSubscriptionLimits.objects.create(subscription_type=subscription_type, max_allowed_tasks=5,
+                                              allowed_files_per_task=1, max_file_size=10)
+        user = User.objects.create(email="replica_report@gmail.com", username="replica_report@gmail.com",
+                                   subscription_type=subscription_type, is_email_verified=True)
+        UserLogin.objects.create(user=user, token="replica-report-token")
+        Task.objects.create(user=user, title="title", description="description", due_datetime=get_datetime_now())
+        UserTaskStatistics.objects.filter(user=user).delete()
+
+        # replica_1 isn't a configured database, routing decisions are recorded & queries made on primary
+        routed = []
+        db_for_read, db_for_write = ReplicaRouter.db_for_read, ReplicaRouter.db_for_write
+
+        def record_read(router, model, **hints):
+            routed.append(("read", model.__name__, db_for_read(router, model, **hints)))
+
+        def record_write(router, model, **hints):
+            routed.append(("write", model.__name__, db_for_write(router, model, **hints)))
+
+        with mock.patch("emumbaproject.db_router.replica_lag", return_value=0), \
+                mock.patch.object(ReplicaRouter, "db_for_read", record_read), \
+                mock.patch.object(ReplicaRouter, "db_for_write", record_write):
+            response = self.client.get("/api/v1/reports/", {"name": "tasks-status,max-created-count-day-wise"},
+                                       HTTP_AUTHORIZATION="replica-report-token")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)["payload"]["report"]["tasks_summary"]["total"], 1)
+        self.assertIn(("read", "UserTaskStatistics", "replica_1"), routed)
+        self.assertIn(("write", "UserTaskStatistics", None), routed)
+        first_write = next(index for index, (kind, _, _) in enumerate(routed) if kind == "write")
+        self.assertEqual([entry for entry in routed[first_write:] if entry[2] == "replica_1"], [])
+
+    def test_lagging_replica(self):
+        """
+        This method tests that reads go to primary when replicas lag behind or there are none.
+        """
+
+        with user_routing(1):
+            with mock.patch("emumbaproject.db_router.replica_lag", return_value=5), replica_reads():
+                self.assertIsNone(self.router.db_for_read(Task))
+
+            with override_settings(DATABASE_REPLICAS=[]), replica_reads():
+                self.assertIsNone(self.router.db_for_read(Task))
+
+
+class PasswordHashingTest(TestCase):
+    """
+        Contains unit tests for hashing passwords by a process pool
+    """
+
+    @override_settings(PASSWORD_HASHING_EXECUTOR="process", PASSWORD_HASHING_WORKERS=1)
+    def test_process_executor(self):
+        """
+        This method tests that hashes made by hashing processes verify passwords.
+        """
+
+        user = User(email="hashing@gmail.com", password=hash_password("my_password"))
+        self.assertTrue(user.check_password("my_password"))
+        self.assertTrue(verify_password(user, "my_password"))
+        self.assertFalse(verify_password(user, "wrong_password"))
+
+        # not forked from this process running threads
+        self.assertIn(_get_executor()._mp_context.get_start_method(), ("forkserver", "spawn"))
+
+
+class FakeCertsResponse:
+    """
+        Stand-in of a response of Google's certificate endpoint
+    """
+
+    def __init__(self, certs, headers):
+        self.certs = certs
+        self.headers = headers
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.certs
+
+
+class FakeCertsSession:
+    """
+        Stand-in of requests.Session serving locally generated certificates
+        (public keys), requests made are counted in self.fetches
+    """
+
+    def __init__(self, max_age=3600):
+        self.certs = {}
+        self.headers = {"Cache-Control": f"public, max-age={max_age}"}
+        self.failing = False
+        self.fetches = 0
+
+    def get(self, url, timeout=None):
+        self.fetches += 1
+        if self.failing:
+            raise requests.ConnectionError("unavailable")
+        return FakeCertsResponse(dict(self.certs), self.headers)
+
+
+class GoogleTokenVerifierTest(TestCase):
+    """
+        Contains unit tests for Google id_token verification against cached certificates
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.keys = {key_id: rsa.newkeys(1024) for key_id in ("key-1", "key-2")}
+
+    def make_verifier(self, max_age=3600, **kwargs):
+        """
+        returns a verifier of tokens for "client-id", self.session serves certificate of key-1
+        """
+        self.session = FakeCertsSession(max_age)
+        self.publish("key-1")
+        return GoogleTokenVerifier("client-id", CertificateCache("https://certs.test", self.session, **kwargs))
+
+    def publish(self, key_id):
+        self.session.certs[key_id] = self.keys[key_id][0].save_pkcs1().decode()
+
+    def make_token(self, key_id="key-1", audience="client-id", email="social@example.com"):
+        signer = crypt.RSASigner.from_string(self.keys[key_id][1].save_pkcs1().decode(), key_id=key_id)
+        now = int(time.time())
+        return jwt.encode(signer, {"iss": "https://accounts.google.com", "aud": audience, "email": email,
+                                   "iat": now, "exp": now + 3600}).decode()
+
+    def test_verify_memoized(self):
+        """
+        This method tests that certificates are fetched once and verified tokens are memoized.
+        """
+
+        verifier = self.make_verifier()
+        token = self.make_token()
+        with mock.patch("todofehrist.oauth.google_verifier", verifier):
+            self.assertEqual(authenticate_oauth_token("google", token)["email"], "social@example.com")
+            self.assertIsNone(authenticate_oauth_token("google", self.make_token(audience="other-client")))
+        self.assertEqual(self.session.fetches, 1)
+
+        self.session.failing = True
+        verifier.certificates.get = mock.Mock(side_effect=AssertionError("certificates used"))
+        self.assertEqual(verifier.verify(token)["email"], "social@example.com")
+
+    def test_refresh(self):
+        """
+        This method tests that expiring certificates are refreshed in background, and kept if that fails.
+        """
+
+        verifier = self.make_verifier(max_age=60, refresh_ahead=300, min_refetch=0)
+        verifier.verify(self.make_token(email="first@example.com"))
+
+        with mock.patch("threading.Thread.start", lambda thread: thread.run()):
+            self.publish("key-2")
+            verifier.verify(self.make_token(email="second@example.com"))
+            self.assertEqual(self.session.fetches, 2)
+            self.assertIn("key-2", verifier.certificates.get())
+
+            self.session.failing = True
+            self.assertEqual(verifier.verify(self.make_token(email="third@example.com"))["email"],
+                             "third@example.com")
+
+    def test_unknown_key(self):
+        """
+        This method tests that a token signed by a newly published key refetches certificates.
+        """
+
+        verifier = self.make_verifier(min_refetch=0)
+        verifier.verify(self.make_token())
+
+        self.publish("key-2")
+        self.assertEqual(verifier.verify(self.make_token("key-2"))["email"], "social@example.com")
+        self.assertEqual(self.session.fetches, 2)
+
+
+class MetricsTest(APITestCase):
+    """
+        Contains unit tests for metrics exposed on /metrics
+    """
+
+    def setUp(self):
+        cache.clear()
+        caches[settings.METRICS_CACHE].clear()
+        local_token_cache.clear()
+        metrics_registry.clear()
+
+    def test_histogram_rendering(self):
+        """
+        This method tests Prometheus text of a histogram & counter flushed by two processes.
+        """
+
+        for _ in range(2):  # a registry per process, sharing cache
+            registry = MetricsRegistry()
+            histogram = registry.histogram("test_duration_seconds", "Test duration.", ("route",), buckets=(0.1, 1))
+            counter = registry.counter("test_total", "Test total.", ("route",))
+            histogram.observe(0.5, "tasks")
+            counter.inc("tasks", amount=0.25)
+            registry.flush()
+
+        lines = registry.render().splitlines()
+        self.assertEqual(lines, [
+            "# HELP test_duration_seconds Test duration.",
+            "# TYPE test_duration_seconds histogram",
+            'test_duration_seconds_bucket{route="tasks",le="1"} 2',
+            'test_duration_seconds_bucket{route="tasks",le="+Inf"} 2',
+            'test_duration_seconds_sum{route="tasks"} 1',
+            'test_duration_seconds_count{route="tasks"} 2',
+            "# HELP test_total Test total.",
+            "# TYPE test_total counter",
+            'test_total{route="tasks"} 0.5',
+        ])
+
+    def test_request_metrics(self):
+        """
+        This method tests that a request's latency, queries & size are exposed per route.
+        """
+
+        self.client.get("/api/v1/tasks", HTTP_AUTHORIZATION="unknown-token")
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = response.content.decode().splitlines()
+        labels = 'route="api/v1/tasks",method="GET",status="401"'
+        self.assertIn(f"todofehrist_http_request_duration_seconds_count{{{labels}}} 1", lines)
+        # token looked up in database
+        self.assertIn(f"todofehrist_http_request_db_queries_sum{{{labels}}} 1", lines)
+        self.assertIn('todofehrist_cache_requests_total{cache="token_shared",result="miss"} 1', lines)
+
+    def test_task_metrics(self):
+        """
+        This method tests that a Celery task's time & queries are recorded by task signals.
+        """
+
+        start_task_metrics(task_id="task-metrics-test")
+        User.objects.count()
+        record_task_metrics(task_id="task-metrics-test", task=refresh_daily_task_rollups, state="SUCCESS")
+
+        lines = self.client.get("/metrics").content.decode().splitlines()
+        self.assertIn('todofehrist_celery_task_db_queries_sum{task="emumbaproject.celery.refresh_daily_task_rollups",'
+                      'state="SUCCESS"} 1', lines)
+
+
+class BenchmarkTest(TransactionTestCase):
+    """
+        Contains unit tests for benchmark seeding & result comparison
+        (seeding processes only see committed rows)
+    """
+
+    def test_seed(self):
+        """
+        This method tests that seeded users have tokens, tasks, statistics & media files.
+        """
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            seeded = seed(users=3, tasks_per_user=4, files_per_task=1, random_seed=1)
+
+            self.assertEqual((len(seeded.user_ids), seeded.tasks, seeded.files), (3, 12, 12))
+            self.assertEqual(UserLogin.objects.get(token=seeded.tokens[seeded.user_ids[0]]).user_id,
+                             seeded.user_ids[0])
+            self.assertEqual(UserTaskStatistics.objects.for_user(seeded.user_ids[0]).total_tasks, 4)
+            self.assertEqual(MediaBlob.objects.get().ref_count, 12)
+            self.assertTrue(User.objects.get(id=seeded.user_ids[0]).check_password(SEED_PASSWORD))
+
+    def test_seed_deterministic(self):
+        """
+        This method tests that same random seed seeds same tasks irrespective of chunking & processes.
+        """
+
+        def seeded_tasks(prefix):
+            return list(Task.objects.filter(user__email__startswith=f"seed-{prefix}").order_by(
+                "user__email", "id").values_list("title", "description", "completion_status", "files_count"))
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            seed(users=3, tasks_per_user=3, files_per_task=0.5, random_seed=7, chunk_size=2, prefix="a-")
+            call_command("seed_data", users=3, tasks_per_user=3, files_per_task=0.5, seed=7, chunk_size=2,
+                         prefix="b-", processes=4, stdout=io.StringIO())
+
+        self.assertEqual(len(seeded_tasks("a-")), 9)
+        self.assertEqual(seeded_tasks("a-"), seeded_tasks("b-"))
+
+    def test_compare_with_baseline(self):
+        """
+        This method tests that slower, lower throughput or more querying endpoints are regressions.
+        """
+
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 99), 5)
+
+        baseline = {"tasks_list": {"p95_ms": 10, "rps": 100, "queries_per_request": 3, "errors": 0},
+                    "reports": {"p95_ms": 10, "rps": 100, "queries_per_request": 3, "errors": 0}}
+        results = {"tasks_list": {"p95_ms": 11, "rps": 90, "queries_per_request": 3.2, "errors": 0},
+                   "reports": {"p95_ms": 13, "rps": 70, "queries_per_request": 4, "errors": 1},
+                   "login": {"p95_ms": 500, "rps": 1, "queries_per_request": 5, "errors": 0}}
+
+        regressions = compare_with_baseline(results, baseline, threshold=0.2)
+        self.assertEqual(len(regressions), 4)
+        self.assertTrue(all(regression.startswith("reports:") for regression in regressions))
@@ -2,13 +2,38 @@
     Contains unit tests to test todofehrist app's views
     ===================================================
 """
+import hashlib
+import io
 import json
-from django.urls import reverse
+import os
+import shutil
+import tempfile
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.urls import path, reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 
+from emumbaproject import metrics
+from todofehrist.async_views import AsyncTaskView, AsyncTaskMediaFileView
 from todofehrist.models import UserSubscriptionTypesEnum
-from todofehrist.models import User, UserSubscriptionType, UserLogin
+from todofehrist.auth_tokens import local_token_cache
+from todofehrist.models import User, UserSubscriptionType, UserLogin, Task, TaskMediaFiles, \
+    UserSubscriptionLimits, UserQuotaManagement, TaskMediaUpload, MediaBlob
+from todofehrist.media import UploadOffsetMismatch, write_chunk
+from todofehrist.models_utility import get_datetime_now
+from todofehrist.search import POSTGRESQL_SEARCH_BACKFILL, SEARCH_VERSION_KEY_PREFIX, InvertedIndex, \
+    inverted_index, uses_postgresql
+
+# endpoints served by async views (settings.ASYNC_VIEWS), see AsyncViewTest
+urlpatterns = [
+    path("api/v1/tasks", AsyncTaskView.as_view()),
+    path("api/v1/tasks/<task_id>/files/<file_id>", AsyncTaskMediaFileView.as_view()),
+]
 
 
 class SignupTest(APITestCase):
@@ -116,3 +141,749 @@ class LoginTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         expected_token = UserLogin.objects.get(user=self.app_user.id).token
         self.assertEqual(response_data["token"], expected_token)
+
+
+@override_settings(PASSWORD_HASHING_EXECUTOR="thread",
+                   PASSWORD_HASHERS=["django.contrib.auth.hashers.PBKDF2PasswordHasher",
+                                     "django.contrib.auth.hashers.MD5PasswordHasher"])
+class LoginThrottleTest(APITestCase):
+    """
+        Contains unit tests for offloaded password hashing & throttling of login route
+    """
+
+    def setUp(self):
+        cache.clear()
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        self.app_user = User.objects.create(email="throttled@gmail.com", username="throttled@gmail.com",
+                                            password=make_password("my_password", hasher="md5"),
+                                            subscription_type=subscription_type, is_email_verified=True)
+        self.credentials = {"email": "throttled@gmail.com", "password": "my_password"}
+
+    def test_rehash_on_login(self):
+        """
+        This method tests that a password hashed by an outdated hasher is rehashed on login.
+        """
+
+        response = self.client.post(reverse('login'), self.credentials)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.app_user.refresh_from_db()
+        self.assertEqual(identify_hasher(self.app_user.password).algorithm, "pbkdf2_sha256")
+        self.assertEqual(self.client.post(reverse('login'), self.credentials).status_code, status.HTTP_200_OK)
+
+    @override_settings(LOGIN_THROTTLE_EMAIL_RATE=(2, 60), LOGIN_THROTTLE_IP_RATE=(4, 60))
+    def test_throttled(self):
+        """
+        This method tests that attempts beyond per email & per IP rates are rejected before hashing.
+        """
+
+        wrong_credentials = {"email": "throttled@gmail.com", "password": "wrong_password"}
+        for _ in range(2):
+            self.assertEqual(self.client.post(reverse('login'), wrong_credentials).status_code,
+                             status.HTTP_404_NOT_FOUND)
+
+        response = self.client.post(reverse('login'), self.credentials)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertLessEqual(int(response["Retry-After"]), 60)
+
+        other_credentials = {"email": "other@gmail.com", "password": "my_password"}
+        self.assertEqual(self.client.post(reverse('login'), other_credentials).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.post(reverse('login'), other_credentials).status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(CLIENT_IP_HEADER="HTTP_X_FORWARDED_FOR", LOGIN_THROTTLE_IP_RATE=(1, 60))
+    def test_forged_forwarded_for(self):
+        """
+        This method tests that a client can't dodge per IP throttling by sending its own X-Forwarded-For entries.
+        """
+
+        credentials = {"email": "other@gmail.com", "password": "my_password"}
+        self.assertEqual(self.client.post(reverse('login'), credentials, HTTP_X_FORWARDED_FOR="1.1.1.1, 10.0.0.1")
+                         .status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.post(reverse('login'), credentials, HTTP_X_FORWARDED_FOR="2.2.2.2, 10.0.0.1")
+                         .status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_non_string_email(self):
+        """
+        This method tests that an email sent as another JSON type is answered as a wrong email.
+        """
+
+        response = self.client.post(reverse('login'), {"email": ["throttled@gmail.com"], "password": "my_password"},
+                                    format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(PASSWORD_HASHING_MAX_PENDING=0)
+    def test_hashing_busy(self):
+        """
+        This method tests that a login finding hashing executor full is rejected.
+        """
+
+        response = self.client.post(reverse('login'), self.credentials)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class TaskListTest(APITestCase):
+    """
+        Contains unit tests for tasks route (listing tasks with cursor pagination)
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_token_cache.clear()
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        self.app_user = User.objects.create(email="task_list@gmail.com", username="task_list@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+        UserLogin.objects.create(user=self.app_user, token="task-list-token")
+
+        Task.objects.bulk_create([Task(user=self.app_user, title=f"task {index}", description="description",
+                                       due_datetime=get_datetime_now()) for index in range(12)])
+        self.task_ids = list(Task.objects.filter(user=self.app_user).values_list("id", flat=True))
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="task-list-token")
+
+    def get_page(self, **params):
+        """
+        returns payload of tasks listing for given query params
+        """
+        response = self.client.get("/api/v1/tasks", {"page_size": 5, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)["payload"]
+
+    def test_cursor_pagination(self):
+        """
+        This method tests walking forward & backward through pages using cursors.
+        """
+
+        first_page = self.get_page(total="true")
+        self.assertEqual([task["id"] for task in first_page["tasks"]], self.task_ids[:5])
+        self.assertEqual((first_page["from"], first_page["to"], first_page["total"]), (1, 5, 12))
+        self.assertIsNone(first_page["prev"])
+
+        second_page = self.get_page(cursor=first_page["next"])
+        self.assertEqual([task["id"] for task in second_page["tasks"]], self.task_ids[5:10])
+        self.assertEqual((second_page["from"], second_page["to"], second_page["total"]), (6, 10, None))
+
+        last_page = self.get_page(cursor=second_page["next"])
+        self.assertEqual([task["id"] for task in last_page["tasks"]], self.task_ids[10:])
+        self.assertEqual((last_page["from"], last_page["to"]), (11, 12))
+        self.assertIsNone(last_page["next"])
+
+        previous_page = self.get_page(cursor=last_page["prev"])
+        self.assertEqual(previous_page["tasks"], second_page["tasks"])
+        self.assertEqual((previous_page["from"], previous_page["to"]), (6, 10))
+        self.assertEqual(self.get_page(cursor=previous_page["prev"])["tasks"], first_page["tasks"])
+
+    def test_invalid_cursor(self):
+        """
+        This method tests tasks listing with a malformed cursor.
+        """
+
+        response = self.client.get("/api/v1/tasks", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_files_query_count_per_page(self):
+        """
+        This method tests that files of a page's tasks are loaded in a single query.
+        (token lookup, tasks of page, files of page)
+        """
+
+        TaskMediaFiles.objects.bulk_create([TaskMediaFiles(task_id=task_id, name=f"file_{index}.pdf",
+                                                           file=f"file_{task_id}_{index}.pdf")
+                                            for task_id in self.task_ids for index in range(2)])
+
+        for page_size in (5, 10):
+            local_token_cache.clear()
+            cache.clear()
+            with self.assertNumQueries(3):
+                payload = self.get_page(page_size=page_size)
+            self.assertEqual(len(payload["tasks"]), page_size)
+            self.assertEqual([len(task["files"]) for task in payload["tasks"]], [2] * page_size)
+
+    def test_page_num_pagination(self):
+        """
+        This method tests offset based pagination kept for older clients.
+        """
+
+        payload = self.get_page(page_num=2)
+        self.assertEqual([task["id"] for task in payload["tasks"]], self.task_ids[5:10])
+        self.assertEqual((payload["from"], payload["to"], payload["total"]), (6, 10, 12))
+
+
+class TaskSearchTest(APITestCase):
+    """
+        Contains unit tests for tasks route with ?search (ranked full text search)
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_token_cache.clear()
+        inverted_index.clear()
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        self.app_user = User.objects.create(email="task_search@gmail.com", username="task_search@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+        UserLogin.objects.create(user=self.app_user, token="task-search-token")
+
+        Task.objects.bulk_create([
+            Task(user=self.app_user, title="Buy Groceries", description="milk and eggs",
+                 due_datetime=get_datetime_now()),
+            Task(user=self.app_user, title="Weekend", description="pick groceries for party",
+                 due_datetime=get_datetime_now()),
+            Task(user=self.app_user, title="Call plumber", description="kitchen sink",
+                 due_datetime=get_datetime_now()),
+        ])
+        if uses_postgresql():
+            # bulk_create skips Task.save, which sets search_vector
+            with connection.cursor() as cursor:
+                cursor.execute(POSTGRESQL_SEARCH_BACKFILL)
+        self.in_title, self.in_description, self.unrelated = Task.objects.filter(user=self.app_user).order_by("pk")
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="task-search-token")
+
+    def search(self, search_term):
+        """
+        returns ids of tasks found for search_term, in ranked order
+        """
+        response = self.client.get("/api/v1/tasks", {"search": search_term, "page_size": 10})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [task["id"] for task in json.loads(response.content)["payload"]["tasks"]]
+
+    def test_ranked_title_and_description_match(self):
+        """
+        This method tests that search covers description and ranks title matches first.
+        """
+
+        self.assertEqual(self.search("groceries"), [self.in_title.id, self.in_description.id])
+
+    def test_prefix_and_fuzzy_match(self):
+        """
+        This method tests case insensitive prefix & misspelled search terms.
+        """
+
+        self.assertEqual(self.search("GROC"), [self.in_title.id, self.in_description.id])
+        self.assertEqual(self.search("plumbr"), [self.unrelated.id])
+        self.assertEqual(self.search("nothing"), [])
+
+    def test_index_follows_task_update(self):
+        """
+        This method tests that updated task content is searchable.
+        """
+
+        self.assertEqual(self.search("plumber"), [self.unrelated.id])
+
+        self.unrelated.title = "Call electrician"
+        self.unrelated.update()
+
+        self.assertEqual(self.search("plumber"), [])
+        self.assertEqual(self.search("electrician"), [self.unrelated.id])
+
+    def test_index_follows_other_process_change(self):
+        """
+        This method tests that in-process index (other than PostgreSQL's) follows a task changed by another process.
+        """
+
+        index = InvertedIndex()
+        tasks = Task.objects.filter(user=self.app_user)
+        self.assertEqual(list(index.search(tasks, self.app_user.id, ["plumber"])), [self.unrelated.id])
+
+        # another process's Task.update, its in-process index hook ran there
+        Task.objects.filter(id=self.unrelated.id).update(title="Call electrician")
+        cache.set(f"{SEARCH_VERSION_KEY_PREFIX}{self.app_user.id}", "other-process")
+
+        self.assertEqual(index.search(tasks, self.app_user.id, ["plumber"]), {})
+        self.assertEqual(list(index.search(tasks, self.app_user.id, ["electrician"])), [self.unrelated.id])
+
+    def test_index_rebuilt_once_version_expired(self):
+        """
+        This method tests that in-process index built without a version is rebuilt once a version expires.
+        """
+
+        index = InvertedIndex()
+        tasks = Task.objects.filter(user=self.app_user)
+        version_key = f"{SEARCH_VERSION_KEY_PREFIX}{self.app_user.id}"
+        cache.delete(version_key)
+        self.assertEqual(list(index.search(tasks, self.app_user.id, ["plumber"])), [self.unrelated.id])
+        self.assertIsNotNone(cache.get(version_key))
+
+        # changed bypassing the hooks, seen after version set on search expired
+        Task.objects.filter(id=self.unrelated.id).update(title="Call electrician")
+        self.assertEqual(list(index.search(tasks, self.app_user.id, ["plumber"])), [self.unrelated.id])
+        cache.delete(version_key)
+
+        self.assertEqual(index.search(tasks, self.app_user.id, ["plumber"]), {})
+
+
+class TaskBulkTest(APITestCase):
+    """
+        Contains unit tests for tasks/bulk route
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_token_cache.clear()
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        UserSubscriptionLimits.objects.create(subscription_type=subscription_type, max_allowed_tasks=3)
+        self.app_user = User.objects.create(email="task_bulk@gmail.com", username="task_bulk@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+        UserLogin.objects.create(user=self.app_user, token="task-bulk-token")
+
+        self.task = Task(user=self.app_user, title="existing", description="description",
+                         due_datetime=get_datetime_now())
+        self.task.save()
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="task-bulk-token")
+
+    def post_operations(self, operations):
+        """
+        returns response of bulk route for given operations
+        """
+        return self.client.post("/api/v1/tasks/bulk", {"operations": operations}, format="json")
+
+    @staticmethod
+    def create_operation(title):
+        """
+        returns a create operation for a task with given title
+        """
+        return {"op": "create", "data": {"title": title, "description": "description",
+                                         "due_datetime": "2030-01-01T10:00:00.000000Z"}}
+
+    def test_bulk_operations(self):
+        """
+        This method tests creates, an update & a delete applied in one request.
+        """
+
+        response = self.post_operations([self.create_operation("first"),
+                                         {"op": "update", "id": self.task.id, "data": {"title": "updated"}},
+                                         self.create_operation("second")])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = json.loads(response.content)["payload"]["results"]
+        self.assertTrue(all(result["success"] for result in results))
+        self.assertEqual(Task.objects.get(id=results[0]["id"]).title, "first")
+        self.assertEqual(Task.objects.get(id=self.task.id).title, "updated")
+        self.assertEqual(UserQuotaManagement.objects.get(user=self.app_user).total_tasks, 3)
+
+        response = self.post_operations([{"op": "delete", "id": results[2]["id"]}, self.create_operation("third")])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(Task.objects.filter(user=self.app_user).values_list("title", flat=True)),
+                         ["first", "third", "updated"])
+
+    def test_invalid_operation_applies_nothing(self):
+        """
+        This method tests that no operation is applied when any of them is invalid.
+        """
+
+        response = self.post_operations([self.create_operation("first"),
+                                         {"op": "update", "id": 0, "data": {"title": "updated"}}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        results = json.loads(response.content)["payload"]["results"]
+        self.assertNotIn("errors", results[0])
+        self.assertIn("errors", results[1])
+        self.assertEqual(Task.objects.filter(user=self.app_user).count(), 1)
+
+    def test_quota_reserved_for_whole_batch(self):
+        """
+        This method tests that creates exceeding quota are rejected together.
+        """
+
+        response = self.post_operations([self.create_operation(f"task {index}") for index in range(3)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Task.objects.filter(user=self.app_user).count(), 1)
+        self.assertEqual(UserQuotaManagement.objects.get(user=self.app_user).total_tasks, 1)
+
+
+class TaskMediaUploadTest(APITestCase):
+    """
+        Contains unit tests for chunked uploads of task files
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_token_cache.clear()
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root,
+                                              MEDIA_UPLOADS_ROOT=os.path.join(media_root, "uploads"))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.PREMIUM.value, price=10, currency="USD")
+        UserSubscriptionLimits.objects.create(subscription_type=subscription_type, max_allowed_tasks=5,
+                                              allowed_files_per_task=2, max_file_size=20)
+        self.app_user = User.objects.create(email="task_upload@gmail.com", username="task_upload@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+        UserLogin.objects.create(user=self.app_user, token="task-upload-token")
+
+        self.task = Task(user=self.app_user, title="title", description="description",
+                         due_datetime=get_datetime_now())
+        self.task.save()
+        self.uploads_url = f"/api/v1/tasks/{self.task.id}/files/uploads"
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="task-upload-token")
+
+    def put_chunk(self, upload_id, content, start, size):
+        """
+        returns response of uploading a chunk
+        """
+        return self.client.put(f"{self.uploads_url}/{upload_id}", content,
+                               content_type="application/octet-stream",
+                               HTTP_CONTENT_RANGE=f"bytes {start}-{start + len(content) - 1}/{size}")
+
+    def test_chunked_upload(self):
+        """
+        This method tests an upload sent in two chunks, including a retried chunk.
+        """
+
+        response = self.client.post(self.uploads_url, {"name": "notes.txt", "size": 10}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        upload_id = json.loads(response.content)["payload"]["upload"]["id"]
+
+        self.assertEqual(self.put_chunk(upload_id, b"0123", 0, 10).status_code, status.HTTP_200_OK)
+        response = self.put_chunk(upload_id, b"0123", 0, 10)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(json.loads(response.content)["payload"]["upload"]["received"], 4)
+
+        response = self.client.post(f"{self.uploads_url}/{upload_id}/complete")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(self.put_chunk(upload_id, b"456789", 4, 10).status_code, status.HTTP_200_OK)
+        response = self.client.post(f"{self.uploads_url}/{upload_id}/complete")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        task_file = TaskMediaFiles.objects.get(task=self.task)
+        self.assertEqual(task_file.name, "notes.txt")
+        with task_file.file.open("rb") as file_handle:
+            self.assertEqual(file_handle.read(), b"0123456789")
+        self.assertFalse(TaskMediaUpload.objects.exists())
+
+    def test_concurrent_chunks_at_same_offset(self):
+        """
+        This method tests that a chunk written at an offset already written by another request is rejected.
+        """
+
+        response = self.client.post(self.uploads_url, {"name": "notes.txt", "size": 10}, format="json")
+        upload_id = json.loads(response.content)["payload"]["upload"]["id"]
+        first, second = TaskMediaUpload.objects.get(id=upload_id), TaskMediaUpload.objects.get(id=upload_id)
+
+        self.assertEqual(write_chunk(first, io.BytesIO(b"0123"), 0, 4), 4)
+        with self.assertRaises(UploadOffsetMismatch):
+            write_chunk(second, io.BytesIO(b"abcd"), 0, 4)
+
+        self.assertEqual(second.received, 4)
+        with open(first.part_path, "rb") as part_file:
+            self.assertEqual(part_file.read(), b"0123")
+
+    def test_chunk_write_lease(self):
+        """
+        This method tests that a chunk is rejected while another request holds its upload's lease, not after it expires.
+        """
+
+        response = self.client.post(self.uploads_url, {"name": "notes.txt", "size": 10}, format="json")
+        upload_id = json.loads(response.content)["payload"]["upload"]["id"]
+        TaskMediaUpload.objects.filter(id=upload_id).update(
+            writing_until=get_datetime_now() + timezone.timedelta(seconds=60))
+
+        response = self.put_chunk(upload_id, b"0123", 0, 10)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        # request holding it died without releasing it
+        TaskMediaUpload.objects.filter(id=upload_id).update(
+            writing_until=get_datetime_now() - timezone.timedelta(seconds=1))
+        self.assertEqual(self.put_chunk(upload_id, b"0123", 0, 10).status_code, status.HTTP_200_OK)
+        self.assertIsNone(TaskMediaUpload.objects.get(id=upload_id).writing_until)
+
+    def test_known_content_skips_upload(self):
+        """
+        This method tests that a file user already has is attached without uploading it again.
+        """
+
+        task_file = TaskMediaFiles(task=self.task, name="notes.txt")
+        task_file.file.save("notes.txt", ContentFile(b"0123456789"))
+        digest = hashlib.sha256(b"0123456789").hexdigest()
+
+        response = self.client.post(self.uploads_url, {"name": "copy.txt", "size": 10, "sha256": digest},
+                                    format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)["payload"]["file"]["name"], "copy.txt")
+        self.assertFalse(TaskMediaUpload.objects.exists())
+        self.assertEqual(MediaBlob.objects.get(digest=digest).ref_count, 2)
+
+        response = self.client.post(self.uploads_url, {"name": "other.txt", "size": 10, "sha256": "0" * 64},
+                                    format="json")
+        self.assertIn("upload", json.loads(response.content)["payload"])
+
+    def test_oversize_upload_rejected(self):
+        """
+        This method tests that uploads over allowed size are rejected before their bytes are read.
+        """
+
+        response = self.client.post(self.uploads_url, {"name": "large.bin", "size": 21}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        response = self.client.post(self.uploads_url, {"name": "small.bin", "size": 4}, format="json")
+        upload_id = json.loads(response.content)["payload"]["upload"]["id"]
+
+        response = self.put_chunk(upload_id, b"01234", 0, 4)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        response = self.put_chunk(upload_id, b"01234", 0, 5)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(TaskMediaUpload.objects.get(id=upload_id).received, 0)
+
+
+class TaskMediaDownloadTest(APITestCase):
+    """
+        Contains unit tests for conditional & range downloads of task files
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_token_cache.clear()
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.PREMIUM.value, price=10, currency="USD")
+        UserSubscriptionLimits.objects.create(subscription_type=subscription_type, max_allowed_tasks=5)
+        self.app_user = User.objects.create(email="task_download@gmail.com", username="task_download@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+        UserLogin.objects.create(user=self.app_user, token="task-download-token")
+
+        task = Task(user=self.app_user, title="title", description="description", due_datetime=get_datetime_now())
+        task.save()
+        task_file = TaskMediaFiles(task=task, name="notes.txt")
+        task_file.file.save("notes.txt", ContentFile(b"0123456789"))
+        self.file_url = f"/api/v1/tasks/{task.id}/files/{task_file.id}"
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="task-download-token")
+
+    def test_conditional_download(self):
+        """
+        This method tests that a client's current copy is answered with 304 Not Modified.
+        """
+
+        response = self.client.get(self.file_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="notes.txt"')
+
+        response = self.client.get(self.file_url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(self.file_url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_range_download(self):
+        """
+        This method tests single byte range requests.
+        """
+
+        response = self.client.get(self.file_url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), b"2345")
+        self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+
+        response = self.client.get(self.file_url, HTTP_RANGE="bytes=-3")
+        self.assertEqual(b"".join(response.streaming_content), b"789")
+
+        response = self.client.get(self.file_url, HTTP_RANGE="bytes=10-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    @override_settings(MEDIA_DOWNLOAD_OFFLOAD="x-accel-redirect")
+    def test_offloaded_download(self):
+        """
+        This method tests that file transfer is handed over to nginx.
+        """
+
+        response = self.client.get(self.file_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["X-Accel-Redirect"].startswith("/protected-media/"))
+        self.assertEqual(response.content, b"")
+
+
+class ReportTest(APITestCase):
+    """
+        Contains unit tests for reports answered from daily rollups
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_token_cache.clear()
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.PREMIUM.value, price=10, currency="USD")
+        UserSubscriptionLimits.objects.create(subscription_type=subscription_type, max_allowed_tasks=10)
+        self.app_user = User.objects.create(email="report@gmail.com", username="report@gmail.com",
+                                            subscription_type=subscription_type, is_email_verified=True)
+        UserLogin.objects.create(user=self.app_user, token="report-token")
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="report-token")
+
+    def complete_task(self, completion_datetime):
+        """
+        creates a task completed at given datetime
+        """
+        task = Task(user=self.app_user, title="title", description="description", due_datetime=completion_datetime)
+        task.save()
+        task.completion_status = True
+        task.completion_datetime = completion_datetime
+        task.update()
+
+    def report(self, name, **params):
+        """
+        returns payload of a report
+        """
+        response = self.client.get("/api/v1/reports/", {"name": name, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)["payload"]["report"]
+
+    def test_date_window_reports(self):
+        """
+        This method tests date based reports with & without from/to window.
+        """
+
+        day_one = get_datetime_now().replace(year=2021, month=8, day=2, hour=10)
+        day_two = day_one + timezone.timedelta(days=1)
+        self.complete_task(day_one)
+        self.complete_task(day_two)
+        self.complete_task(day_two)
+
+        self.assertEqual(self.report("max-completion-count-day-wise"),
+                         {"max_tasks_completion_date": {"date": "2021-08-03", "count": 2}})
+        self.assertEqual(self.report("tasks-completion-avg"), {"day_wise_tasks_completion_avg": 1.5})
+        self.assertEqual(self.report("max-completion-count-day-wise", to="2021-08-02"),
+                         {"max_tasks_completion_date": {"date": "2021-08-02", "count": 1}})
+
+        # a change after rollups are built is reflected in next report
+        self.complete_task(day_one + timezone.timedelta(hours=1))
+        self.assertEqual(self.report("tasks-completion-avg", **{"from": "2021-08-01", "to": "2021-08-02"}),
+                         {"day_wise_tasks_completion_avg": 2.0})
+
+        response = self.client.get("/api/v1/reports/", {"name": "tasks-completion-avg", "from": "02-08-2021"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_multiple_reports(self):
+        """
+        This method tests that several reports are combined in one payload from a fixed number of queries.
+        """
+
+        self.complete_task(get_datetime_now().replace(year=2021, month=8, day=2, hour=10))
+        self.report("all")  # builds rollups
+
+        # statistics row, stale rollups check & one rollup aggregate (token is cached)
+        with self.assertNumQueries(3):
+            report = self.report("all", **{"from": "2021-08-01"})
+        self.assertEqual(set(report), {"tasks_summary", "day_wise_tasks_completion_avg", "incomplete_tasks_count",
+                                       "max_tasks_completion_date", "day_wise_tasks_creation"})
+        self.assertEqual(sum(report["day_wise_tasks_creation"].values()), 1)
+
+        report = self.report("tasks-status,incomplete-tasks-count")
+        self.assertEqual(report, {"tasks_summary": {"total": 1, "complete": 1, "incomplete": 0},
+                                  "incomplete_tasks_count": 0})
+
+        response = self.client.get("/api/v1/reports/", {"name": "tasks-status,unknown"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reports_cached_per_user(self):
+        """
+        This method tests that cached reports aren't shared across users and are invalidated by task changes.
+        """
+
+        other_user = User.objects.create(email="report_other@gmail.com", username="report_other@gmail.com",
+                                         subscription_type=self.app_user.subscription_type, is_email_verified=True)
+        UserLogin.objects.create(user=other_user, token="report-other-token")
+
+        self.assertEqual(self.report("tasks-status")["tasks_summary"]["total"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.complete_task(get_datetime_now())
+
+        # statistics row only, then served from cache
+        with self.assertNumQueries(1):
+            self.assertEqual(self.report("tasks-status")["tasks_summary"]["total"], 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.report("tasks-status")["tasks_summary"]["total"], 1)
+
+        self.client.credentials(HTTP_AUTHORIZATION="report-other-token")
+        self.assertEqual(self.report("tasks-status")["tasks_summary"]["total"], 0)
+
+
+@override_settings(ROOT_URLCONF="tests.test_views")
+class AsyncViewTest(TransactionTestCase):
+    """
+        Contains unit tests for async views served under ASGI, whose queries
+        run in database threads (so rows are committed, not kept in a test
+        transaction)
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_token_cache.clear()
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        subscription_type = UserSubscriptionType.objects.create(
+            name=UserSubscriptionTypesEnum.FREEMIUM.value, price=0, currency="USD")
+        UserSubscriptionLimits.objects.create(subscription_type=subscription_type, max_allowed_tasks=5)
+        app_user = User.objects.create(email="task_async@gmail.com", username="task_async@gmail.com",
+                                       subscription_type=subscription_type, is_email_verified=True)
+        UserLogin.objects.create(user=app_user, token="task-async-token")
+
+        task = Task(user=app_user, title="title", description="description", due_datetime=get_datetime_now())
+        task.save()
+        task_file = TaskMediaFiles(task=task, name="notes.txt")
+        task_file.file.save("notes.txt", ContentFile(b"0123456789"))
+        self.file_url = f"/api/v1/tasks/{task.id}/files/{task_file.id}"
+
+        self.async_client = AsyncClient()
+
+    async def get(self, url, token="task-async-token"):
+        """
+        returns response of an async GET request sent with a login token
+        """
+        return await self.async_client.get(url, AUTHORIZATION=token)
+
+    async def test_async_views(self):
+        """
+        This method tests that async views respond like DRF views and their
+        database threads' queries are counted by metrics.
+        """
+
+        counter = metrics.QueryCounter()
+        with metrics.queries_counted(counter):
+            response = await self.get("/api/v1/tasks")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        payload = json.loads(response.content)["payload"]
+        self.assertEqual([task["title"] for task in payload["tasks"]], ["title"])
+        self.assertGreater(counter.count, 0)
+
+        response = await self.get("/api/v1/tasks", token="invalid-token")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(json.loads(response.content)["success"])
+
+        response = await self.get(self.file_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
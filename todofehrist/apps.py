@@ -1,6 +1,38 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, post_save, post_delete
+
+
+def setup_search_indexes(using, **kwargs):
+    """
+    Creates PostgreSQL extension & indexes used by todofehrist.search,
+    these aren't expressible as model indexes on other database backends.
+    """
+    from django.db import connections
+    from todofehrist.search import POSTGRESQL_SEARCH_SETUP
+
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+
+    with connection.cursor() as cursor:
+        for statement in POSTGRESQL_SEARCH_SETUP:
+            cursor.execute(statement)
 
 
 class TodofehristConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'todofehrist'
+
+    def ready(self):
+        from todofehrist.models import MediaBlob
+        from todofehrist.subscriptions import subscription_registry
+
+        post_migrate.connect(setup_search_indexes, sender=self)
+
+        for model_name in ("todofehrist.UserSubscriptionType", "todofehrist.UserSubscriptionLimits"):
+            post_save.connect(subscription_registry.invalidate, sender=model_name, weak=False)
+            post_delete.connect(subscription_registry.invalidate, sender=model_name, weak=False)
+
+        # reference counts of content addressed media files
+        post_save.connect(MediaBlob.objects.acquire, sender="todofehrist.TaskMediaFiles", weak=False)
+        post_delete.connect(MediaBlob.objects.release, sender="todofehrist.TaskMediaFiles", weak=False)
@@ -0,0 +1,201 @@
+"""
+    Contains async views serving task, file & report endpoints under ASGI
+    =====================================================================
+
+    Enabled by settings.ASYNC_VIEWS (see todofehrist.urls). Served by an
+    ASGI server (see README), a request is then held by the event loop, not
+    by a worker thread, while its body is received (Django buffers it before
+    calling a view) and while its response, e.g. a file download, is sent.
+    A process keeps thousands of slow clients this way.
+
+    Django 3.2 has no async ORM and DRF has no async views, so the login
+    token is checked (async_login_required) and the DRF view of an endpoint
+    (todofehrist.views) then runs in a thread of a fixed pool
+    (run_in_db_thread). Only threads of that pool hold database connections,
+    settings.ASYNC_DB_THREADS of them per process.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from todofehrist.auth_tokens import resolve_token
+from todofehrist.utility import authenticated_user, token_error_response
+from todofehrist.views import TaskView, TaskBulkView, TaskUpdateView, TaskMediaFileView, \
+    TaskMediaUploadView, TaskMediaUploadCompleteView, ReportView
+
+_db_executor = ThreadPoolExecutor(settings.ASYNC_DB_THREADS, thread_name_prefix="todofehrist-db")
+
+
+def _call_in_db_thread(func, args, kwargs):
+    # what request_started & request_finished signals do for a request
+    # thread: honour CONN_MAX_AGE and drop broken connections
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """
+    This method runs blocking (database) code in a thread of the database
+    thread pool and returns its result. It runs in a copy of current
+    context, so e.g. emumbaproject.metrics.queries_counted counts its queries.
+    """
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _db_executor, functools.partial(context.run, _call_in_db_thread, func, args, kwargs))
+
+
+def as_django_response(response):
+    """
+    returns a DRF Response as a rendered HttpResponse, which Django's async
+    handler doesn't hand to its sync thread to render. Other responses
+    (e.g. a FileResponse) are returned as-is.
+    """
+    if not isinstance(response, Response):
+        return response
+
+    if getattr(response, "accepted_renderer", None) is None:
+        # built outside a DRF view, e.g. by async_login_required
+        response.accepted_renderer = JSONRenderer()
+        response.accepted_media_type = JSONRenderer.media_type
+        response.renderer_context = {}
+
+    response.render()
+    django_response = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+        django_response[header] = value
+    return django_response
+
+
+def async_login_required(func_handler):
+    """
+    This is async counterpart of todofehrist.utility.login_required. Token
+    is resolved in a database thread (even a locally cached one is checked
+    against shared cache). Resolved token is kept on request, so that
+    login_required of the DRF view doesn't resolve it again.
+    """
+    async def wrap(self, request, *args, **kwargs):
+
+        token = request.META.get('HTTP_AUTHORIZATION', '')
+        token_entry = await run_in_db_thread(resolve_token, token) if token else None
+
+        error_response = token_error_response(token_entry)
+        if error_response is not None:
+            return as_django_response(error_response)
+
+        request.todofehrist_token_entry = token_entry
+        user = authenticated_user(request, token_entry)
+
+        return await func_handler(self, request, user, *args, **kwargs)
+
+    return wrap
+
+
+def _serve(view, request, args, kwargs):
+    return as_django_response(view(request, *args, **kwargs))
+
+
+class AsyncAPIView(View):
+    """
+        Base class of an async view serving requests of api_view, a DRF view
+        whose handlers are all decorated by login_required
+    """
+    api_view = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.api_view_function = staticmethod(cls.api_view.as_view())
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # awaited by Django's handler (class-based views can't be async in Django 3.2)
+        view._is_coroutine = asyncio.coroutines._is_coroutine
+        # authenticated by login token like DRF views, not by session
+        view.csrf_exempt = True
+        # documented by drf-yasg like api_view
+        view.cls = cls.api_view
+        view.initkwargs = {}
+        return view
+
+    @async_login_required
+    async def dispatch(self, request, user, *args, **kwargs):
+        """
+        This method runs api_view in a database thread for an authenticated
+        user, methods api_view doesn't support are rejected by it.
+        """
+        return await run_in_db_thread(_serve, self.api_view_function, request, args, kwargs)
+
+
+class AsyncTaskView(AsyncAPIView):
+    """
+        Async view of TaskView
+    """
+    api_view = TaskView
+
+
+class AsyncTaskBulkView(AsyncAPIView):
+    """
+        Async view of TaskBulkView
+    """
+    api_view = TaskBulkView
+
+
+class AsyncTaskUpdateView(AsyncAPIView):
+    """
+        Async view of TaskUpdateView
+    """
+    api_view = TaskUpdateView
+
+
+class AsyncTaskMediaFileView(AsyncAPIView):
+    """
+        Async view of TaskMediaFileView, a downloaded file is streamed to a
+        slow client by the event loop (see README for offloading it to nginx)
+    """
+    api_view = TaskMediaFileView
+
+
+class AsyncTaskMediaUploadView(AsyncAPIView):
+    """
+        Async view of TaskMediaUploadView, a chunk is received by the event
+        loop before the view writes it
+    """
+    api_view = TaskMediaUploadView
+
+
+class AsyncTaskMediaUploadCompleteView(AsyncAPIView):
+    """
+        Async view of TaskMediaUploadCompleteView
+    """
+    api_view = TaskMediaUploadCompleteView
+
+
+class AsyncReportView(AsyncAPIView):
+    """
+        Async view of ReportView
+    """
+    api_view = ReportView
+
+
+ASYNC_VIEWS = {view.api_view: view for view in AsyncAPIView.__subclasses__()}
+
+
+def as_view(api_view):
+    """
+    returns view function of api_view, or of its async view when settings.ASYNC_VIEWS is set
+    """
+    if settings.ASYNC_VIEWS:
+        return ASYNC_VIEWS[api_view].as_view()
+    return api_view.as_view()
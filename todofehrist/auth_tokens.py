@@ -0,0 +1,341 @@
+"""
+    Contains token resolution helpers used by todofehrist.utility.login_required
+    ===========================================================================
+
+    Every authenticated request maps an Authorization token to a user.
+    Two token modes are supported (settings.LOGIN_TOKEN_MODE):
+
+    - database: opaque tokens stored in user_login table. Resolved tokens
+      are kept in a small in-process LRU cache (first tier) which is backed
+      by django's configured cache (shared tier). A rotated or deleted
+      token leaves an invalidation marker in shared tier, so that first
+      tiers of all processes stop accepting it at once.
+    - signed: HMAC signed tokens carrying user id, subscription type and
+      expiry, verified without looking them up. Logout & password reset
+      are recorded in revoked_token table & user.tokens_valid_after, read
+      through django's cache. A token whose revocation can't be checked
+      (database unavailable) is rejected.
+"""
+import hashlib
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+from django.utils import timezone
+
+from emumbaproject.metrics import record_cache_lookup
+from todofehrist.models import User, UserLogin, RevokedToken
+from todofehrist.models_utility import get_datetime_now
+
+LOGIN_TOKEN_MODE_DATABASE = "database"
+LOGIN_TOKEN_MODE_SIGNED = "signed"
+
+TOKEN_CACHE_KEY_PREFIX = "todofehrist:auth-token:"
+INVALIDATED_TOKEN_KEY_PREFIX = "todofehrist:invalidated-token:"
+REVOKED_TOKEN_KEY_PREFIX = "todofehrist:revoked-token:"
+REVOKED_USER_KEY_PREFIX = "todofehrist:revoked-user:"
+SIGNED_TOKEN_SALT = "todofehrist.auth_tokens.signed"
+
+# Cached value of a resolved token
+TokenEntry = namedtuple("TokenEntry", ["user_id", "subscription_type_id", "expire_at"])
+
+
+class LRUCache:
+    """
+        Thread safe, size bounded LRU cache with a time to live for every entry.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        returns cached value against key or None if key is missing or expired
+        """
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        stores value against key, evicting least recently used entries when full
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        removes key from cache (if exists)
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        removes all entries from cache
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+local_token_cache = LRUCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_LOCAL_TTL)
+
+
+def token_digest(token):
+    """
+    Tokens are never used as cache keys as-is, only their sha256 digest.
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _seconds_to_expiry(expire_at):
+    return int((expire_at - get_datetime_now()).total_seconds())
+
+
+def signed_token_mode():
+    """
+    returns True if login tokens are signed tokens instead of database ones
+    """
+    return settings.LOGIN_TOKEN_MODE == LOGIN_TOKEN_MODE_SIGNED
+
+
+def make_signed_token(user):
+    """
+    This method generates a signed login token for user, which is valid
+    for settings.LOGIN_TOKEN_EXPIRY_TIME seconds.
+    """
+    issued_at = time.time()
+    payload = {"u": user.id,
+               "s": user.subscription_type_id,
+               "i": issued_at,
+               "e": int(issued_at + settings.LOGIN_TOKEN_EXPIRY_TIME),
+               "j": secrets.token_urlsafe(8)}
+
+    return signing.dumps(payload, salt=SIGNED_TOKEN_SALT)
+
+
+def _load_signed_token(token):
+    try:
+        return signing.loads(token, salt=SIGNED_TOKEN_SALT)
+    except signing.BadSignature:
+        return None
+
+
+def _revocation(payload):
+    """
+    returns (token is revoked, user's tokens_valid_after) of a signed token's
+    payload, read through shared cache from revoked_token table & user row.
+    raises DatabaseError if it can't be answered.
+    """
+    token_key = REVOKED_TOKEN_KEY_PREFIX + payload["j"]
+    user_key = REVOKED_USER_KEY_PREFIX + str(payload["u"])
+    try:
+        cached = cache.get_many([token_key, user_key])
+    except Exception:  # an unavailable cache is answered by database instead
+        cached = {}
+    record_cache_lookup("token_revocation", len(cached) == 2)
+
+    missing = {}
+    revoked = cached.get(token_key)
+    if revoked is None:
+        revoked = RevokedToken.objects.filter(jti=payload["j"]).exists()
+        missing[token_key] = revoked
+
+    valid_after = cached.get(user_key)
+    if valid_after is None:
+        # tokens of a deleted user are all revoked
+        valid_after = User.objects.filter(id=payload["u"]).values_list(
+            "tokens_valid_after", flat=True).first()
+        missing[user_key] = float("inf") if valid_after is None else valid_after
+        valid_after = missing[user_key]
+
+    if missing:
+        try:
+            cache.set_many(missing, settings.TOKEN_CACHE_SHARED_TTL)
+        except Exception:  # answered by database, cache is only a read-through
+            pass
+    return revoked, valid_after
+
+
+def verify_signed_token(token):
+    """
+    This method verifies signature of a signed login token & checks it
+    against revocation list. returns TokenEntry or None if token is invalid,
+    revoked or its revocation can't be checked (database unavailable).
+    """
+    payload = _load_signed_token(token)
+    if payload is None:
+        return None
+
+    try:
+        revoked, valid_after = _revocation(payload)
+    except DatabaseError as exception_:
+        logging.error(f"Revocation of a signed token can't be checked, token is rejected: {exception_}")
+        return None
+
+    if revoked or valid_after >= payload["i"]:
+        return None
+
+    expire_at = timezone.datetime.fromtimestamp(payload["e"], tz=timezone.utc)
+    return TokenEntry(payload["u"], payload["s"], expire_at)
+
+
+def revoke_token(token):
+    """
+    This method revokes a single login token e.g. on logout.
+    """
+    if not token:
+        return
+
+    if signed_token_mode():
+        payload = _load_signed_token(token)
+        if payload is None:
+            return
+        ttl = payload["e"] - int(time.time())
+        if ttl > 0:
+            RevokedToken.objects.bulk_create([RevokedToken(
+                jti=payload["j"], expire_at=timezone.datetime.fromtimestamp(payload["e"], tz=timezone.utc))],
+                ignore_conflicts=True)
+            cache.set(REVOKED_TOKEN_KEY_PREFIX + payload["j"], True, min(ttl, settings.TOKEN_CACHE_SHARED_TTL))
+        return
+
+    invalidate_token(token)
+    UserLogin.objects.filter(token=token).delete()
+
+
+def revoke_user_tokens(user):
+    """
+    This method revokes all login tokens of a user issued till now e.g. on password reset.
+    """
+    # signed tokens issued before this moment are rejected (until they expire anyway)
+    valid_after = time.time()
+    User.objects.filter(id=user.id).update(tokens_valid_after=valid_after)
+    user.tokens_valid_after = valid_after
+    cache.set(REVOKED_USER_KEY_PREFIX + str(user.id), valid_after, settings.TOKEN_CACHE_SHARED_TTL)
+
+    for token in UserLogin.objects.filter(user=user.id).values_list("token", flat=True):
+        invalidate_token(token)
+    UserLogin.objects.filter(user=user.id).delete()
+
+
+def remove_expired_revocations():
+    """
+    This method removes revocations of signed tokens which have expired anyway.
+    returns number of removed revocations.
+    """
+    return RevokedToken.objects.filter(expire_at__lte=get_datetime_now()).delete()[0]
+
+
+def resolve_token(token):
+    """
+    This method returns TokenEntry against a login token. Signed tokens are
+    verified in place, database tokens are looked up in local cache, shared
+    cache and finally in user_login table.
+    returns None when token doesn't exist.
+    """
+    if not token:
+        return None
+
+    return resolve_local_token(token) or resolve_remote_token(token)
+
+
+def resolve_local_token(token):
+    """
+    This method returns TokenEntry of a database token found in local cache.
+    A token invalidated by any process since it was cached locally isn't
+    returned, an invalidation marker is checked in shared cache on every hit.
+    returns None when token isn't cached locally (or is a signed token).
+    """
+    if not token or signed_token_mode():
+        return None
+
+    digest = token_digest(token)
+    entry = local_token_cache.get(digest)
+    if entry is not None and cache.get(INVALIDATED_TOKEN_KEY_PREFIX + digest) is not None:
+        local_token_cache.delete(digest)
+        entry = None
+    record_cache_lookup("token_local", entry is not None)
+    return entry
+
+
+def resolve_remote_token(token):
+    """
+    This method returns TokenEntry against a login token, verifying a signed
+    token (its revocation list is in shared cache) or looking a database
+    token up in shared cache and user_login table, without checking local
+    cache first (see resolve_token).
+    returns None when token doesn't exist.
+    """
+    if signed_token_mode():
+        return verify_signed_token(token)
+
+    digest = token_digest(token)
+    cache_key = TOKEN_CACHE_KEY_PREFIX + digest
+    entry = cache.get(cache_key)
+    record_cache_lookup("token_shared", entry is not None)
+
+    if entry is None:
+        row = UserLogin.objects.filter(token=token).values_list(
+            "user_id", "user__subscription_type_id", "expire_at").first()
+        if row is None:
+            return None
+
+        entry = TokenEntry(*row)
+        ttl = min(settings.TOKEN_CACHE_SHARED_TTL, _seconds_to_expiry(entry.expire_at))
+        if ttl > 0:
+            cache.set(cache_key, entry, ttl)
+
+    local_token_cache.set(digest, entry, _seconds_to_expiry(entry.expire_at))
+
+    return entry
+
+
+def invalidate_token(token):
+    """
+    This method must be called whenever a login token is rotated or deleted.
+    """
+    if not token:
+        return
+
+    digest = token_digest(token)
+    local_token_cache.delete(digest)
+    cache.delete(TOKEN_CACHE_KEY_PREFIX + digest)
+    # local caches of other processes drop it on their next hit, entries live there at most this long
+    cache.set(INVALIDATED_TOKEN_KEY_PREFIX + digest, 1, settings.TOKEN_CACHE_LOCAL_TTL)
+
+
+def user_from_entry(entry):
+    """
+    This method builds a User object from TokenEntry without a database query.
+    Only id & subscription_type_id are populated, rest of the attributes are
+    deferred and will be loaded from database on first access.
+    """
+    values = {"id": entry.user_id, "subscription_type_id": entry.subscription_type_id}
+    field_names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+
+    return User.from_db(DEFAULT_DB_ALIAS, field_names, [values[name] for name in field_names])
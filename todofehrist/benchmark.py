@@ -0,0 +1,440 @@
+"""
+    Contains API benchmark scenarios & statistics used by benchmark command
+    =======================================================================
+
+    A scenario drives one endpoint (method + route of todofehrist.urls)
+    with requests built by its prepare function. Rows a request consumes
+    or changes (users logging in/out, tasks & files being deleted, uploads
+    being written) are created by prepare, before timing starts, so that
+    scenarios don't interfere with each other and every request succeeds.
+
+    Requests of a scenario are sent by a given number of concurrent
+    threads, each with its own django test Client & database connection.
+    Every request's latency & database queries (see emumbaproject.metrics)
+    are recorded, results report p50/p95/p99 latency, throughput (requests
+    per second) & queries per request, and are compared with a baseline.
+"""
+import json
+import math
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connections, models
+from django.test import Client
+from django.test.client import MULTIPART_CONTENT, BOUNDARY, encode_multipart
+from django.core.files.base import ContentFile
+from django.utils.encoding import force_bytes
+from django.utils import timezone
+from django.utils.http import urlsafe_base64_encode
+
+from emumbaproject.metrics import QueryCounter, queries_counted
+from todofehrist.auth_tokens import make_signed_token, signed_token_mode
+from todofehrist.media import create_upload
+from todofehrist.models import User, Task, TaskMediaFiles, TaskMediaUpload
+from todofehrist.models_utility import get_datetime_now
+from todofehrist.seeding import SEED_PASSWORD, WORDS, seed_users, seed_tokens, random_task, seed_blob
+from todofehrist.utility import account_token_gen
+
+BenchmarkRequest = namedtuple("BenchmarkRequest", ["path", "body", "content_type", "headers"])
+Scenario = namedtuple("Scenario", ["name", "method", "route", "prepare"])
+ActiveUser = namedtuple("ActiveUser", ["id", "token", "task_ids"])
+
+JSON_CONTENT = "application/json"
+CHUNK_CONTENT = "application/octet-stream"
+PAGE_SIZE = 20  # tasks per listed page
+BULK_OPERATIONS = 10  # operations per tasks/bulk request, half creates & half updates
+TASKS_PER_ACTIVE_USER = 50  # ids of tasks loaded per active user
+FILE_CONTENT = b"benchmark upload\n" * 64
+# allowed increase of average queries per request, concurrent requests of a
+# user may both miss a cache (e.g. login tokens) which one request would fill
+QUERY_TOLERANCE = 0.5
+
+
+class BenchmarkContext:
+    """
+        Seeded users requests are sent for and rows created for scenarios
+    """
+
+    def __init__(self, rng, subscription_type, user_ids, tokens, active_users, batch_size=1000):
+        self.rng = rng
+        self.subscription_type = subscription_type
+        self.batch_size = batch_size
+        self.api_url = f"/{settings.API_URL}/"
+        self.tokens = tokens
+        self.password_hash = User.objects.filter(id=user_ids[0]).values_list("password", flat=True).get()
+        self._created_users = 0
+        self._blob_name = None
+
+        ids = rng.sample(user_ids, min(active_users, len(user_ids)))
+        task_ids = {user_id: [] for user_id in ids}
+        for user_id, task_id in Task.objects.filter(user__in=ids).order_by("user", "-pk").values_list("user", "id"):
+            if len(task_ids[user_id]) < TASKS_PER_ACTIVE_USER:
+                task_ids[user_id].append(task_id)
+        self.users = [ActiveUser(user_id, self.token(user_id), task_ids[user_id])
+                      for user_id in ids]
+
+    def token(self, user_id):
+        """
+        returns a login token of a seeded user
+        """
+        if signed_token_mode():
+            return make_signed_token(User(id=user_id, subscription_type_id=self.subscription_type.id))
+        return self.tokens[user_id]
+
+    def user(self, with_tasks=False):
+        """
+        returns a random ActiveUser
+        """
+        users = [user for user in self.users if user.task_ids] if with_tasks else self.users
+        return self.rng.choice(users)
+
+    def create_users(self, count, verified=True, with_tokens=False):
+        """
+        returns User objects created for a scenario
+        """
+        prefix = f"bench{self._created_users}-"
+        self._created_users += 1
+        user_ids = seed_users(count, self.subscription_type, self.batch_size, prefix=prefix, verified=verified,
+                              password_hash=self.password_hash)
+        if with_tokens:
+            self.tokens.update(seed_tokens(user_ids, self.rng, self.batch_size))
+        return list(User.objects.filter(id__in=user_ids).order_by("id"))
+
+    def create_tasks(self, count):
+        """
+        returns [(ActiveUser, Task)] of tasks created for a scenario
+        """
+        now = get_datetime_now()
+        created = []
+        for _ in range(count):
+            user = self.user()
+            task = random_task(self.rng, user.id, now)
+            # quota & statistics aren't needed, skip Task.save
+            models.Model.save(task, force_insert=True)
+            created.append((user, task))
+        return created
+
+    def create_files(self, count):
+        """
+        returns [(ActiveUser, TaskMediaFiles)] of files created for a scenario
+        """
+        if self._blob_name is None:
+            self._blob_name = seed_blob()
+
+        created = []
+        for _ in range(count):
+            user = self.user(with_tasks=True)
+            task_file = TaskMediaFiles(task_id=self.rng.choice(user.task_ids), name="benchmark.txt",
+                                       file=self._blob_name)
+            task_file.save()
+            created.append((user, task_file))
+        return created
+
+    def create_uploads(self, count, received_all=False):
+        """
+        returns [(ActiveUser, TaskMediaUpload)] of uploads created for a scenario
+        """
+        created = []
+        for _ in range(count):
+            user = self.user(with_tasks=True)
+            upload = create_upload(self.rng.choice(user.task_ids), "benchmark.txt", len(FILE_CONTENT))
+            if received_all:
+                with open(upload.part_path, "wb") as part_file:
+                    part_file.write(FILE_CONTENT)
+                TaskMediaUpload.objects.filter(id=upload.id).update(received=upload.size)
+            created.append((user, upload))
+        return created
+
+    def task_data(self):
+        """
+        returns request data of a new task
+        """
+        due = get_datetime_now() + timezone.timedelta(minutes=self.rng.randint(60, 30 * 24 * 60))
+        return {"title": " ".join(self.rng.sample(WORDS, 3)),
+                "description": " ".join(self.rng.choice(WORDS) for _ in range(12)),
+                "due_datetime": due.strftime(settings.DATETIME_FORMATS[0])}
+
+
+def _request(path, data=None, token=None, **headers):
+    if token is not None:
+        headers["HTTP_AUTHORIZATION"] = token
+    body = json.dumps(data) if data is not None else ""
+    return BenchmarkRequest(path, body, JSON_CONTENT, headers)
+
+
+def _client_address(index):
+    """
+    returns a distinct client IP per index, credentials are throttled per IP (see todofehrist.throttling)
+    """
+    return f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+
+
+def _prepare_register(ctx, count):
+    prefix = ctx.rng.getrandbits(32)
+    return [_request(ctx.api_url + "register", {"email": f"bench-register-{prefix}-{index}@example.com",
+                                                "password": SEED_PASSWORD}, REMOTE_ADDR=_client_address(index))
+            for index in range(count)]
+
+
+def _prepare_activate(ctx, count):
+    generator = account_token_gen()
+    return [_request(f"{ctx.api_url}activate/{urlsafe_base64_encode(force_bytes(user.pk))}/"
+                     f"{generator.make_token(user)}") for user in ctx.create_users(count, verified=False)]
+
+
+def _prepare_login(ctx, count):
+    return [_request(ctx.api_url + "auth", {"email": user.email, "password": SEED_PASSWORD},
+                     REMOTE_ADDR=_client_address(index))
+            for index, user in enumerate(ctx.create_users(count))]
+
+
+def _prepare_logout(ctx, count):
+    return [_request(ctx.api_url + "auth/logout", token=ctx.token(user.id))
+            for user in ctx.create_users(count, with_tokens=True)]
+
+
+def _prepare_forgot_password(ctx, count):
+    emails = dict(User.objects.filter(id__in=[user.id for user in ctx.users]).values_list("id", "email"))
+    return [_request(ctx.api_url + "auth/reset", {"email": emails[ctx.user().id]}) for _ in range(count)]
+
+
+def _prepare_reset_password(ctx, count):
+    generator = account_token_gen()
+    return [_request(ctx.api_url + "auth/reset", {"email": user.email, "new_password": "benchmark-password-2",
+                                                   "reset_token": generator.make_token(user)},
+                     REMOTE_ADDR=_client_address(index))
+            for index, user in enumerate(ctx.create_users(count))]
+
+
+def _prepare_tasks_list(ctx, count):
+    return [_request(f"{ctx.api_url}tasks?page_size={PAGE_SIZE}", token=user.token)
+            for user in (ctx.user() for _ in range(count))]
+
+
+def _prepare_tasks_page(ctx, count):
+    requests = []
+    for _ in range(count):
+        user = ctx.user(with_tasks=True)
+        page_num = ctx.rng.randint(1, math.ceil(len(user.task_ids) / PAGE_SIZE))
+        requests.append(_request(f"{ctx.api_url}tasks?page_size={PAGE_SIZE}&page_num={page_num}", token=user.token))
+    return requests
+
+
+def _prepare_tasks_search(ctx, count):
+    return [_request(f"{ctx.api_url}tasks?page_size={PAGE_SIZE}&search={'+'.join(ctx.rng.sample(WORDS, 2))}",
+                     token=user.token) for user in (ctx.user() for _ in range(count))]
+
+
+def _prepare_task_create(ctx, count):
+    return [_request(ctx.api_url + "tasks", ctx.task_data(), token=ctx.user().token) for _ in range(count)]
+
+
+def _prepare_tasks_bulk(ctx, count):
+    requests = []
+    for _ in range(count):
+        user = ctx.user(with_tasks=True)
+        updated_ids = ctx.rng.sample(user.task_ids, min(BULK_OPERATIONS // 2, len(user.task_ids)))
+        operations = [{"op": "create", "data": ctx.task_data()} for _ in range(BULK_OPERATIONS - len(updated_ids))]
+        operations += [{"op": "update", "id": task_id, "data": {"completion_status": ctx.rng.random() < 0.5}}
+                       for task_id in updated_ids]
+        requests.append(_request(ctx.api_url + "tasks/bulk", {"operations": operations}, token=user.token))
+    return requests
+
+
+def _prepare_task_get(ctx, count):
+    return [_request(f"{ctx.api_url}tasks/{ctx.rng.choice(user.task_ids)}", token=user.token)
+            for user in (ctx.user(with_tasks=True) for _ in range(count))]
+
+
+def _prepare_task_update(ctx, count):
+    return [_request(f"{ctx.api_url}tasks/{ctx.rng.choice(user.task_ids)}",
+                     {"completion_status": ctx.rng.random() < 0.5, "title": " ".join(ctx.rng.sample(WORDS, 3))},
+                     token=user.token) for user in (ctx.user(with_tasks=True) for _ in range(count))]
+
+
+def _prepare_task_delete(ctx, count):
+    return [_request(f"{ctx.api_url}tasks/{task.id}", token=user.token) for user, task in ctx.create_tasks(count)]
+
+
+def _prepare_file_upload(ctx, count):
+    requests = []
+    for index in range(count):
+        user = ctx.user(with_tasks=True)
+        # distinct content, every upload is stored as a new blob
+        content = ContentFile(FILE_CONTENT + f"{ctx.rng.getrandbits(64)}-{index}".encode(), name="benchmark.txt")
+        requests.append(BenchmarkRequest(f"{ctx.api_url}tasks/{ctx.rng.choice(user.task_ids)}/files",
+                                         encode_multipart(BOUNDARY, {"file": content}), MULTIPART_CONTENT,
+                                         {"HTTP_AUTHORIZATION": user.token}))
+    return requests
+
+
+def _prepare_file_download(ctx, count):
+    return [_request(f"{ctx.api_url}tasks/{task_file.task_id}/files/{task_file.id}", token=user.token)
+            for user, task_file in ctx.create_files(count)]
+
+
+def _prepare_file_delete(ctx, count):
+    return _prepare_file_download(ctx, count)
+
+
+def _prepare_upload_initiate(ctx, count):
+    return [_request(f"{ctx.api_url}tasks/{ctx.rng.choice(user.task_ids)}/files/uploads",
+                     {"name": "benchmark.txt", "size": len(FILE_CONTENT)}, token=user.token)
+            for user in (ctx.user(with_tasks=True) for _ in range(count))]
+
+
+def _upload_path(ctx, upload):
+    return f"{ctx.api_url}tasks/{upload.task_id}/files/uploads/{upload.id}"
+
+
+def _prepare_upload_status(ctx, count):
+    return [_request(_upload_path(ctx, upload), token=user.token) for user, upload in ctx.create_uploads(count)]
+
+
+def _prepare_upload_chunk(ctx, count):
+    return [BenchmarkRequest(_upload_path(ctx, upload), FILE_CONTENT, CHUNK_CONTENT,
+                             {"HTTP_AUTHORIZATION": user.token,
+                              "HTTP_CONTENT_RANGE": f"bytes 0-{upload.size - 1}/{upload.size}"})
+            for user, upload in ctx.create_uploads(count)]
+
+
+def _prepare_upload_abort(ctx, count):
+    return _prepare_upload_status(ctx, count)
+
+
+def _prepare_upload_complete(ctx, count):
+    return [_request(_upload_path(ctx, upload) + "/complete", token=user.token)
+            for user, upload in ctx.create_uploads(count, received_all=True)]
+
+
+def _prepare_reports(ctx, count):
+    return [_request(ctx.api_url + "reports/?name=all", token=ctx.user().token) for _ in range(count)]
+
+
+# Scenarios run in this order, ones changing shared rows last. SocialAuthLogin
+# (oauth) isn't benchmarked, it verifies tokens against Google's servers.
+SCENARIOS = [
+    Scenario("tasks_list", "GET", "tasks", _prepare_tasks_list),
+    Scenario("tasks_page", "GET", "tasks?page_num", _prepare_tasks_page),
+    Scenario("tasks_search", "GET", "tasks?search", _prepare_tasks_search),
+    Scenario("task_get", "GET", "tasks/<task_id>", _prepare_task_get),
+    Scenario("reports", "GET", "reports/", _prepare_reports),
+    Scenario("file_download", "GET", "tasks/<task_id>/files/<file_id>", _prepare_file_download),
+    Scenario("upload_status", "GET", "tasks/<task_id>/files/uploads/<upload_id>", _prepare_upload_status),
+    Scenario("task_create", "POST", "tasks", _prepare_task_create),
+    Scenario("tasks_bulk", "POST", "tasks/bulk", _prepare_tasks_bulk),
+    Scenario("task_update", "POST", "tasks/<task_id>", _prepare_task_update),
+    Scenario("task_delete", "DELETE", "tasks/<task_id>", _prepare_task_delete),
+    Scenario("file_upload", "POST", "tasks/<task_id>/files", _prepare_file_upload),
+    Scenario("file_delete", "DELETE", "tasks/<task_id>/files/<file_id>", _prepare_file_delete),
+    Scenario("upload_initiate", "POST", "tasks/<task_id>/files/uploads", _prepare_upload_initiate),
+    Scenario("upload_chunk", "PUT", "tasks/<task_id>/files/uploads/<upload_id>", _prepare_upload_chunk),
+    Scenario("upload_complete", "POST", "tasks/<task_id>/files/uploads/<upload_id>/complete",
+             _prepare_upload_complete),
+    Scenario("upload_abort", "DELETE", "tasks/<task_id>/files/uploads/<upload_id>", _prepare_upload_abort),
+    Scenario("register", "POST", "register", _prepare_register),
+    Scenario("activate", "GET", "activate/<uid>/<token>", _prepare_activate),
+    Scenario("login", "POST", "auth", _prepare_login),
+    Scenario("logout", "POST", "auth/logout", _prepare_logout),
+    Scenario("forgot_password", "GET", "auth/reset", _prepare_forgot_password),
+    Scenario("reset_password", "POST", "auth/reset", _prepare_reset_password),
+]
+
+
+def percentile(values, percent):
+    """
+    returns nearest-rank percentile of values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def _send(client, method, request):
+    response = client.generic(method, request.path, request.body, request.content_type, **request.headers)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    response.close()
+    return response.status_code
+
+
+def run_scenario(scenario, requests, concurrency):
+    """
+    This method sends requests of a scenario from concurrency threads.
+    returns dict of results: requests, errors (responses with status >= 400),
+    p50/p95/p99 latency in milliseconds, rps & queries per request.
+    """
+    pending = queue.SimpleQueue()
+    for request in requests:
+        pending.put(request)
+
+    samples = []  # (seconds, queries, status) of every request
+    lock = threading.Lock()
+
+    def worker():
+        client = Client(raise_request_exception=False)
+        try:
+            while True:
+                try:
+                    request = pending.get_nowait()
+                except queue.Empty:
+                    return
+
+                counter = QueryCounter()
+                started = time.perf_counter()
+                with queries_counted(counter):
+                    status = _send(client, scenario.method, request)
+                elapsed = time.perf_counter() - started
+
+                with lock:
+                    samples.append((elapsed, counter.count, status))
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = [seconds * 1000 for seconds, _, _ in samples]
+    return {"requests": len(samples),
+            "errors": sum(1 for _, _, status in samples if status >= 400),
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "rps": round(len(samples) / elapsed, 3),
+            "queries_per_request": round(sum(queries for _, queries, _ in samples) / len(samples), 3)}
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """
+    returns list of regression messages of results against baseline
+    results, a scenario regresses if its p95 latency grows or throughput
+    drops by more than threshold (a fraction), or if it makes more queries
+    (beyond QUERY_TOLERANCE) or fails more requests. Scenarios missing in baseline are skipped.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+
+        if result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        if result["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{name}: {result['rps']} requests/s < baseline {base['rps']} requests/s")
+        if result["queries_per_request"] > base["queries_per_request"] + QUERY_TOLERANCE:
+            regressions.append(f"{name}: {result['queries_per_request']} queries/request > "
+                               f"baseline {base['queries_per_request']}")
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{name}: {result['errors']} failed requests > baseline {base['errors']}")
+
+    return regressions
@@ -0,0 +1,140 @@
+"""
+    Contains bulk task create/update/delete used by todofehrist.views.TaskBulkView
+    =============================================================================
+
+    All operations of a bulk request are validated first, if any of them
+    is invalid nothing is applied. Valid operations are applied in a single
+    transaction: deletes, one quota reservation for all creates, then
+    bulk_create & bulk_update, and a single UserTaskStatistics update.
+"""
+from django.db import connection, models, transaction
+from django.db.models import F
+
+from todofehrist import search
+from todofehrist.models import Task, UserQuotaManagement, UserTaskStatistics
+from todofehrist.models_utility import get_datetime_now
+from todofehrist.serializers import TaskBulkSerializer, TaskBulkOperationSerializer
+from todofehrist.subscriptions import subscription_registry
+
+UPDATE_FIELDS = ['title', 'description', 'due_datetime', 'completion_status',
+                 'completion_datetime', 'updated_datetime', 'search_vector']
+
+
+class TaskQuotaExceeded(ValueError):
+    """
+        Raised when creates of a bulk request don't fit in user's task quota
+    """
+
+
+def _validate(user, operations):
+    """
+    returns list of per operation results, an operation's result contains
+    'errors' if it is invalid, otherwise its (unsaved) Task object.
+    """
+    results = [{"index": index, "op": None, "success": False} for index in range(len(operations))]
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        serializer_ = TaskBulkOperationSerializer(data=operation)
+        if serializer_.is_valid():
+            parsed.append((index, serializer_.validated_data))
+            results[index]["op"] = serializer_.validated_data["op"]
+        else:
+            results[index]["errors"] = serializer_.errors
+
+    # a task can be referenced by one operation only
+    referenced_ids = [item["id"] for _, item in parsed if item["op"] != "create"]
+    tasks = Task.objects.filter(user=user.id, id__in=set(referenced_ids)).in_bulk()
+
+    creates = [(index, item) for index, item in parsed if item["op"] == "create"]
+    if creates:
+        serializer_ = TaskBulkSerializer(data=[item["data"] for _, item in creates], many=True)
+        if serializer_.is_valid():
+            for (index, _), validated_data in zip(creates, serializer_.validated_data):
+                results[index]["task"] = Task(user_id=user.id, **validated_data)
+        else:
+            for (index, _), errors in zip(creates, serializer_.errors):
+                if errors:
+                    results[index]["errors"] = errors
+
+    for index, item in parsed:
+        if item["op"] == "create":
+            continue
+
+        task = tasks.get(item["id"])
+        if task is None:
+            results[index]["errors"] = f"Task with id {item['id']} doesn't exist or belong to you."
+        elif referenced_ids.count(item["id"]) > 1:
+            results[index]["errors"] = f"Task with id {item['id']} is referenced by more than one operation."
+        elif item["op"] == "update":
+            serializer_ = TaskBulkSerializer(data=item["data"], partial=True)
+            if serializer_.is_valid():
+                TaskBulkSerializer.assign(task, serializer_.validated_data)
+                results[index]["task"] = task
+            else:
+                results[index]["errors"] = serializer_.errors
+        else:
+            results[index]["task"] = task
+
+    return results
+
+
+def _create_tasks(tasks):
+    if connection.features.can_return_rows_from_bulk_insert:
+        Task.objects.bulk_create(tasks)
+    else:  # ids of created rows are needed for results, insert them one by one
+        for task in tasks:
+            # quota is already reserved, skip Task.save
+            models.Model.save(task, force_insert=True)
+
+
+def apply_task_operations(user, operations):
+    """
+    This method validates & applies bulk task operations for a user.
+    returns (results, valid), results contains one entry per operation with
+    its 'index', 'op', 'success' and task 'id' or validation 'errors'.
+    raises TaskQuotaExceeded if creates don't fit in user's quota.
+    """
+    results = _validate(user, operations)
+    if any("errors" in result for result in results):
+        for result in results:
+            result.pop("task", None)
+        return results, False
+
+    creates = [result["task"] for result in results if result["op"] == "create"]
+    updates = [result["task"] for result in results if result["op"] == "update"]
+    deletes = [result["task"] for result in results if result["op"] == "delete"]
+
+    now = get_datetime_now()
+    for task in creates + updates:
+        task.updated_datetime = now
+        task.search_vector = search.search_vector_for(task)
+
+    with transaction.atomic():
+        if deletes:
+            Task.objects.filter(id__in=[task.id for task in deletes]).delete()
+            UserQuotaManagement.objects.filter(user=user.id).update(total_tasks=F('total_tasks') - len(deletes))
+
+        if creates:
+            max_allowed_tasks = subscription_registry.limits(user.subscription_type_id).max_allowed_tasks
+            if not UserQuotaManagement.objects.reserve_tasks(user.id, len(creates), max_allowed_tasks):
+                raise TaskQuotaExceeded("User Quota for Task Creation Reached.")
+            _create_tasks(creates)
+
+        if updates:
+            Task.objects.bulk_update(updates, UPDATE_FIELDS)
+
+        UserTaskStatistics.objects.record(user.id, created=creates, updated=updates, deleted=deletes)
+
+    for task in creates + updates:
+        task.remember_saved_state()
+    for task in deletes:
+        search.remove_task(task)
+    for task in creates + updates:
+        search.index_task(task)
+
+    for result in results:
+        result["id"] = result.pop("task").id
+        result["success"] = True
+
+    return results, True
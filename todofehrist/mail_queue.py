@@ -0,0 +1,185 @@
+"""
+    Contains outbound email queue used by todofehrist.utility
+    =========================================================
+
+    Requests don't talk to SMTP server, an email is stored as an
+    OutboundEmail row (in request's transaction) and a Celery task is
+    queued once it is committed. Workers send pending emails in batches of
+    settings.EMAIL_BATCH_SIZE over an SMTP connection kept open by worker
+    process, rendering email templates compiled once per process. A batch
+    is claimed in a short transaction and sent outside of it, so SMTP
+    latency never holds row locks or a database transaction. Failed
+    emails are retried with exponential backoff, a periodic sweep picks up
+    emails whose Celery task couldn't be queued or retried (or whose
+    worker died sending them).
+
+    Context of an email (e.g. account tokens) is emptied once it is sent or
+    given up, its row is removed after settings.EMAIL_RETENTION_TIME.
+"""
+import logging
+from functools import lru_cache
+from smtplib import SMTPException, SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as db_connection, transaction
+from django.db.models import Q
+from django.template.loader import get_template
+from django.utils import timezone
+
+from todofehrist.models import OutboundEmail
+from todofehrist.models_utility import get_datetime_now
+
+_smtp_connection = None
+
+
+@lru_cache(maxsize=None)
+def _template(template_name):
+    """
+    returns compiled template, compiled once per process
+    """
+    return get_template(template_name)
+
+
+def smtp_connection():
+    """
+    returns SMTP connection of this (worker) process, opened if needed
+    """
+    global _smtp_connection
+
+    if _smtp_connection is None:
+        _smtp_connection = get_connection()
+        _smtp_connection.open()
+
+    return _smtp_connection
+
+
+def close_smtp_connection(**kwargs):
+    """
+    closes SMTP connection of this process, connected to Celery's
+    worker_process_shutdown signal in emumbaproject.celery
+    """
+    global _smtp_connection
+
+    if _smtp_connection is not None:
+        try:
+            _smtp_connection.close()
+        finally:
+            _smtp_connection = None
+
+
+def enqueue_email(subject, to_, body="", template_name="", context=None):
+    """
+    This method queues an html email, either a ready body or a template
+    rendered by worker with context (JSON serializable).
+    returns OutboundEmail object.
+    """
+    email = OutboundEmail.objects.create(subject=subject, to=list(to_), body=body,
+                                         template_name=template_name, context=context or {})
+    transaction.on_commit(dispatch_emails)
+    return email
+
+
+def dispatch_emails():
+    """
+    This method queues Celery task sending pending emails, a broker outage
+    only delays emails till next periodic sweep.
+    """
+    from emumbaproject.celery import send_queued_emails
+
+    try:
+        send_queued_emails.delay()
+    except Exception as exception_:  # kombu raises various connection errors
+        logging.warning(f"Email dispatch couldn't be queued, left for periodic sweep. {exception_}")
+
+
+def _send(email):
+    message = EmailMessage(email.subject, email.body or _template(email.template_name).render(email.context),
+                           to=email.to, connection=smtp_connection())
+    message.content_subtype = 'html'
+    try:
+        message.send()
+    except SMTPServerDisconnected:
+        # server closed idle connection, send once more over a new one
+        close_smtp_connection()
+        message.connection = smtp_connection()
+        message.send()
+
+
+def claim_pending_emails(now):
+    """
+    This method claims (marks SENDING) a batch of due pending emails and
+    emails whose claiming worker didn't finish them within
+    settings.EMAIL_CLAIM_TIMEOUT seconds, in a short transaction locking
+    them (skipping ones locked by other workers) only till they are marked.
+    returns claimed OutboundEmail objects
+    """
+    abandoned = now - timezone.timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT)
+
+    with transaction.atomic():
+        due = OutboundEmail.objects.select_for_update(
+            skip_locked=db_connection.features.has_select_for_update_skip_locked).filter(
+            Q(status=OutboundEmail.PENDING, next_attempt_datetime__lte=now) |
+            Q(status=OutboundEmail.SENDING, claimed_datetime__lte=abandoned)).order_by("id")
+        emails = list(due[:settings.EMAIL_BATCH_SIZE])
+
+        for email in emails:
+            email.status = OutboundEmail.SENDING
+            email.claimed_datetime = now
+            email.attempts += 1  # counted when claimed, so a worker dying on it counts too
+        OutboundEmail.objects.bulk_update(emails, ["status", "claimed_datetime", "attempts"])
+
+    return emails
+
+
+def send_pending_emails():
+    """
+    This method claims a batch of due pending emails and sends them outside
+    any transaction, each email is marked sent (or failed, or due for a
+    retry) as soon as it is sent.
+    returns (number of emails sent, True if more due emails are pending)
+    """
+    now = get_datetime_now()
+    sent = 0
+
+    emails = claim_pending_emails(now)
+    for email in emails:
+        try:
+            _send(email)
+        except (SMTPException, OSError) as exception_:
+            close_smtp_connection()
+            email.last_error = str(exception_)[:300]
+            if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                email.status = OutboundEmail.FAILED
+                logging.error(f"Email {email.id} to {email.to} failed permanently. {exception_}")
+            else:
+                backoff = settings.EMAIL_RETRY_BACKOFF * 2 ** (email.attempts - 1)
+                email.status = OutboundEmail.PENDING
+                email.next_attempt_datetime = get_datetime_now() + timezone.timedelta(seconds=backoff)
+        except Exception as exception_:  # e.g. a template error, retrying won't help
+            logging.exception(exception_)
+            email.last_error = str(exception_)[:300]
+            email.status = OutboundEmail.FAILED
+        else:
+            email.status = OutboundEmail.SENT
+            email.sent_datetime = get_datetime_now()
+            sent += 1
+
+        if email.status != OutboundEmail.PENDING:
+            email.context = {}
+        email.save(update_fields=["status", "last_error", "next_attempt_datetime", "sent_datetime", "context"])
+
+    more_pending = len(emails) == settings.EMAIL_BATCH_SIZE
+    return sent, more_pending
+
+
+def remove_finished_emails():
+    """
+    This method removes emails sent or given up (claimed for last attempt)
+    more than settings.EMAIL_RETENTION_TIME seconds ago.
+    returns number of emails removed
+    """
+    removed_before = get_datetime_now() - timezone.timedelta(seconds=settings.EMAIL_RETENTION_TIME)
+    removed, _ = OutboundEmail.objects.filter(status__in=[OutboundEmail.SENT, OutboundEmail.FAILED],
+                                              claimed_datetime__lte=removed_before).delete()
+    return removed
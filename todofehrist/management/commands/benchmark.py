@@ -0,0 +1,150 @@
+"""
+    Contains benchmark management command
+    =====================================
+
+    Creates a throwaway database (test database of default connection,
+    destroyed afterwards) & media root, seeds it (see todofehrist.seeding)
+    and drives every endpoint of todofehrist.urls (see
+    todofehrist.benchmark.SCENARIOS) at given concurrency. Results are
+    printed, optionally written to --output and compared with a baseline
+    recorded by an earlier run with --save-baseline. A regression (see
+    todofehrist.benchmark.compare_with_baseline) fails the command.
+
+    Emails are queued on an in-memory Celery broker, nothing is sent.
+
+    Usage: python manage.py benchmark [--users 1000] [--tasks-per-user 100]
+           [--concurrency 8] [--requests 200] [--endpoints tasks_list ...]
+           [--save-baseline] [--threshold 0.2]
+"""
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from emumbaproject.celery import app as celery_app
+from todofehrist.benchmark import SCENARIOS, BenchmarkContext, run_scenario, compare_with_baseline
+from todofehrist.seeding import seed, seed_subscription
+
+PARAMETERS = ("users", "tasks_per_user", "files_per_task", "active_users", "concurrency", "requests", "seed")
+
+
+class Command(BaseCommand):
+    """
+        Seed a throwaway database and benchmark API endpoints against a baseline
+    """
+    help = "Benchmark API endpoints (latency percentiles, throughput & queries per request) on a seeded " \
+           "throwaway database, failing if results regress from baseline."
+
+    def add_arguments(self, parser):
+        names = [scenario.name for scenario in SCENARIOS]
+
+        parser.add_argument("--users", type=int, default=1000, help="Users to seed.")
+        parser.add_argument("--tasks-per-user", type=int, default=100, help="Tasks seeded per user.")
+        parser.add_argument("--files-per-task", type=float, default=0.2,
+                            help="Media files seeded per task on average.")
+        parser.add_argument("--active-users", type=int, default=100,
+                            help="Seeded users requests are sent for.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients (threads).")
+        parser.add_argument("--requests", type=int, default=200, help="Requests sent per endpoint.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed of seeded data & requests.")
+        parser.add_argument("--endpoints", nargs="+", choices=names, default=names, metavar="ENDPOINT",
+                            help=f"Endpoints to benchmark, all by default: {', '.join(names)}.")
+        parser.add_argument("--baseline", default=str(Path(settings.BASE_DIR) / "benchmarks" / "baseline.json"),
+                            help="Baseline results file.")
+        parser.add_argument("--save-baseline", action="store_true",
+                            help="Store results as baseline instead of comparing with it.")
+        parser.add_argument("--threshold", type=float, default=0.2,
+                            help="Allowed fraction of p95 latency increase or throughput drop.")
+        parser.add_argument("--output", help="Write results as JSON to this file.")
+        parser.add_argument("--noinput", "--no-input", action="store_false", dest="interactive",
+                            help="Destroy an existing benchmark database without asking.")
+
+    def handle(self, *args, **options):
+        parameters = {name: options[name] for name in PARAMETERS}
+        parameters["database"] = connection.vendor
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            results = self._run(options, Path(temp_dir))
+
+        self._print(results)
+        report = {"parameters": parameters, "results": results}
+
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=2))
+
+        baseline_path = Path(options["baseline"])
+        if options["save_baseline"]:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(report, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {baseline_path}."))
+            return
+
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}, record one with --save-baseline."))
+            return
+
+        baseline = json.loads(baseline_path.read_text())
+        if baseline["parameters"] != parameters:
+            raise CommandError(f"Baseline was recorded with {baseline['parameters']}, not {parameters}. "
+                               f"Run with same parameters or record a new baseline with --save-baseline.")
+
+        regressions = compare_with_baseline(results, baseline["results"], options["threshold"])
+        if regressions:
+            raise CommandError("Performance regressed from baseline:\n" + "\n".join(regressions))
+
+        self.stdout.write(self.style.SUCCESS("No regression from baseline."))
+
+    def _run(self, options, temp_dir):
+        if connection.vendor == "sqlite" and not connection.settings_dict["TEST"]["NAME"]:
+            # connections to an in-memory test database are never closed, they
+            # would pile up (and may deadlock) across benchmark threads
+            connection.settings_dict["TEST"]["NAME"] = str(temp_dir / "benchmark.sqlite3")
+
+        setup_test_environment()
+        # queued emails stay in process, request latency doesn't include a broker
+        celery_app.conf.broker_url = "memory://"
+        old_name = connection.creation.create_test_db(verbosity=options["verbosity"],
+                                                       autoclobber=not options["interactive"], serialize=False)
+        try:
+            # subscription types new users sign up with
+            call_command("loaddata", "fixture_2", verbosity=0)
+            with override_settings(MEDIA_ROOT=temp_dir / "media", MEDIA_UPLOADS_ROOT=temp_dir / "media" / "uploads"):
+                return self._benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=options["verbosity"])
+            teardown_test_environment()
+
+    def _benchmark(self, options):
+        started = time.perf_counter()
+        seeded = seed(options["users"], options["tasks_per_user"], options["files_per_task"], options["seed"])
+        self.stdout.write(f"Seeded {len(seeded.user_ids)} users, {seeded.tasks} tasks & {seeded.files} files "
+                          f"in {time.perf_counter() - started:.1f}s.")
+
+        ctx = BenchmarkContext(random.Random(options["seed"]), seed_subscription(), seeded.user_ids,
+                               seeded.tokens, options["active_users"])
+
+        results = {}
+        for scenario in SCENARIOS:
+            if scenario.name not in options["endpoints"]:
+                continue
+            requests = scenario.prepare(ctx, options["requests"])
+            results[scenario.name] = run_scenario(scenario, requests, options["concurrency"])
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{scenario.name}: {results[scenario.name]}")
+
+        return results
+
+    def _print(self, results):
+        self.stdout.write(f"{'endpoint':<18}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}"
+                          f"{'p99 ms':>10}{'req/s':>10}{'queries':>9}")
+        for name, result in results.items():
+            self.stdout.write(f"{name:<18}{result['requests']:>9}{result['errors']:>8}{result['p50_ms']:>10.1f}"
+                              f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['rps']:>10.1f}"
+                              f"{result['queries_per_request']:>9.1f}")
@@ -0,0 +1,30 @@
+"""
+    Contains rebuild_task_statistics management command
+    ===================================================
+
+    UserTaskStatistics & UserDailyTaskRollup rows are maintained
+    incrementally by Task model methods, tasks changed outside of them (e.g.
+    raw SQL or admin bulk actions) make counts drift. This command
+    recomputes both from Task table.
+
+    Usage: python manage.py rebuild_task_statistics [--user USER_ID ...]
+"""
+from django.core.management.base import BaseCommand
+
+from todofehrist.models import UserTaskStatistics, UserDailyTaskRollup
+
+
+class Command(BaseCommand):
+    """
+        Recompute per user task statistics & daily rollups used by reports
+    """
+    help = "Recompute per user task statistics (UserTaskStatistics & UserDailyTaskRollup) from tasks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, nargs="+", dest="user_ids",
+                            help="Ids of users to rebuild, all users having tasks by default.")
+
+    def handle(self, *args, **options):
+        count = UserTaskStatistics.objects.rebuild(user_ids=options["user_ids"])
+        rollups = UserDailyTaskRollup.objects.rebuild(user_ids=options["user_ids"])
+        self.stdout.write(self.style.SUCCESS(f"Task statistics of {count} users & {rollups} daily rollups rebuilt."))
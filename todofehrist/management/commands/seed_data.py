@@ -0,0 +1,60 @@
+"""
+    Contains seed_data management command
+    =====================================
+
+    Fills the configured database with synthetic users, subscription
+    limits, login tokens, quota rows, tasks & media file rows (see
+    todofehrist.seeding) to size a database or benchmark against it. Rows
+    are inserted by PostgreSQL COPY from a pool of processes, same --seed
+    (& --chunk-size) seeds same rows.
+
+    Usage: python manage.py seed_data --users 50000 --tasks-per-user 100
+           [--files-per-task 0.2] [--seed 0] [--processes 8] [--prefix run2-]
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from todofehrist.seeding import CHUNK_SIZE, SEED_EMAIL, SEED_PASSWORD, seed
+
+
+class Command(BaseCommand):
+    """
+        Seed synthetic users, tasks & media files in bulk
+    """
+    help = "Seed synthetic users, tasks & media files in bulk (PostgreSQL COPY, parallel processes)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, required=True, help="Users to seed.")
+        parser.add_argument("--tasks-per-user", type=int, default=100, help="Tasks seeded per user.")
+        parser.add_argument("--files-per-task", type=float, default=0.2,
+                            help="Media files seeded per task on average.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed, same seed seeds same rows.")
+        parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Seeding processes.")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Users seeded by a process at once.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows inserted by a statement.")
+        parser.add_argument("--prefix", default="",
+                            help="Prefix of seeded emails, to seed more users in an already seeded database.")
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS, help="Database to seed.")
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["chunk_size"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--users, --chunk-size & --batch-size must be positive.")
+
+        processes = max(options["processes"], 1)
+        if processes > 1 and connections[options["database"]].vendor == "sqlite":
+            # SQLite has a single writer, parallel writers only wait for each other
+            self.stdout.write(self.style.WARNING("SQLite database, seeding from a single process."))
+            processes = 1
+
+        started = time.perf_counter()
+        result = seed(options["users"], options["tasks_per_user"], options["files_per_task"],
+                      random_seed=options["seed"], batch_size=options["batch_size"], processes=processes,
+                      chunk_size=options["chunk_size"], prefix=options["prefix"], using=options["database"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(result.user_ids)} users, {result.tasks} tasks & {result.files} files in "
+            f"{time.perf_counter() - started:.1f}s. Users sign in as {SEED_EMAIL.format(options['prefix'] + 'N')} "
+            f"with password '{SEED_PASSWORD}'."))
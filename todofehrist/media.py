@@ -0,0 +1,373 @@
+"""
+    Contains helpers for Task media files used by todofehrist.views
+    ===============================================================
+
+    Downloads: responses carry ETag & Last-Modified validators (answered
+    with 304 Not Modified when a client's copy is current) and support a
+    single byte range. With settings.MEDIA_DOWNLOAD_OFFLOAD set, file
+    transfer is handed over to the front proxy (nginx X-Accel-Redirect or
+    X-Sendfile) once the request is authorized.
+
+    Chunked uploads: a client initiates an upload with file's name & size,
+    sends its bytes in one or more PUT requests (each carrying a
+    Content-Range header) and completes it. Every chunk is streamed from
+    request to a part file in constant memory, an upload exceeding its
+    subscription's max_file_size is rejected before its bytes are read and
+    an interrupted upload resumes from the offset stored in TaskMediaUpload.
+    A client may send the file's sha256 when initiating an upload, if user
+    already has a file with same content it is attached without an upload.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.db.models import Q
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from todofehrist.models import MediaBlob, Task, TaskMediaFiles, TaskMediaUpload
+from todofehrist.models_utility import get_datetime_now
+from todofehrist.storage import blob_name, content_addressed_storage, digest_from_name
+from todofehrist.subscriptions import subscription_registry
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+OFFLOAD_X_ACCEL_REDIRECT = "x-accel-redirect"
+OFFLOAD_X_SENDFILE = "x-sendfile"
+
+
+class UploadError(Exception):
+    """
+        Base class of chunked upload errors
+    """
+
+
+class UploadOffsetMismatch(UploadError):
+    """
+        Raised when a chunk doesn't start where previously received bytes end
+    """
+
+
+class UploadTooLarge(UploadError):
+    """
+        Raised when a chunk goes past the declared (and allowed) file size
+    """
+
+
+class UploadIncomplete(UploadError):
+    """
+        Raised when an upload is completed before receiving all of its bytes
+    """
+
+
+class PartFile(File):
+    """
+        File of a complete upload, storage moves it instead of copying its content
+    """
+
+    def temporary_file_path(self):
+        """
+        returns path of file, makes FileSystemStorage move the file on save
+        """
+        return self.name
+
+
+def upload_limits_error(user, task_id, size):
+    """
+    returns error message if a file of given size can't be uploaded to task
+    as per user's subscription limits, None otherwise.
+    """
+    limits = subscription_registry.limits(user.subscription_type_id)
+
+    if size > limits.max_file_size:
+        return f"File size exceeds allowed size of {limits.max_file_size} bytes."
+
+    if TaskMediaFiles.objects.filter(task=task_id).count() >= limits.allowed_files_per_task:
+        return f"A task can't have more than {limits.allowed_files_per_task} files."
+
+    return None
+
+
+def parse_content_range(header, size):
+    """
+    returns (start, length) of chunk from a 'bytes start-end/total' header
+    raises UploadError if header is missing or doesn't match upload's size
+    """
+    match = CONTENT_RANGE_RE.match(header or "")
+    if not match:
+        raise UploadError("Content-Range header 'bytes start-end/total' is required.")
+
+    start, end, total = (int(value) for value in match.groups())
+    if end < start:
+        raise UploadError("Invalid Content-Range header.")
+    if total != size:
+        raise UploadError(f"Content-Range total must be upload size {size}.")
+
+    return start, end - start + 1
+
+
+def create_upload(task_id, name, size):
+    """
+    This method starts a chunked upload and creates its empty part file.
+    """
+    os.makedirs(settings.MEDIA_UPLOADS_ROOT, exist_ok=True)
+
+    upload = TaskMediaUpload.objects.create(task_id=task_id, name=name, size=size)
+    open(upload.part_path, "wb").close()
+
+    return upload
+
+
+def lock_task_files(task_id):
+    """
+    This method locks task's row till end of current transaction, so that
+    checking its file count (upload_limits_error) & attaching a file to it
+    aren't interleaved with another request's.
+    """
+    list(Task.objects.select_for_update().filter(id=task_id).values_list("id", flat=True))
+
+
+def write_chunk(upload, stream, start, length):
+    """
+    This method streams length bytes from stream (request) to upload's
+    part file at offset start, reading settings.MEDIA_UPLOAD_CHUNK_READ_SIZE
+    bytes at once. Upload is claimed for settings.MEDIA_UPLOAD_WRITE_LEASE
+    seconds by a conditional update before its bytes are read, a concurrent
+    request writing it gets UploadOffsetMismatch. No transaction is open
+    while bytes are read, however slow the client is. Bytes received before
+    a client disconnects are kept so that the upload can be resumed.
+    returns number of bytes written.
+    """
+    if start + length > upload.size:
+        raise UploadTooLarge(f"Chunk exceeds upload size of {upload.size} bytes.")
+
+    now = get_datetime_now()
+    claimed = TaskMediaUpload.objects.filter(Q(writing_until__isnull=True) | Q(writing_until__lt=now),
+                                             id=upload.id, received=start).update(
+        writing_until=now + timezone.timedelta(seconds=settings.MEDIA_UPLOAD_WRITE_LEASE), updated_datetime=now)
+    if not claimed:
+        upload.refresh_from_db(fields=["received", "writing_until"])
+        if start != upload.received:
+            raise UploadOffsetMismatch(f"Chunk must start at offset {upload.received}.")
+        raise UploadOffsetMismatch("Upload is being written by another request.")
+
+    written = 0
+    try:
+        with open(upload.part_path, "r+b") as part_file:
+            part_file.seek(start)
+            part_file.truncate()
+            while written < length:
+                data = stream.read(min(settings.MEDIA_UPLOAD_CHUNK_READ_SIZE, length - written))
+                if not data:
+                    break
+                part_file.write(data)
+                written += len(data)
+    finally:
+        # no-op if lease expired & another request took the upload over meanwhile
+        updated = TaskMediaUpload.objects.filter(id=upload.id, received=start).update(
+            received=start + written, writing_until=None, updated_datetime=get_datetime_now())
+
+    if not updated:
+        raise UploadOffsetMismatch("Upload is being written by another request.")
+
+    upload.received, upload.writing_until = start + written, None
+    return written
+
+
+def complete_upload(upload):
+    """
+    This method moves a fully received upload to media storage as a
+    TaskMediaFiles object.
+    """
+    if upload.received != upload.size:
+        raise UploadIncomplete(f"Upload has received {upload.received} of {upload.size} bytes.")
+
+    task_file = TaskMediaFiles(task_id=upload.task_id, name=upload.name)
+    task_file.file.save(upload.name, PartFile(None, name=upload.part_path), save=False)
+    task_file.save()
+
+    # part file is moved already, skip TaskMediaUpload.delete
+    TaskMediaUpload.objects.filter(id=upload.id).delete()
+
+    return task_file
+
+
+def remove_expired_uploads():
+    """
+    This method removes incomplete uploads not written since
+    settings.MEDIA_UPLOAD_EXPIRY_TIME seconds.
+    """
+    expired_before = get_datetime_now() - timezone.timedelta(seconds=settings.MEDIA_UPLOAD_EXPIRY_TIME)
+
+    count = 0
+    for upload in TaskMediaUpload.objects.filter(updated_datetime__lt=expired_before):
+        upload.delete()
+        count += 1
+
+    logging.info(f"{count} expired uploads removed.")
+    return count
+
+
+def attach_known_blob(user, task_id, name, size, digest):
+    """
+    This method attaches an already stored file to a task without uploading
+    it again, if one of user's own files has given sha256 digest & size.
+    returns TaskMediaFiles object, None if content isn't known.
+    """
+    file_name = blob_name(digest)
+    if not MediaBlob.objects.filter(digest=digest, size=size, ref_count__gt=0).exists() or \
+            not TaskMediaFiles.objects.filter(task__user=user.id, file=file_name).exists():
+        return None
+
+    task_file = TaskMediaFiles(task_id=task_id, name=name, file=file_name)
+    task_file.save()
+    return task_file
+
+
+def remove_unreferenced_blobs():
+    """
+    This method removes stored files which aren't referenced by any
+    TaskMediaFiles object since settings.MEDIA_BLOB_GRACE_TIME seconds.
+    """
+    removed_before = get_datetime_now() - timezone.timedelta(seconds=settings.MEDIA_BLOB_GRACE_TIME)
+
+    count = 0
+    for digest in MediaBlob.objects.filter(ref_count__lte=0, updated_datetime__lt=removed_before).values_list(
+            "digest", flat=True):
+        # re-checked by delete, blob may have been referenced again meanwhile
+        deleted, _ = MediaBlob.objects.filter(digest=digest, ref_count__lte=0,
+                                              updated_datetime__lt=removed_before).delete()
+        if not deleted:
+            continue
+
+        path = content_addressed_storage.path(blob_name(digest))
+        try:
+            # a recent touch means content was just uploaded again, keep it
+            if os.path.getmtime(path) < removed_before.timestamp():
+                os.remove(path)
+                count += 1
+        except FileNotFoundError:
+            pass
+
+    logging.info(f"{count} unreferenced media blobs removed.")
+    return count
+
+
+def file_etag(task_file, stat):
+    """
+    returns strong ETag of a stored file, sha256 of content if it is known
+    """
+    digest = digest_from_name(task_file.file.name)
+    if digest is None:
+        digest = hashlib.md5(f"{task_file.file.name}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        candidates = [value.strip() for value in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+    if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def parse_range(request, etag, size):
+    """
+    returns (start, end) of requested byte range (end inclusive), None if
+    whole file is to be sent (no/multiple ranges or a stale If-Range)
+    raises ValueError if range can't be satisfied
+    """
+    header = request.META.get("HTTP_RANGE", "")
+    match = RANGE_RE.match(header.replace(" ", ""))
+    if not match:
+        return None
+
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range is not None and if_range != etag:
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:  # suffix range, last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        return None
+
+    if start > end or start >= size:
+        raise ValueError("Range Not Satisfiable")
+
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, "rb") as file_handle:
+        file_handle.seek(start)
+        while length > 0:
+            data = file_handle.read(min(settings.MEDIA_UPLOAD_CHUNK_READ_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def download_response(request, task_file):
+    """
+    This method returns response sending a task file to client, honouring
+    conditional (If-None-Match/If-Modified-Since) and Range requests.
+    """
+    path = task_file.file.path
+    stat = os.stat(path)
+    etag = file_etag(task_file, stat)
+
+    headers = {"ETag": etag,
+               "Last-Modified": http_date(stat.st_mtime),
+               "Accept-Ranges": "bytes",
+               "Content-Disposition": f'attachment; filename="{task_file.name}"'}
+    content_type = mimetypes.guess_type(task_file.name)[0] or "application/octet-stream"
+
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponse(status=304)
+        for header in ("ETag", "Last-Modified"):
+            response[header] = headers[header]
+        return response
+
+    if settings.MEDIA_DOWNLOAD_OFFLOAD == OFFLOAD_X_ACCEL_REDIRECT:
+        # nginx serves the file (and Range requests) from an internal location
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT_LOCATION + task_file.file.name
+    elif settings.MEDIA_DOWNLOAD_OFFLOAD == OFFLOAD_X_SENDFILE:
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = path
+    else:
+        try:
+            byte_range = parse_range(request, etag, stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+            return response
+
+        if byte_range is None:
+            response = FileResponse(open(path, "rb"), content_type=content_type)
+            response["Content-Length"] = stat.st_size
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(_read_range(path, start, end - start + 1), status=206,
+                                             content_type=content_type)
+            response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            response["Content-Length"] = end - start + 1
+
+    for header, value in headers.items():
+        response[header] = value
+
+    return response
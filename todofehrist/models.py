@@ -2,14 +2,23 @@
     Contains all models for todofehrist application
 """
 import os
+import uuid
 from enum import Enum
 
-from django.db import models
+from django.db import models, connections, router, transaction, IntegrityError, DEFAULT_DB_ALIAS
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.contrib.postgres.search import SearchVectorField
 from django.conf import settings
 from django.db.models import F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
 
 from todofehrist.models_utility import get_datetime_now, get_expiry_datetime
+from todofehrist import search
+from todofehrist.password_hashing import set_password
+from todofehrist.report_cache import invalidate_reports
+from todofehrist.storage import content_addressed_storage, digest_from_name
+from todofehrist.subscriptions import subscription_registry
 
 
 class UserSubscriptionTypesEnum(Enum):
@@ -49,7 +58,8 @@ class UserManager(BaseUserManager):
 
         email_address = self.normalize_email(email_address)
         user = self.model(email=email_address, username=email_address)
-        user.set_password(password)
+        # hashed by hashing executor, see todofehrist.password_hashing
+        set_password(user, password)
         user.subscription_type = subscription_type
         user.save()
 
@@ -88,6 +98,8 @@ class User(AbstractUser):
     is_email_verified = models.BooleanField(default=False)
     is_oauth = models.BooleanField(default=False)
     updated_datetime = models.DateTimeField(default=get_datetime_now)
+    # signed login tokens issued (time.time()) at or before this are revoked (see todofehrist.auth_tokens)
+    tokens_valid_after = models.FloatField(default=0)
 
     class Meta:
         """
@@ -103,7 +115,7 @@ class UserLogin(models.Model):
         Custom Django Model for Login/Auth handling of AppUser.
     """
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    token = models.CharField(max_length=256)
+    token = models.CharField(max_length=256, db_index=True)
     created_at = models.DateTimeField(default=get_datetime_now)
     expire_at = models.DateTimeField(default=get_expiry_datetime)
 
@@ -123,6 +135,47 @@ class UserLogin(models.Model):
         super(UserLogin, self).save(*args, **kwargs)
 
 
+class RevokedToken(models.Model):
+    """
+        Maintain revoked (e.g. logged out) signed login tokens by their
+        unique id, until they expire (see todofehrist.auth_tokens)
+    """
+    jti = models.CharField(max_length=32, primary_key=True)
+    expire_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        """
+            Define Database Table Metadata
+        """
+        db_table = 'revoked_token'
+
+
+class UserQuotaManagementManager(models.Manager):
+    """
+        Manager class for UserQuotaManagement
+    """
+
+    def reserve_tasks(self, user_id, count, max_allowed_tasks):
+        """
+        This method increments user's total_tasks by count if it stays within
+        max_allowed_tasks, creating user's quota row if it doesn't exist yet.
+        Check & increment happen in a single (upsert) statement.
+        returns True if quota is reserved, False if quota limit is reached.
+        """
+        table = self.model._meta.db_table
+        query = f"""
+            INSERT INTO {table} (user_id, total_tasks, downloaded_file_count, uploaded_files_count)
+            SELECT %s, %s, 0, 0 WHERE %s <= %s
+            ON CONFLICT (user_id) DO UPDATE SET total_tasks = {table}.total_tasks + excluded.total_tasks
+            WHERE {table}.total_tasks + excluded.total_tasks <= %s
+            RETURNING total_tasks
+        """
+        using = self._db or router.db_for_write(self.model)
+        with connections[using].cursor() as cursor:
+            cursor.execute(query, [user_id, count, count, max_allowed_tasks, max_allowed_tasks])
+            return cursor.fetchone() is not None
+
+
 class UserQuotaManagement(models.Model):
     """
         Custom Django Model for logging application usage for AppUser.
@@ -134,6 +187,8 @@ class UserQuotaManagement(models.Model):
     uploaded_files_count = models.IntegerField(default=0)
     last_uploaded_datetime = models.DateTimeField(null=True)
 
+    objects = UserQuotaManagementManager()
+
 
 class UserSubscriptionLimits(models.Model):
     """
@@ -162,51 +217,470 @@ class Task(models.Model):
     files_count = models.IntegerField(default=0)
     created_datetime = models.DateTimeField(default=get_datetime_now)
     updated_datetime = models.DateTimeField(default=get_datetime_now)
+    # weighted title & description lexemes, indexed by GIN index (see todofehrist.search)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ['-pk']
 
+    # fields whose changes are counted in UserTaskStatistics & UserDailyTaskRollup
+    TRACKED_FIELDS = ('created_datetime', 'completion_status', 'completion_datetime')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_saved_state()
+        return instance
+
+    def remember_saved_state(self):
+        """
+        keeps values of TRACKED_FIELDS as stored in database
+        """
+        self.saved_state = {field: getattr(self, field) for field in self.TRACKED_FIELDS}
+
+    def saved_value(self, field):
+        """
+        returns value of a tracked field as stored in database
+        """
+        return getattr(self, "saved_state", {}).get(field, getattr(self, field))
+
     def save(self, *args, **kwargs):
 
-        max_allowed_tasks = UserSubscriptionLimits.objects.get(
-            subscription_type=self.user.subscription_type).max_allowed_tasks
-
-        # Update the total tasks count for user
-        success = UserQuotaManagement.objects.filter(user=self.user, total_tasks__lt=max_allowed_tasks).update(
-            total_tasks=F("total_tasks")+1)
-        if success == 0:  # couldn't update or find
-            query_obj, success = UserQuotaManagement.objects.get_or_create(user=self.user)
-            if success:  # new object is created
-                query_obj.total_tasks = 1
-                query_obj.save()
-            else:  # object already exists and thus has  total_tasks >= max_allowed_tasks
+        max_allowed_tasks = subscription_registry.limits(self.user.subscription_type_id).max_allowed_tasks
+
+        with transaction.atomic():
+            # Update the total tasks count for user
+            if not UserQuotaManagement.objects.reserve_tasks(self.user_id, 1, max_allowed_tasks):
                 raise ValueError("User Quota for Task Creation Reached.")
 
-        super(Task, self).save(*args, **kwargs)
+            self.search_vector = search.search_vector_for(self)
+            super(Task, self).save(*args, **kwargs)
+            UserTaskStatistics.objects.record(self.user_id, created=[self])
+        self.remember_saved_state()
+        search.index_task(self)
 
     def update(self, *args, **kwargs):
         self.updated_datetime = get_datetime_now()
-        super(Task, self).save(*args, **kwargs)
+        self.search_vector = search.search_vector_for(self)
+        with transaction.atomic():
+            super(Task, self).save(*args, **kwargs)
+            UserTaskStatistics.objects.record(self.user_id, updated=[self])
+        self.remember_saved_state()
+        search.index_task(self)
 
     def delete(self, *args, **kwargs):
 
-        UserQuotaManagement.objects.filter(user=self.user).update(total_tasks=F('total_tasks')-1)
-        super(Task, self).delete()
+        with transaction.atomic():
+            UserQuotaManagement.objects.filter(user=self.user_id).update(total_tasks=F('total_tasks')-1)
+            super(Task, self).delete()
+            UserTaskStatistics.objects.record(self.user_id, deleted=[self])
+        search.remove_task(self)
+
+
+class UserTaskStatisticsManager(models.Manager):
+    """
+        Manager class for UserTaskStatistics
+    """
+
+    @staticmethod
+    def weekday_field(created_datetime):
+        """
+        returns name of created_on_* field counting tasks created on datetime's weekday
+        """
+        # isoweekday counts 1 as Monday, same weekday as ExtractWeekDay in current time zone
+        return UserTaskStatistics.WEEKDAY_FIELDS[timezone.localtime(created_datetime).isoweekday() % 7]
+
+    def record(self, user_id, created=(), updated=(), deleted=()):
+        """
+        This method updates a user's statistics (and marks daily rollups
+        stale) for created, updated & deleted tasks. It has to be called
+        after tasks are written, in the same transaction.
+        """
+        deltas = {}
+        stale_dates = set()
+
+        def add(task, sign, saved):
+            value = task.saved_value if saved else lambda field: getattr(task, field)
+            deltas["total_tasks"] = deltas.get("total_tasks", 0) + sign
+            weekday_field = self.weekday_field(value("created_datetime"))
+            deltas[weekday_field] = deltas.get(weekday_field, 0) + sign
+            stale_dates.add(timezone.localtime(value("created_datetime")).date())
+            if value("completion_status"):
+                deltas["complete_tasks"] = deltas.get("complete_tasks", 0) + sign
+                if value("completion_datetime"):
+                    stale_dates.add(timezone.localtime(value("completion_datetime")).date())
+
+        for task in created:
+            add(task, 1, saved=False)
+        for task in deleted:
+            add(task, -1, saved=True)
+        for task in updated:
+            if any(task.saved_value(field) != getattr(task, field) for field in Task.TRACKED_FIELDS):
+                # counted as replacing the stored task by its new version
+                add(task, -1, saved=True)
+                add(task, 1, saved=False)
+
+        UserDailyTaskRollup.objects.mark_stale(user_id, stale_dates)
+        if stale_dates:
+            # reports cached before this change are outdated once it is committed
+            transaction.on_commit(lambda: invalidate_reports(user_id))
+
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if not deltas:
+            return
+
+        if not self.filter(user=user_id).update(**{field: F(field) + delta for field, delta in deltas.items()}):
+            # first change of user's tasks since statistics exist, count all of them
+            self.rebuild(user_ids=[user_id])
+
+    def rebuild(self, user_ids=None):
+        """
+        This method (re)computes statistics of given users (all users if None)
+        from Task table in one aggregate query, fixing any drift. Task table
+        is read in the transaction writing statistics, so from primary (or
+        database of db_manager()) even within emumbaproject.db_router.replica_reads().
+        returns number of users rebuilt.
+        """
+        aggregates = {"total_tasks": models.Count("id"),
+                      "complete_tasks": models.Count("id", filter=models.Q(completion_status=True))}
+        for week_day, field in enumerate(UserTaskStatistics.WEEKDAY_FIELDS, start=1):
+            aggregates[field] = models.Count("id", filter=models.Q(created_datetime__week_day=week_day))
+
+        # routed as a write, which pins a user reading within replica_reads() to primary
+        using = self._db or router.db_for_write(self.model)
+        with transaction.atomic(using=using):
+            tasks = Task.objects.using(using).order_by()
+            if user_ids is not None:
+                tasks = tasks.filter(user__in=user_ids)
+            rows = {row.pop("user"): row for row in tasks.values("user").annotate(**aggregates)}
+
+            # users without tasks get an empty row
+            for user_id in (user_ids if user_ids is not None else []):
+                rows.setdefault(user_id, {field: 0 for field in aggregates})
+
+            for user_id, counts in rows.items():
+                self.using(using).update_or_create(user_id=user_id, defaults=counts)
+
+        return len(rows)
+
+    def for_user(self, user_id):
+        """
+        returns statistics of a user, computed once if not maintained yet
+        """
+        try:
+            return self.get(user=user_id)
+        except self.model.DoesNotExist:
+            self.rebuild(user_ids=[user_id])
+            # a replica may not have it yet
+            return self.using(self._db or DEFAULT_DB_ALIAS).get(user=user_id)
+
+
+class UserTaskStatistics(models.Model):
+    """
+        Maintain counts of User's tasks used by reports, kept current by Task
+        model methods (see UserTaskStatisticsManager.record) instead of
+        aggregating Task table on every report request.
+    """
+    WEEKDAY_FIELDS = ("created_on_sun", "created_on_mon", "created_on_tue", "created_on_wed",
+                      "created_on_thu", "created_on_fri", "created_on_sat")
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True)
+    total_tasks = models.IntegerField(default=0)
+    complete_tasks = models.IntegerField(default=0)
+    # tasks created per weekday (in TIME_ZONE)
+    created_on_sun = models.IntegerField(default=0)
+    created_on_mon = models.IntegerField(default=0)
+    created_on_tue = models.IntegerField(default=0)
+    created_on_wed = models.IntegerField(default=0)
+    created_on_thu = models.IntegerField(default=0)
+    created_on_fri = models.IntegerField(default=0)
+    created_on_sat = models.IntegerField(default=0)
+    rollups_built = models.BooleanField(default=False)  # UserDailyTaskRollup rows exist for all days
+
+    objects = UserTaskStatisticsManager()
+
+    @property
+    def incomplete_tasks(self):
+        """
+        returns count of user's pending tasks
+        """
+        return self.total_tasks - self.complete_tasks
+
+
+class MediaBlobManager(models.Manager):
+    """
+        Manager class for MediaBlob, counts TaskMediaFiles referencing a blob
+    """
+
+    def acquire(self, sender, instance, created, raw=False, **kwargs):
+        """
+        increments reference count of a saved TaskMediaFiles object's blob,
+        connected to TaskMediaFiles' post_save signal in todofehrist.apps
+        """
+        digest = digest_from_name(instance.file.name)
+        if not created or raw or digest is None:
+            return
+
+        now = get_datetime_now()
+        if self.filter(digest=digest).update(ref_count=F('ref_count') + 1, updated_datetime=now):
+            return
+
+        try:
+            with transaction.atomic():
+                self.create(digest=digest, size=instance.file.size, ref_count=1, updated_datetime=now)
+        except IntegrityError:  # created by a concurrent upload of same content
+            self.filter(digest=digest).update(ref_count=F('ref_count') + 1, updated_datetime=now)
+
+    def release(self, sender, instance, **kwargs):
+        """
+        decrements reference count of a deleted TaskMediaFiles object's blob,
+        connected to TaskMediaFiles' post_delete signal (which is sent for
+        cascaded deletes too). Unreferenced blobs are removed later by
+        todofehrist.media.remove_unreferenced_blobs.
+        """
+        digest = digest_from_name(instance.file.name)
+        if digest is None:
+            # file stored before content addressed storage, referenced only by this row
+            if instance.file:
+                instance.file.storage.delete(instance.file.name)
+            return
+
+        self.filter(digest=digest).update(ref_count=F('ref_count') - 1, updated_datetime=get_datetime_now())
+
+
+class MediaBlob(models.Model):
+    """
+        Maintain reference count of a file stored in content addressed storage
+    """
+    digest = models.CharField(max_length=64, primary_key=True)  # sha256 of content
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_datetime = models.DateTimeField(default=get_datetime_now)
+    updated_datetime = models.DateTimeField(default=get_datetime_now)
+
+    objects = MediaBlobManager()
 
 
 class TaskMediaFiles(models.Model):
     """
-        Maintain Uploaded files by User for a Task
+        Maintain Uploaded files by User for a Task, files are stored (once
+        per distinct content) by todofehrist.storage.ContentAddressedStorage
     """
     task = models.ForeignKey(Task, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
-    file = models.FileField()
+    file = models.FileField(storage=content_addressed_storage, max_length=200)
     uploaded_datetime = models.DateTimeField(default=get_datetime_now)
     last_accessed_datetime = models.DateTimeField(null=True)
     is_deleted = models.BooleanField(default=False)
 
+
+class TaskMediaUpload(models.Model):
+    """
+        Maintain state of a resumable (chunked) file upload for a Task,
+        received bytes are stored in a part file until upload is complete.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    task = models.ForeignKey(Task, on_delete=models.CASCADE)
+    name = models.CharField(max_length=50)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    writing_until = models.DateTimeField(null=True)  # lease of request writing a chunk, see todofehrist.media
+    created_datetime = models.DateTimeField(default=get_datetime_now)
+    updated_datetime = models.DateTimeField(default=get_datetime_now)
+
+    @property
+    def part_path(self):
+        """
+        returns path of file containing bytes received till now
+        """
+        return os.path.join(settings.MEDIA_UPLOADS_ROOT, f"{self.id}.part")
+
     def delete(self, using=None, keep_parents=False):
-        # delete file from local system
-        if self.file and os.path.isfile(self.file.path):
-            os.remove(self.file.path)
-        super(TaskMediaFiles, self).delete()
+        # delete partially uploaded file from local system
+        if os.path.isfile(self.part_path):
+            os.remove(self.part_path)
+        super(TaskMediaUpload, self).delete()
+
+
+class UserDailyTaskRollupManager(models.Manager):
+    """
+        Manager class for UserDailyTaskRollup
+    """
+
+    def mark_stale(self, user_id, dates):
+        """
+        This method marks rollups of a user's given dates for recomputation,
+        called by UserTaskStatisticsManager.record along with task changes.
+        """
+        if not dates:
+            return
+
+        if self.filter(user=user_id, date__in=dates).update(is_stale=True, version=F('version') + 1) < len(dates):
+            self.bulk_create([self.model(user_id=user_id, date=date, is_stale=True) for date in dates],
+                             ignore_conflicts=True)
+
+    @staticmethod
+    def _day_counts(tasks, date_field):
+        """
+        returns {(user_id, date): count} of tasks grouped by date of a datetime field
+        """
+        rows = tasks.order_by().annotate(day=TruncDate(date_field)).values("user", "day").annotate(
+            count=models.Count("id")).values_list("user", "day", "count")
+        return {(user_id, day): count for user_id, day, count in rows}
+
+    def refresh(self, user_id=None, limit=None):
+        """
+        This method recomputes stale rollups (of a user if given, at most limit
+        rows) from Task table, two aggregate queries per user. They're read
+        from primary even within emumbaproject.db_router.replica_reads(), a
+        replica may not have latest tasks or stale marks yet.
+        returns number of rollups refreshed.
+        """
+        stale = self.using(DEFAULT_DB_ALIAS).filter(is_stale=True).order_by("user", "date")
+        if user_id is not None:
+            stale = stale.filter(user=user_id)
+        rows = list(stale.values_list("id", "user", "date", "version")[:limit])
+        if not rows:
+            return 0
+
+        # reads in a transaction go to primary too
+        with transaction.atomic():
+            dates_by_user = {}
+            for _, row_user_id, date, _ in rows:
+                dates_by_user.setdefault(row_user_id, []).append(date)
+
+            created, completed = {}, {}
+            for row_user_id, dates in dates_by_user.items():
+                tasks = Task.objects.filter(user=row_user_id)
+                created.update(self._day_counts(tasks.filter(created_datetime__date__in=dates), "created_datetime"))
+                completed.update(self._day_counts(tasks.filter(completion_status=True,
+                                                               completion_datetime__date__in=dates),
+                                                  "completion_datetime"))
+
+            refreshed = 0
+            for rollup_id, row_user_id, date, version in rows:
+                # a row marked stale again meanwhile (version changed) waits for next refresh
+                refreshed += self.filter(id=rollup_id, version=version).update(
+                    created_count=created.get((row_user_id, date), 0),
+                    completed_count=completed.get((row_user_id, date), 0), is_stale=False)
+
+        return refreshed
+
+    def rebuild(self, user_ids=None):
+        """
+        This method (re)computes all rollups of given users (all users if None),
+        reading tasks in the transaction writing rollups (on primary, as refresh,
+        or database of db_manager()). Rebuilding pins user of current request
+        to primary, see emumbaproject.db_router.
+        returns number of rollups written.
+        """
+        # routed as a write, which pins a user reading within replica_reads() to primary
+        using = self._db or router.db_for_write(self.model)
+        with transaction.atomic(using=using):
+            tasks = Task.objects.using(using)
+            if user_ids is not None:
+                tasks = tasks.filter(user__in=user_ids)
+
+            created = self._day_counts(tasks, "created_datetime")
+            completed = self._day_counts(tasks.filter(completion_status=True, completion_datetime__isnull=False),
+                                         "completion_datetime")
+
+            rollups = [self.model(user_id=user_id, date=date, created_count=created.get((user_id, date), 0),
+                                  completed_count=completed.get((user_id, date), 0))
+                       for user_id, date in set(created) | set(completed)]
+
+            existing = self.using(using) if user_ids is None else self.using(using).filter(user__in=user_ids)
+            existing.delete()
+            self.using(using).bulk_create(rollups, batch_size=1000)
+
+            statistics = UserTaskStatistics.objects.using(using)
+            if user_ids is not None:
+                statistics = statistics.filter(user__in=user_ids)
+            statistics.update(rollups_built=True)
+
+        return len(rollups)
+
+    def for_user(self, user_id, date_from=None, date_to=None, statistics=None):
+        """
+        returns queryset of a user's current rollups between (inclusive) dates,
+        building or refreshing them first if needed (on primary), only the
+        returned queryset may be read from a replica. statistics is user's
+        UserTaskStatistics object, if already fetched.
+        """
+        statistics = statistics or UserTaskStatistics.objects.for_user(user_id)
+        rollups = self.all()
+        if not statistics.rollups_built:
+            self.rebuild(user_ids=[user_id])
+            # a replica may not have them yet
+            rollups = self.using(self._db or DEFAULT_DB_ALIAS)
+        elif self.refresh(user_id=user_id):
+            rollups = self.using(self._db or DEFAULT_DB_ALIAS)
+
+        rollups = rollups.filter(user=user_id)
+        if date_from is not None:
+            rollups = rollups.filter(date__gte=date_from)
+        if date_to is not None:
+            rollups = rollups.filter(date__lte=date_to)
+
+        return rollups
+
+
+class UserDailyTaskRollup(models.Model):
+    """
+        Maintain count of tasks a User created & completed on a day (in
+        TIME_ZONE), date based reports aggregate these rows instead of Task
+        table. Task changes mark rows stale, stale rows are recomputed by a
+        periodic task and before a user's report is generated.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    date = models.DateField()
+    created_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    is_stale = models.BooleanField(default=False, db_index=True)
+    version = models.IntegerField(default=0)  # incremented whenever marked stale
+
+    objects = UserDailyTaskRollupManager()
+
+    class Meta:
+        unique_together = ('user', 'date')
+
+
+class TaskReminderLog(models.Model):
+    """
+        Maintain pending tasks reminders sent to Users, makes reminder job
+        idempotent (see todofehrist.reminders)
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    date = models.DateField()  # due date of reminded tasks
+    sent_datetime = models.DateTimeField(default=get_datetime_now)
+
+    class Meta:
+        unique_together = ('user', 'date')
+
+
+class OutboundEmail(models.Model):
+    """
+        Maintain emails queued by requests & sent by Celery workers
+        (see todofehrist.mail_queue)
+    """
+    PENDING = 'PENDING'
+    SENDING = 'SENDING'  # claimed by a worker
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+
+    subject = models.CharField(max_length=200)
+    to = models.JSONField()  # list of email addresses
+    body = models.TextField(blank=True)  # html body, rendered from template_name if empty
+    template_name = models.CharField(max_length=100, blank=True)
+    context = models.JSONField(default=dict)  # emptied once sent or given up, it holds account tokens
+    status = models.CharField(max_length=10, default=PENDING,
+                              choices=[(PENDING, PENDING), (SENDING, SENDING), (SENT, SENT), (FAILED, FAILED)])
+    attempts = models.IntegerField(default=0)
+    last_error = models.CharField(max_length=300, blank=True)
+    next_attempt_datetime = models.DateTimeField(default=get_datetime_now)
+    claimed_datetime = models.DateTimeField(null=True)
+    created_datetime = models.DateTimeField(default=get_datetime_now)
+    sent_datetime = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_datetime'])]
@@ -0,0 +1,184 @@
+"""
+    Contains Google id_token verification used by SocialAuthLogin
+    =============================================================
+
+    google.oauth2.id_token.verify_oauth2_token fetches Google's signing
+    certificates over a new HTTP transport for every token it verifies, so
+    social logins wait on (and fail with) Google's certificate endpoint.
+    Here instead:
+
+    - certificates are fetched over one pooled requests.Session and kept
+      as long as their Cache-Control max-age (or Expires) header allows,
+    - they're refreshed in a background thread once less than
+      settings.GOOGLE_OAUTH_CERTS_REFRESH_AHEAD seconds of that are left,
+      and cached ones keep being used while Google's endpoint fails (keys
+      are published well before & stay published after they sign tokens),
+    - certificates are refetched early for a token signed by a key not
+      among them, at most once in GOOGLE_OAUTH_CERTS_MIN_REFETCH seconds,
+    - verified tokens are memoized (by their digest) until they expire.
+"""
+import email.utils
+import logging
+import re
+import threading
+import time
+
+import requests
+from django.conf import settings
+from google.auth import exceptions, jwt
+
+from todofehrist.auth_tokens import LRUCache, token_digest
+
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+
+def max_age(headers, default):
+    """
+    returns seconds a response can be cached for as per its Cache-Control
+    (less its Age) or Expires header, default if it has neither
+    """
+    match = MAX_AGE_PATTERN.search(headers.get("Cache-Control", ""))
+    if match:
+        return max(int(match.group(1)) - int(headers.get("Age", "0") or 0), 0)
+
+    try:
+        expires = email.utils.parsedate_to_datetime(headers["Expires"])
+    except (KeyError, TypeError, ValueError):
+        return default
+    return max(expires.timestamp() - time.time(), 0)
+
+
+class CertificateCache:
+    """
+        Certificates ({key id: certificate}) served at url, fetched by session
+    """
+
+    def __init__(self, url, session, timeout=5, default_max_age=60 * 60, refresh_ahead=5 * 60,
+                 min_refetch=60):
+        self.url = url
+        self.session = session
+        self.timeout = timeout
+        self.default_max_age = default_max_age
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch = min_refetch
+
+        self._certs = None
+        self._expires = 0  # time.monotonic() certificates expire at
+        self._fetched = float("-inf")  # time.monotonic() of last fetch attempt
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        self._refreshing_lock = threading.Lock()
+
+    def get(self, key_id=None):
+        """
+        returns certificates, fetched first if none are cached, cached ones
+        expired or key_id isn't one of them
+        """
+        certs, expires, now = self._certs, self._expires, time.monotonic()
+        if certs is None or now >= expires:
+            return self.refresh()
+        if key_id is not None and key_id not in certs:
+            # signed by a key published after certificates were fetched
+            return self.refresh(min_age=self.min_refetch)
+        if expires - now <= self.refresh_ahead:
+            self._refresh_in_background()
+        return certs
+
+    def _fetch(self):
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json(), max_age(response.headers, self.default_max_age)
+
+    def refresh(self, min_age=0):
+        """
+        fetches certificates (once for callers waiting at the same time) unless
+        they were fetched within last min_age seconds, and returns them.
+        Cached certificates are kept (and retried after min_refetch seconds)
+        if fetching fails, with no cached ones its error is raised.
+        """
+        requested = time.monotonic()
+        with self._fetch_lock:
+            if self._certs is not None and self._fetched >= requested - min_age:
+                return self._certs
+
+            self._fetched = time.monotonic()
+            try:
+                certs, seconds = self._fetch()
+            except (requests.RequestException, ValueError) as exception_:
+                if self._certs is None:
+                    raise exceptions.TransportError(
+                        f"Could not fetch certificates at {self.url}: {exception_}") from exception_
+                logging.warning(f"Could not refresh certificates at {self.url}, using cached ones: {exception_}")
+                self._expires = max(self._expires, self._fetched + self.min_refetch)
+                return self._certs
+
+            self._certs, self._expires = certs, self._fetched + seconds
+            return certs
+
+    def _refresh_in_background(self):
+        with self._refreshing_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name="todofehrist-certs-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh(min_age=self.min_refetch)
+        except exceptions.TransportError as exception_:
+            logging.warning(exception_)
+        finally:
+            with self._refreshing_lock:
+                self._refreshing = False
+
+
+class GoogleTokenVerifier:
+    """
+        Verifies Google id_tokens issued for audience against certificates
+        (a CertificateCache), memoizing verified ones until they expire
+    """
+
+    def __init__(self, audience, certificates, cache_size=10000, issuers=GOOGLE_ISSUERS):
+        self.audience = audience
+        self.certificates = certificates
+        self.issuers = issuers
+        # google id_tokens are valid for an hour
+        self._verified = LRUCache(cache_size, 60 * 60)
+
+    def verify(self, token):
+        """
+        returns decoded claims of token, raises ValueError or
+        google.auth.exceptions.GoogleAuthError for an invalid token
+        """
+        digest = token_digest(token)
+        idinfo = self._verified.get(digest)
+        if idinfo is not None:
+            return idinfo
+
+        certs = self.certificates.get(jwt.decode_header(token).get("kid"))
+        idinfo = jwt.decode(token, certs=certs, audience=self.audience)
+        if idinfo["iss"] not in self.issuers:
+            raise exceptions.GoogleAuthError(f"Wrong issuer. 'iss' should be one of {self.issuers}.")
+
+        self._verified.set(digest, idinfo, idinfo["exp"] - time.time())
+        return idinfo
+
+
+# one session, so that its connections to certificate endpoint are reused
+session = requests.Session()
+
+google_verifier = GoogleTokenVerifier(
+    settings.GOOGLE_OAUTH_CLIENT_ID,
+    CertificateCache(settings.GOOGLE_OAUTH_CERTS_URL, session, timeout=settings.GOOGLE_OAUTH_CERTS_TIMEOUT,
+                     refresh_ahead=settings.GOOGLE_OAUTH_CERTS_REFRESH_AHEAD,
+                     min_refetch=settings.GOOGLE_OAUTH_CERTS_MIN_REFETCH),
+    cache_size=settings.GOOGLE_OAUTH_TOKEN_CACHE_SIZE)
+
+
+def verify_google_token(token):
+    """
+    returns decoded claims of a Google id_token issued for settings.GOOGLE_OAUTH_CLIENT_ID
+    """
+    return google_verifier.verify(token)
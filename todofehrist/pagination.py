@@ -0,0 +1,130 @@
+"""
+    Contains keyset (cursor) based pagination used by todofehrist.views
+    ===================================================================
+
+    Unlike django's Paginator, which issues a COUNT(*) and an OFFSET query
+    for every page, keyset pagination seeks directly to the first row of a
+    page using values of the ordering fields of its neighbouring row, so
+    every page costs the same irrespective of how deep a client scrolls.
+
+    A cursor is an opaque string which encodes ordering field values of
+    the row it points to, pagination direction and offset of that row (to
+    report from/to fields of a page without counting rows).
+"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from django.db.models import Q
+
+DIRECTION_NEXT = "n"
+DIRECTION_PREV = "p"
+
+KeysetPage = namedtuple("KeysetPage", ["items", "start_index", "end_index", "next_cursor", "prev_cursor"])
+
+
+class InvalidCursor(ValueError):
+    """
+        Raised when a cursor string can't be decoded
+    """
+
+
+def encode_cursor(values, offset, direction):
+    """
+    returns an opaque cursor string for given ordering values
+    """
+    data = json.dumps({"v": values, "o": offset, "d": direction}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    returns (values, offset, direction) decoded from cursor string
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values, offset, direction = data["v"], int(data["o"]), data["d"]
+    except (ValueError, TypeError, KeyError, binascii.Error) as exception_:
+        raise InvalidCursor("Invalid cursor provided.") from exception_
+
+    if direction not in (DIRECTION_NEXT, DIRECTION_PREV) or not isinstance(values, list) or offset < 0:
+        raise InvalidCursor("Invalid cursor provided.")
+
+    return values, offset, direction
+
+
+class KeysetPaginator:
+    """
+        Paginates a queryset on given ordering fields, last field must be unique
+        (e.g. pk) so that every row has a distinct position.
+    """
+
+    def __init__(self, queryset, page_size, ordering=("-pk",)):
+        self.queryset = queryset
+        self.page_size = page_size
+        self.ordering = [(field.lstrip("-"), field.startswith("-")) for field in ordering]
+
+    def _ordering(self, reverse=False):
+        return [f"-{name}" if descending != reverse else name for name, descending in self.ordering]
+
+    def _seek_filter(self, values, forward):
+        """
+        returns Q object selecting rows after (forward) or before given values
+        e.g. for ordering (-a, -b): a < v1 OR (a = v1 AND b < v2)
+        """
+        if len(values) != len(self.ordering):
+            raise InvalidCursor("Invalid cursor provided.")
+
+        seek = Q()
+        for index, (name, descending) in enumerate(self.ordering):
+            lookup = "lt" if descending == forward else "gt"
+            condition = Q(**{f"{name}__{lookup}": values[index]})
+            for prev_index, (prev_name, _) in enumerate(self.ordering[:index]):
+                condition &= Q(**{prev_name: values[prev_index]})
+            seek |= condition
+
+        return seek
+
+    def _values(self, item):
+        return [getattr(item, name) for name, _ in self.ordering]
+
+    def page(self, cursor=None):
+        """
+        returns KeysetPage for given cursor, first page if cursor is None
+        raises InvalidCursor if cursor can't be decoded
+        """
+        offset, direction = 0, DIRECTION_NEXT
+        queryset = self.queryset.order_by(*self._ordering())
+
+        if cursor:
+            values, offset, direction = decode_cursor(cursor)
+            if direction == DIRECTION_NEXT:
+                queryset = queryset.filter(self._seek_filter(values, forward=True))
+            else:
+                queryset = self.queryset.filter(self._seek_filter(values, forward=False)).order_by(
+                    *self._ordering(reverse=True))
+
+        items = list(queryset[:self.page_size + 1])
+        has_more = len(items) > self.page_size
+        items = items[:self.page_size]
+
+        if direction == DIRECTION_PREV:
+            items.reverse()
+            start_index = max(offset - len(items), 0)
+            has_next, has_prev = True, has_more
+        else:
+            start_index = offset
+            has_next, has_prev = has_more, offset > 0
+
+        next_cursor = prev_cursor = None
+        if items:
+            end_index = start_index + len(items)
+            if has_next:
+                next_cursor = encode_cursor(self._values(items[-1]), end_index, DIRECTION_NEXT)
+            if has_prev:
+                prev_cursor = encode_cursor(self._values(items[0]), start_index, DIRECTION_PREV)
+        else:
+            end_index = start_index
+
+        return KeysetPage(items, start_index + 1 if items else 0, end_index, next_cursor, prev_cursor)
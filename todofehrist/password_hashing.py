@@ -0,0 +1,150 @@
+"""
+    Contains password hashing executor used by login, signup & password reset
+    =========================================================================
+
+    Password hashes (PBKDF2 by default) are deliberately slow, computed in
+    a request thread they hold a core for tens of milliseconds each, so a
+    burst of logins slows every other endpoint served by the process. They
+    are computed by an executor instead (settings.PASSWORD_HASHING_EXECUTOR):
+
+    - process: a pool of settings.PASSWORD_HASHING_WORKERS processes per
+      web process, so hashing uses at most that many cores,
+    - thread: a pool of as many threads,
+    - inline: the calling thread (as django does).
+
+    At most settings.PASSWORD_HASHING_MAX_PENDING hashes wait for or run
+    in the executor of a process, a request beyond gets PasswordHashingBusy
+    (answered with 429 Too Many Requests) instead of queueing up behind
+    them. Logins are throttled per email & IP before any hashing, see
+    todofehrist.throttling.
+
+    A password whose hash was made by another hasher or by other hasher
+    parameters (e.g. fewer PBKDF2 iterations) is rehashed on a successful
+    login, as by django's User.check_password.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import check_password as django_check_password, make_password
+
+EXECUTOR_PROCESS = "process"
+EXECUTOR_THREAD = "thread"
+EXECUTOR_INLINE = "inline"
+
+
+class PasswordHashingBusy(Exception):
+    """
+        Too many passwords are being hashed by this process already
+    """
+
+
+def _init_process():
+    # processes aren't forked (see _get_executor), they start with django unconfigured
+    django.setup()
+
+
+def _hash(raw_password):
+    return make_password(raw_password)
+
+
+def _check(raw_password, encoded):
+    """
+    returns (password is correct, new hash if it must be rehashed else None)
+    """
+    rehashed = []
+    correct = django_check_password(raw_password, encoded,
+                                    setter=lambda raw_password_: rehashed.append(make_password(raw_password_)))
+    return correct, rehashed[0] if rehashed else None
+
+
+_executor = None
+_executor_key = None  # (kind, workers, pid) executor was created for
+_executor_lock = threading.Lock()
+_pending = None
+_pending_key = None
+
+
+def _get_executor():
+    """
+    returns executor as per settings (None for inline), a forked process creates its own
+    """
+    global _executor, _executor_key
+
+    key = (settings.PASSWORD_HASHING_EXECUTOR, settings.PASSWORD_HASHING_WORKERS, os.getpid())
+    with _executor_lock:
+        if _executor_key != key:
+            if _executor is not None and _executor_key[2] == os.getpid():
+                _executor.shutdown(wait=False)
+
+            _executor = None
+            if settings.PASSWORD_HASHING_EXECUTOR == EXECUTOR_PROCESS:
+                # forking a process running threads (metrics flush, request log listener) can copy
+                # locks they hold & deadlock the child, so processes start from a clean interpreter
+                start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _executor = ProcessPoolExecutor(settings.PASSWORD_HASHING_WORKERS, initializer=_init_process,
+                                                mp_context=multiprocessing.get_context(start_method))
+            elif settings.PASSWORD_HASHING_EXECUTOR == EXECUTOR_THREAD:
+                _executor = ThreadPoolExecutor(settings.PASSWORD_HASHING_WORKERS,
+                                               thread_name_prefix="todofehrist-hashing")
+            _executor_key = key
+        return _executor
+
+
+def _get_pending():
+    global _pending, _pending_key
+
+    with _executor_lock:
+        if _pending_key != settings.PASSWORD_HASHING_MAX_PENDING:
+            _pending = threading.BoundedSemaphore(settings.PASSWORD_HASHING_MAX_PENDING)
+            _pending_key = settings.PASSWORD_HASHING_MAX_PENDING
+        return _pending
+
+
+def run(func, *args):
+    """
+    runs func(*args) by hashing executor and returns its result, raises
+    PasswordHashingBusy if PASSWORD_HASHING_MAX_PENDING calls are pending
+    """
+    pending = _get_pending()
+    if not pending.acquire(blocking=False):
+        raise PasswordHashingBusy(f"{settings.PASSWORD_HASHING_MAX_PENDING} passwords are being hashed already.")
+
+    try:
+        executor = _get_executor()
+        if executor is None:
+            return func(*args)
+        return executor.submit(func, *args).result()
+    finally:
+        pending.release()
+
+
+def hash_password(raw_password):
+    """
+    returns hash of raw_password, as stored in User.password
+    """
+    return run(_hash, raw_password)
+
+
+def set_password(user, raw_password):
+    """
+    sets user's password hashed by hashing executor, as User.set_password
+    does (so that validators are told of the change once user is saved)
+    """
+    user.password = hash_password(raw_password)
+    user._password = raw_password
+
+
+def verify_password(user, raw_password):
+    """
+    returns True if raw_password is user's password, its hash is updated
+    (and saved) if it was made by an outdated hasher or hasher parameters
+    """
+    correct, rehashed = run(_check, raw_password, user.password)
+    if rehashed:
+        user.password = rehashed
+        user.save(update_fields=["password"])
+    return correct
@@ -0,0 +1,82 @@
+"""
+    Contains daily pending tasks reminder pipeline used by emumbaproject.celery
+    ==========================================================================
+
+    Reminder job streams (user, email, pending tasks count) rows of tasks due
+    on a day in batches of settings.REMINDER_BATCH_SIZE, each batch is sent
+    by a separate Celery subtask so that batches are sent in parallel by all
+    workers. A subtask sends its batch over a single SMTP connection, logging
+    every reminder in TaskReminderLog as it is sent, a retried subtask skips
+    users already reminded for the day.
+"""
+import logging
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count
+
+from emumbaproject.db_router import replica_reads
+from todofehrist.models import Task, TaskReminderLog
+
+REMINDER_SUBJECT = "ToDoFehrist - Pending Tasks Reminder"
+
+
+def reminder_batches(day, batch_size):
+    """
+    This method yields lists of [user_id, email, count] of users having
+    pending tasks due on day, read from database in chunks.
+    """
+    with replica_reads():
+        # a replica in sync, if any, streams rows (see emumbaproject.db_router)
+        alias = router.db_for_read(Task)
+
+    rows = Task.objects.using(alias).filter(completion_status=False, due_datetime__date=day).order_by(
+        "user").values("user").annotate(count=Count("id")).values_list("user", "user__email", "count")
+
+    batch = []
+    for user_id, email, count in rows.iterator(chunk_size=batch_size):
+        batch.append([user_id, email, count])
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def send_reminders(day, entries):
+    """
+    This method sends reminder emails of a batch over one SMTP connection.
+    entries is a list of [user_id, email, count], users already reminded
+    for day are skipped. A reminder is logged (claimed) before it is sent
+    and its log removed if sending it fails, so a retried or concurrent
+    subtask never sends it again.
+    returns number of reminders sent.
+    """
+    reminded = set(TaskReminderLog.objects.filter(
+        date=day, user__in=[user_id for user_id, _, _ in entries]).values_list("user", flat=True))
+
+    sent = 0
+    with get_connection() as connection:
+        for user_id, email, count in entries:
+            if user_id in reminded:
+                continue
+
+            try:
+                with transaction.atomic():
+                    reminder_log = TaskReminderLog.objects.create(user_id=user_id, date=day)
+            except IntegrityError:
+                # claimed by another subtask meanwhile
+                continue
+
+            try:
+                EmailMessage(REMINDER_SUBJECT, f"You have {count} pending tasks due today.",
+                             to=[email], connection=connection).send()
+            except Exception:  # not reminded, left for a retry of this batch
+                reminder_log.delete()
+                raise
+
+            sent += 1
+            logging.debug(f"Reminder Email sent to user with email address {email}")
+
+    return sent
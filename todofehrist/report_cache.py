@@ -0,0 +1,59 @@
+"""
+    Contains per user cache of generated reports
+    ============================================
+
+    Reports are cached under a key made of user's id, user's reports
+    version, report names & date window, so an entry is never shared across
+    users. Every committed change of a user's tasks bumps that user's
+    version (see UserTaskStatisticsManager.record), entries of older
+    versions are never read again and expire after settings.REPORT_CACHE_TIME.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from emumbaproject.metrics import record_cache_lookup
+
+
+def _version_key(user_id):
+    return f"todofehrist:reports-version:{user_id}"
+
+
+def reports_version(user_id):
+    """
+    returns current version of a user's cached reports
+    """
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # a fresh (time based) version never matches entries of an evicted one
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_reports(user_id):
+    """
+    This method makes a user's cached reports unreachable.
+    """
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:  # no version, so nothing cached
+        pass
+
+
+def cached_reports(user_id, report_names, date_from, date_to, generate):
+    """
+    returns a user's reports from cache, generated by calling generate() on a miss
+    """
+    window = f"{date_from or ''}:{date_to or ''}"
+    key = f"todofehrist:reports:{user_id}:{reports_version(user_id)}:{','.join(sorted(report_names))}:{window}"
+
+    report_data = cache.get(key)
+    record_cache_lookup("reports", report_data is not None)
+    if report_data is None:
+        report_data = generate()
+        cache.set(key, report_data, settings.REPORT_CACHE_TIME)
+
+    return report_data
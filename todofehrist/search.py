@@ -0,0 +1,279 @@
+"""
+    Contains full text search over Task's title and description
+    ===========================================================
+
+    On PostgreSQL every task stores a weighted tsvector (title: A,
+    description: B) which is written along with the task row in Task.save
+    & Task.update and indexed by a GIN index. Search terms are matched as
+    prefixes against it, while a pg_trgm index on title adds fuzzy
+    (misspelled) matches. Results are ranked by ts_rank + title similarity.
+
+    Other database backends (e.g. SQLite test runs) use a pure-Python,
+    in-process inverted index built lazily per user, meant for tests &
+    development only. Every process holds its own copy, rebuilt on search
+    after any process changed user's tasks, which needs a shared cache
+    backend across processes (see InvertedIndex).
+"""
+import difflib
+import re
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, CharField, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = "simple"
+
+# Relative weight of a term found in title vs description, same as
+# ts_rank's default weights for A & B labels
+TITLE_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+
+# Multiplier of a term's weight depending upon how it matched a search word
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.8
+FUZZY_MATCH = 0.5
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+SEARCH_VERSION_KEY_PREFIX = "todofehrist:search-version:"
+
+# Backfills tasks created before search_vector existed (or inserted in bulk, see todofehrist.seeding)
+POSTGRESQL_SEARCH_BACKFILL = (
+    "UPDATE todofehrist_task SET search_vector = "
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B') "
+    "WHERE search_vector IS NULL")
+
+# Executed after migrations on PostgreSQL, see todofehrist.apps
+POSTGRESQL_SEARCH_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS todofehrist_task_search_vector_gin "
+    "ON todofehrist_task USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS todofehrist_task_title_trgm "
+    "ON todofehrist_task USING gin (title gin_trgm_ops)",
+    POSTGRESQL_SEARCH_BACKFILL,
+]
+
+
+def uses_postgresql():
+    """
+    returns True if default database supports tsvector & trigram search
+    """
+    return connection.vendor == "postgresql"
+
+
+def tokenize(text):
+    """
+    returns list of lower case words in text
+    """
+    return WORD_RE.findall((text or "").lower())
+
+
+def search_vector_for(task):
+    """
+    returns an expression for Task.search_vector computed from task's own
+    title & description, so that it can be written in the same INSERT/UPDATE
+    statement as the task itself. returns None on non PostgreSQL backends.
+    """
+    if not uses_postgresql():
+        return None
+
+    return SearchVector(Value(task.title, output_field=CharField()), weight="A", config=SEARCH_CONFIG) + \
+        SearchVector(Value(task.description, output_field=CharField()), weight="B", config=SEARCH_CONFIG)
+
+
+class UserIndex:
+    """
+        Inverted index of a single user's tasks, term -> {task_id: weight}
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.documents = {}
+
+    def add(self, task_id, title, description):
+        """
+        (re)indexes a task
+        """
+        self.remove(task_id)
+
+        weights = {}
+        for term in tokenize(description):
+            weights[term] = weights.get(term, 0) + DESCRIPTION_WEIGHT
+        for term in tokenize(title):
+            weights[term] = weights.get(term, 0) + TITLE_WEIGHT
+
+        self.documents[task_id] = weights
+        for term, weight in weights.items():
+            self.postings.setdefault(term, {})[task_id] = weight
+
+    def remove(self, task_id):
+        """
+        removes a task from index (if exists)
+        """
+        for term in self.documents.pop(task_id, {}):
+            postings = self.postings[term]
+            postings.pop(task_id, None)
+            if not postings:
+                del self.postings[term]
+
+    def _matching_terms(self, word):
+        """
+        returns {term: match multiplier} of indexed terms matching a search word
+        """
+        matches = {}
+        for term in self.postings:
+            if term == word:
+                matches[term] = EXACT_MATCH
+            elif term.startswith(word):
+                matches[term] = PREFIX_MATCH
+
+        if not matches:
+            for term in difflib.get_close_matches(word, self.postings, n=5,
+                                                  cutoff=settings.TASK_SEARCH_FUZZY_CUTOFF):
+                matches[term] = FUZZY_MATCH
+
+        return matches
+
+    def search(self, words):
+        """
+        returns {task_id: score} of tasks matching all search words
+        """
+        scores = None
+
+        for word in words:
+            word_scores = {}
+            for term, multiplier in self._matching_terms(word).items():
+                for task_id, weight in self.postings[term].items():
+                    word_scores[task_id] = max(word_scores.get(task_id, 0), weight * multiplier)
+
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {task_id: score + word_scores[task_id]
+                          for task_id, score in scores.items() if task_id in word_scores}
+
+        return scores or {}
+
+
+class InvertedIndex:
+    """
+        Process wide collection of UserIndex objects, a user's index is built
+        from database on its search and rebuilt once any process changed
+        user's tasks: every change (Task model hooks) sets a new version of
+        user's index in django's cache, a built index of another version is
+        stale. A version expires after settings.TASK_SEARCH_INDEX_VERSION_TTL
+        and next search sets a new one, so changes bypassing the hooks are
+        seen at least this often. Processes see each other's changes only
+        with a shared cache backend (settings.CACHES), with the default local
+        memory cache run a single process.
+    """
+
+    def __init__(self):
+        self._users = {}  # user_id -> (version, UserIndex)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _version_key(user_id):
+        return f"{SEARCH_VERSION_KEY_PREFIX}{user_id}"
+
+    def _version(self, user_id):
+        key = self._version_key(user_id)
+        version = cache.get(key)
+        if version is None:
+            # expired or evicted, an index built now is stale once this version expires
+            version = uuid.uuid4().hex
+            if not cache.add(key, version, settings.TASK_SEARCH_INDEX_VERSION_TTL):
+                version = cache.get(key, version)  # set by another process meanwhile
+        return version
+
+    def invalidate(self, user_id):
+        """
+        marks indexes of a user stale in all processes, called when user's tasks change
+        """
+        cache.set(self._version_key(user_id), uuid.uuid4().hex, settings.TASK_SEARCH_INDEX_VERSION_TTL)
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def search(self, queryset, user_id, words):
+        """
+        returns {task_id: score} of user's tasks (rows of queryset) matching search words
+        """
+        # read before building, so that a change made meanwhile is seen by next search
+        version = self._version(user_id)
+        with self._lock:
+            built_version, user_index = self._users.get(user_id, (None, None))
+            if user_index is None or built_version != version:
+                user_index = UserIndex()
+                for task_id, title, description in queryset.model.objects.filter(
+                        user=user_id).values_list("id", "title", "description"):
+                    user_index.add(task_id, title, description)
+                self._users[user_id] = (version, user_index)
+
+            return user_index.search(words)
+
+    def clear(self):
+        """
+        drops all built indexes of this process
+        """
+        with self._lock:
+            self._users.clear()
+
+
+inverted_index = InvertedIndex()
+
+
+def index_task(task):
+    """
+    This method is called by Task model whenever a task is saved.
+    """
+    if not uses_postgresql():
+        inverted_index.invalidate(task.user_id)
+
+
+def remove_task(task):
+    """
+    This method is called by Task model whenever a task is deleted.
+    """
+    if not uses_postgresql():
+        inverted_index.invalidate(task.user_id)
+
+
+def _no_results(queryset):
+    return queryset.none().annotate(rank=Value(0.0, output_field=FloatField())).order_by("-rank", "-pk")
+
+
+def search_tasks(queryset, user_id, search_term):
+    """
+    This method filters a user's tasks queryset down to tasks matching
+    search_term in title or description. Returned queryset is annotated
+    with 'rank' and ordered by (-rank, -pk).
+    """
+    words = tokenize(search_term)
+    if not words:
+        return _no_results(queryset)
+
+    if uses_postgresql():
+        query = SearchQuery(" & ".join(f"{word}:*" for word in words), config=SEARCH_CONFIG, search_type="raw")
+        queryset = queryset.annotate(similarity=TrigramSimilarity("title", search_term.lower())).filter(
+            Q(search_vector=query) | Q(similarity__gt=settings.TASK_SEARCH_TRIGRAM_THRESHOLD))
+        # rank is cast to double precision so that cursor values round trip exactly
+        rank = Cast(SearchRank(F("search_vector"), query) + F("similarity"), FloatField())
+
+    else:
+        scores = inverted_index.search(queryset, user_id, words)
+        top_scores = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        top_scores = top_scores[:settings.TASK_SEARCH_MAX_FALLBACK_RESULTS]
+        if not top_scores:
+            return _no_results(queryset)
+
+        queryset = queryset.filter(id__in=[task_id for task_id, _ in top_scores])
+        rank = Case(*[When(id=task_id, then=Value(score)) for task_id, score in top_scores],
+                    default=Value(0.0), output_field=FloatField())
+
+    return queryset.annotate(rank=rank).order_by("-rank", "-pk")
@@ -0,0 +1,298 @@
+"""
+    Contains synthetic data seeding used by benchmark management command
+    ====================================================================
+
+    Seeds users (sharing one password hash, as hashing is deliberately
+    slow), their login tokens & quota rows, tasks with realistic due and
+    completion distributions and media file rows. All media rows reference
+    one stored blob, so that seeding millions of them doesn't write as many
+    files. Rows are inserted by PostgreSQL COPY (bulk_create on other
+    database backends) in batches, task statistics, daily rollups & search
+    vectors are computed afterwards in bulk.
+
+    Users are seeded in chunks of chunk_size users, chunks can be seeded
+    by a pool of processes. Every chunk draws its rows from its own random
+    generator seeded by (random seed, chunk number), so seeded rows depend
+    only upon the given random seed & chunk size, not upon process count.
+"""
+import csv
+import io
+import itertools
+import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.utils import timezone
+
+from todofehrist.models import User, UserLogin, UserSubscriptionType, UserSubscriptionLimits, \
+    UserQuotaManagement, Task, TaskMediaFiles, MediaBlob, UserTaskStatistics, UserDailyTaskRollup
+from todofehrist.models_utility import get_datetime_now
+from todofehrist.search import POSTGRESQL_SEARCH_BACKFILL
+from todofehrist.storage import content_addressed_storage, digest_from_name
+
+SEED_SUBSCRIPTION = "BENCHMARK"
+SEED_PASSWORD = "benchmark-password"
+SEED_EMAIL = "seed-{}@example.com"
+SEED_FILE_CONTENT = b"ToDoFehrist benchmark media file\n" * 512
+
+WORDS = ("buy", "groceries", "call", "mom", "write", "report", "review", "pull", "request", "fix", "bug",
+         "plan", "meeting", "book", "flight", "pay", "bills", "clean", "kitchen", "read", "chapter",
+         "prepare", "slides", "update", "resume", "water", "plants", "renew", "passport", "backup",
+         "laptop", "schedule", "dentist", "order", "birthday", "gift", "submit", "taxes", "walk", "dog")
+
+COMPLETION_RATIO = 0.6  # share of completed tasks
+LATE_COMPLETION_RATIO = 0.2  # share of completed tasks completed after their due datetime
+HISTORY_DAYS = 365  # tasks are created within these many past days
+CHUNK_SIZE = 1000  # users seeded by a chunk
+
+COPY_NULL = "\\N"
+
+SeedResult = namedtuple("SeedResult", ["user_ids", "tokens", "tasks", "files"])
+SeedChunk = namedtuple("SeedChunk", ["number", "first_user", "users", "tasks_per_user", "files_per_task",
+                                     "random_seed", "prefix", "subscription_type", "password_hash", "blob_name",
+                                     "batch_size", "using"])
+
+
+def _batches(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _copy(objects, using):
+    """
+    inserts objects of a model by a single PostgreSQL COPY statement on database using
+    """
+    connection = connections[using]
+    model = type(objects[0])
+    fields = [field for field in model._meta.concrete_fields if not isinstance(field, models.AutoField)]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objects:
+        values = (field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields)
+        writer.writerow([COPY_NULL if value is None else value for value in values])
+    buffer.seek(0)
+
+    quote_name = connection.ops.quote_name
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {quote_name(model._meta.db_table)} ({columns}) FROM STDIN "
+                           f"WITH (FORMAT csv, NULL '{COPY_NULL}')", buffer)
+
+
+def insert(objects, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    This method inserts objects of a model in batches into database using,
+    without signals & Model.save hooks, and without setting ids of inserted
+    objects.
+    returns number of inserted objects.
+    """
+    count = 0
+    for batch in _batches(objects, batch_size):
+        if connections[using].vendor == "postgresql":
+            _copy(batch, using)
+        else:
+            type(batch[0]).objects.using(using).bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def _sentence(rng, min_words, max_words, max_length):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))[:max_length]
+
+
+def seed_subscription(using=DEFAULT_DB_ALIAS):
+    """
+    returns subscription type of seeded users, its limits don't restrict
+    benchmarked requests (creating tasks, uploading files etc.)
+    """
+    subscription_type, _ = UserSubscriptionType.objects.using(using).get_or_create(
+        name=SEED_SUBSCRIPTION, defaults={"price": 0, "currency": "USD"})
+    UserSubscriptionLimits.objects.using(using).update_or_create(subscription_type=subscription_type, defaults={
+        "max_allowed_tasks": 2 ** 31 - 1, "max_allowed_files": 2 ** 31 - 1, "allowed_files_per_task": 1000,
+        "max_file_size": 100 * 1024 * 1024, "max_downloads_per_day": 2 ** 31 - 1,
+        "max_uploads_per_day": 2 ** 31 - 1, "permanent_deletion_time": 0})
+    return subscription_type
+
+
+def seed_users(count, subscription_type, batch_size, prefix="", verified=True, password_hash=None, first=0,
+               using=DEFAULT_DB_ALIAS):
+    """
+    This method creates count users with emails seed-<prefix><n>@example.com
+    (n starting from first).
+    returns ids of created users.
+    """
+    password_hash = password_hash or make_password(SEED_PASSWORD)
+    now = get_datetime_now()
+
+    emails = [SEED_EMAIL.format(f"{prefix}{index}") for index in range(first, first + count)]
+    insert((User(email=email, username=email, password=password_hash, subscription_type=subscription_type,
+                 is_email_verified=verified, date_joined=now) for email in emails), batch_size, using)
+
+    # ids aren't set by bulk_create on every database backend
+    ids_by_email = {}
+    for batch in _batches(emails, batch_size):
+        ids_by_email.update(User.objects.using(using).filter(email__in=batch).values_list("email", "id"))
+    return [ids_by_email[email] for email in emails]
+
+
+def seed_tokens(user_ids, rng, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    This method creates a login token for every user.
+    returns {user_id: token}
+    """
+    tokens = {user_id: "%032x" % rng.getrandbits(128) for user_id in user_ids}
+    insert((UserLogin(user_id=user_id, token=token) for user_id, token in tokens.items()), batch_size, using)
+    return tokens
+
+
+def random_task(rng, user_id, now, files_per_task=0):
+    """
+    returns an unsaved Task of user created within HISTORY_DAYS, due within
+    a month of its creation and completed (before or after due) as per
+    COMPLETION_RATIO. files_count is drawn so that tasks have files_per_task
+    files on average.
+    """
+    created = now - timezone.timedelta(seconds=rng.randint(0, HISTORY_DAYS * 24 * 60 * 60))
+    due = created + timezone.timedelta(seconds=rng.randint(60 * 60, 30 * 24 * 60 * 60))
+
+    completion_datetime = None
+    if rng.random() < COMPLETION_RATIO:
+        if rng.random() < LATE_COMPLETION_RATIO:
+            completion_datetime = due + (due - created) * rng.random()
+        else:
+            completion_datetime = created + (due - created) * rng.random()
+        completion_datetime = min(completion_datetime, now)
+
+    files_count = int(files_per_task) + (rng.random() < files_per_task - int(files_per_task))
+
+    return Task(user_id=user_id, title=_sentence(rng, 2, 4, 50), description=_sentence(rng, 5, 20, 300),
+                due_datetime=due, completion_status=completion_datetime is not None,
+                completion_datetime=completion_datetime, files_count=files_count,
+                created_datetime=created, updated_datetime=completion_datetime or created)
+
+
+def seed_tasks(user_ids, tasks_per_user, files_per_task, rng, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    This method creates tasks_per_user tasks for every user & their quota rows.
+    returns number of created tasks.
+    """
+    now = get_datetime_now()
+    tasks = (random_task(rng, user_id, now, files_per_task) for user_id in user_ids for _ in range(tasks_per_user))
+    count = insert(tasks, batch_size, using)
+
+    insert((UserQuotaManagement(user_id=user_id, total_tasks=tasks_per_user) for user_id in user_ids), batch_size,
+           using)
+    return count
+
+
+def seed_blob(using=DEFAULT_DB_ALIAS):
+    """
+    returns storage name of the blob referenced by seeded media files
+    """
+    name = content_addressed_storage.save("seed.txt", ContentFile(SEED_FILE_CONTENT))
+    MediaBlob.objects.using(using).get_or_create(digest=digest_from_name(name),
+                                                 defaults={"size": len(SEED_FILE_CONTENT)})
+    return name
+
+
+def seed_media_files(user_ids, file_name, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    This method creates files_count media file rows of every task of users,
+    all referencing the seeded blob file_name. Rows aren't counted in
+    blob's ref_count, see count_blob_references.
+    returns number of created rows.
+    """
+    now = get_datetime_now()
+
+    count = 0
+    for user_batch in _batches(user_ids, batch_size):
+        tasks = list(Task.objects.using(using).filter(user__in=user_batch, files_count__gt=0).order_by().values_list(
+            "id", "files_count"))
+        count += insert((TaskMediaFiles(task_id=task_id, name=f"file-{index}.txt", file=file_name,
+                                        uploaded_datetime=now)
+                         for task_id, files_count in tasks for index in range(files_count)), batch_size, using)
+    return count
+
+
+def count_blob_references(file_name, using=DEFAULT_DB_ALIAS):
+    """
+    This method sets ref_count of a blob to number of media file rows
+    referencing it (inserted rows don't send post_save).
+    """
+    MediaBlob.objects.using(using).filter(digest=digest_from_name(file_name)).update(
+        ref_count=TaskMediaFiles.objects.using(using).filter(file=file_name).count(),
+        updated_datetime=get_datetime_now())
+
+
+def seed_chunk(chunk):
+    """
+    This method seeds users of a SeedChunk with their tokens, tasks & media
+    files, and builds their statistics & daily rollups.
+    returns SeedResult
+    """
+    rng = random.Random(f"{chunk.random_seed}:{chunk.number}")
+
+    user_ids = seed_users(chunk.users, chunk.subscription_type, chunk.batch_size, prefix=chunk.prefix,
+                          password_hash=chunk.password_hash, first=chunk.first_user, using=chunk.using)
+    tokens = seed_tokens(user_ids, rng, chunk.batch_size, chunk.using)
+    tasks = seed_tasks(user_ids, chunk.tasks_per_user, chunk.files_per_task, rng, chunk.batch_size, chunk.using)
+    files = seed_media_files(user_ids, chunk.blob_name, chunk.batch_size, chunk.using) if chunk.blob_name else 0
+
+    UserTaskStatistics.objects.db_manager(chunk.using).rebuild(user_ids=user_ids)
+    UserDailyTaskRollup.objects.db_manager(chunk.using).rebuild(user_ids=user_ids)
+
+    return SeedResult(user_ids, tokens, tasks, files)
+
+
+def _init_process():
+    # spawned processes (e.g. on macOS) start with django unconfigured
+    django.setup()
+
+
+def seed(users, tasks_per_user, files_per_task=0, random_seed=0, batch_size=5000, processes=1,
+         chunk_size=CHUNK_SIZE, prefix="", using=DEFAULT_DB_ALIAS):
+    """
+    This method seeds users with their tokens, tasks & media files into
+    database using, and builds statistics, daily rollups & search vectors
+    of seeded tasks. Chunks of users are seeded by processes processes in
+    parallel.
+    returns SeedResult
+    """
+    subscription_type = seed_subscription(using)
+    # a fixed salt keeps seeded rows same across runs
+    password_hash = make_password(SEED_PASSWORD, salt=f"seed{random_seed}")
+    blob_name = seed_blob(using) if files_per_task else None
+
+    chunks = [SeedChunk(number, first_user, min(chunk_size, users - first_user), tasks_per_user, files_per_task,
+                        random_seed, prefix, subscription_type, password_hash, blob_name, batch_size, using)
+              for number, first_user in enumerate(range(0, users, chunk_size))]
+
+    if processes > 1:
+        # forked processes must not share parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(processes, initializer=_init_process) as executor:
+            results = list(executor.map(seed_chunk, chunks))
+    else:
+        results = [seed_chunk(chunk) for chunk in chunks]
+
+    if blob_name:
+        count_blob_references(blob_name, using)
+    # search vectors of inserted tasks (PostgreSQL only), indexes exist since migrations
+    if connections[using].vendor == "postgresql":
+        with connections[using].cursor() as cursor:
+            cursor.execute(POSTGRESQL_SEARCH_BACKFILL)
+
+    tokens = {}
+    for result in results:
+        tokens.update(result.tokens)
+    return SeedResult([user_id for result in results for user_id in result.user_ids], tokens,
+                      sum(result.tasks for result in results), sum(result.files for result in results))
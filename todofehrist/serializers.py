@@ -5,7 +5,7 @@ from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 from emumbaproject import settings
 
-from todofehrist.models import User, UserLogin, Task, TaskMediaFiles
+from todofehrist.models import User, UserLogin, Task, TaskMediaFiles, TaskMediaUpload
 from todofehrist.models_utility import get_datetime_now
 
 
@@ -81,6 +81,15 @@ class TaskSerializer(serializers.ModelSerializer):
         This method will update the partial data for Task object
         after validating the data received in update request.
         """
+        self.assign(instance, validated_data)
+        instance.update()
+        return instance
+
+    @staticmethod
+    def assign(instance, validated_data):
+        """
+        This method sets Task object's attributes from (partial) data without saving it.
+        """
         instance.title = validated_data.get('title', instance.title)
         instance.description = validated_data.get('description', instance.description)
         instance.due_datetime = validated_data.get('due_datetime', instance.due_datetime)
@@ -91,21 +100,50 @@ class TaskSerializer(serializers.ModelSerializer):
         else:
             instance.completion_datetime = None
         instance.completion_status = completion_status
-        instance.update()
-        return instance
 
     def get_files(self, instance):
         """
         This method serialize task related files stored in TaskMediaFiles model.
+        Files prefetched by list views via prefetch_related("taskmediafiles_set")
+        are served from cache, otherwise they are queried for this task.
         return: list
         """
         try:
-            return TaskMediaFilesSerializer(
-                    TaskMediaFiles.objects.filter(task=instance.id), many=True).data
+            return TaskMediaFilesSerializer(instance.taskmediafiles_set.all(), many=True).data
         except AttributeError:
             return []
 
 
+class TaskBulkSerializer(TaskSerializer):
+    """
+        Serializer class for validating Task operations of a bulk request,
+        user is set by the view rather than validated (queried) per item.
+    """
+
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class TaskBulkOperationSerializer(serializers.Serializer):
+    """
+        serializer class for validating an operation of bulk tasks request
+    """
+    OPERATIONS = ('create', 'update', 'delete')
+
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    id = serializers.IntegerField(required=False)
+    data = serializers.DictField(required=False)
+
+    def validate(self, attrs):
+        """
+        update & delete operations need a task id, create & update need data
+        """
+        if attrs['op'] != 'create' and attrs.get('id') is None:
+            raise serializers.ValidationError({"id": "This field is required."})
+        if attrs['op'] != 'delete' and attrs.get('data') is None:
+            raise serializers.ValidationError({"data": "This field is required."})
+        return attrs
+
+
 class TaskMediaFilesSerializer(serializers.ModelSerializer):
     """
         Serializer class for TaskMediaFiles Model
@@ -121,6 +159,24 @@ class TaskMediaFilesSerializer(serializers.ModelSerializer):
         fields = ('id', 'task', 'name', 'file')
 
 
+class TaskMediaUploadSerializer(serializers.ModelSerializer):
+    """
+        Serializer class for TaskMediaUpload Model (chunked uploads)
+    """
+
+    size = serializers.IntegerField(min_value=1)
+    # optional sha256 hex digest of file, lets a known file skip its upload
+    sha256 = serializers.RegexField(r"^[0-9a-f]{64}$", required=False, write_only=True)
+
+    class Meta:
+        """
+            Define model and attributes to use for serialization
+        """
+        model = TaskMediaUpload
+        fields = ('id', 'task', 'name', 'size', 'received', 'sha256')
+        read_only_fields = ('id', 'task', 'received')
+
+
 class SocialAuthSerializer(serializers.Serializer):
     """
         serializer class for validating social oauth login view
@@ -0,0 +1,117 @@
+"""
+    Contains content addressed storage of Task media files
+    ======================================================
+
+    Every file is stored once under the sha256 digest of its content in a
+    fan-out layout (blobs/ab/cd/abcd...), so that the same file attached to
+    many tasks takes disk space once. Digest is computed while a file is
+    streamed to disk (see HashingFileUploadHandler & ContentAddressedStorage._save).
+
+    Rows referencing a blob are counted by todofehrist.models.MediaBlob,
+    blobs no longer referenced are removed by a periodic task after
+    settings.MEDIA_BLOB_GRACE_TIME seconds (see todofehrist.media).
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+BLOBS_DIR = "blobs"
+BLOB_NAME_RE = re.compile(r"^blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})$")
+
+READ_SIZE = 64 * 1024
+
+
+def blob_name(digest):
+    """
+    returns storage name of a blob against its sha256 hex digest
+    """
+    return f"{BLOBS_DIR}/{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def digest_from_name(name):
+    """
+    returns sha256 hex digest of a blob's storage name, None for files stored
+    before content addressed storage (named after uploaded file)
+    """
+    match = BLOB_NAME_RE.match(name or "")
+    return match.group(1) if match else None
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+        Upload handler computing sha256 of a (large) uploaded file while it is
+        streamed to a temporary file, storage then doesn't read it again.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        uploaded_file.sha256 = self.hasher.hexdigest()
+        return uploaded_file
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+        FileSystemStorage naming files after sha256 of their content,
+        saving content of an already stored blob only discards it.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # name is decided by content in _save
+        return name
+
+    def _hash_file(self, path):
+        hasher = hashlib.sha256()
+        with open(path, "rb") as file_handle:
+            for data in iter(lambda: file_handle.read(READ_SIZE), b""):
+                hasher.update(data)
+        return hasher.hexdigest()
+
+    def _save(self, name, content):
+        blobs_root = self.path(BLOBS_DIR)
+        os.makedirs(blobs_root, exist_ok=True)
+
+        if hasattr(content, "temporary_file_path"):
+            # file is on disk already (large upload or complete chunked upload), move it
+            temp_path = content.temporary_file_path()
+            digest = getattr(content, "sha256", None) or self._hash_file(temp_path)
+        else:
+            hasher = hashlib.sha256()
+            with tempfile.NamedTemporaryFile(dir=blobs_root, suffix=".tmp", delete=False) as temp_file:
+                temp_path = temp_file.name
+                for chunk in content.chunks():
+                    hasher.update(chunk)
+                    temp_file.write(chunk)
+            digest = hasher.hexdigest()
+
+        name = blob_name(digest)
+        full_path = self.path(name)
+
+        if os.path.exists(full_path):
+            # known content, nothing to write. Touching the blob keeps it from being
+            # removed as unreferenced before this new reference is counted.
+            os.remove(temp_path)
+            os.utime(full_path)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            # a rename on the same file system, concurrent writers of same content are harmless
+            file_move_safe(temp_path, full_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+
+        return name
+
+
+content_addressed_storage = ContentAddressedStorage()
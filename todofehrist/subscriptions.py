@@ -0,0 +1,81 @@
+"""
+    Contains process wide registry of subscription types and their limits
+    =====================================================================
+
+    UserSubscriptionType & UserSubscriptionLimits are tiny, nearly static
+    tables read on every task creation. The registry loads both tables in
+    memory on first use and reloads them when either changes in this
+    process (model signals) or after settings.SUBSCRIPTION_REGISTRY_TTL
+    seconds (changes made by other processes).
+"""
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+
+
+class SubscriptionRegistry:
+    """
+        In-memory copy of UserSubscriptionType & UserSubscriptionLimits rows
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._types = {}
+        self._limits = {}
+        self._expires = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._expires > time.monotonic():
+            return
+
+        with self._lock:
+            if self._expires > time.monotonic():
+                return
+
+            generation = self._generation
+            subscription_type_model = apps.get_model("todofehrist", "UserSubscriptionType")
+            limits_model = apps.get_model("todofehrist", "UserSubscriptionLimits")
+
+            self._types = {item.id: item for item in subscription_type_model.objects.all()}
+            self._limits = {item.subscription_type_id: item for item in limits_model.objects.all()}
+            if generation == self._generation:  # not invalidated while loading
+                self._expires = time.monotonic() + self.ttl
+
+    def subscription_type(self, subscription_type_id):
+        """
+        returns UserSubscriptionType object against its id
+        raises UserSubscriptionType.DoesNotExist
+        """
+        self._ensure_loaded()
+        try:
+            return self._types[subscription_type_id]
+        except KeyError:
+            raise apps.get_model("todofehrist", "UserSubscriptionType").DoesNotExist(
+                f"UserSubscriptionType with id {subscription_type_id} doesn't exist.") from None
+
+    def limits(self, subscription_type_id):
+        """
+        returns UserSubscriptionLimits object of a subscription type
+        raises UserSubscriptionLimits.DoesNotExist
+        """
+        self._ensure_loaded()
+        try:
+            return self._limits[subscription_type_id]
+        except KeyError:
+            raise apps.get_model("todofehrist", "UserSubscriptionLimits").DoesNotExist(
+                f"UserSubscriptionLimits for subscription type {subscription_type_id} doesn't exist.") from None
+
+    def invalidate(self, **kwargs):
+        """
+        forces reload on next access, connected to post_save/post_delete
+        signals of both models in todofehrist.apps
+        """
+        self._generation += 1
+        self._expires = 0
+
+
+subscription_registry = SubscriptionRegistry(settings.SUBSCRIPTION_REGISTRY_TTL)
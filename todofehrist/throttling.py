@@ -0,0 +1,67 @@
+"""
+    Contains throttling of login, signup & password reset attempts
+    ==============================================================
+
+    Attempts are counted per email & per client IP in fixed windows, by
+    counters in django's cache (shared across processes with a shared
+    cache backend, see settings.CACHES). An attempt beyond its limit is
+    rejected before its password is hashed (see todofehrist.password_hashing),
+    so a login storm can't keep hashing executors busy.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from todofehrist.auth_tokens import token_digest
+
+THROTTLE_KEY_PREFIX = "todofehrist:throttle:"
+
+
+def client_ip(request):
+    """
+    returns IP of client, from settings.CLIENT_IP_HEADER if configured: the
+    address added by the outermost of settings.CLIENT_IP_PROXIES trusted
+    reverse proxies, as entries before it are sent by client & can be forged
+    """
+    if settings.CLIENT_IP_HEADER:
+        forwarded = request.META.get(settings.CLIENT_IP_HEADER, "")
+        addresses = [address.strip() for address in forwarded.split(",") if address.strip()]
+        if addresses:
+            # every proxy appends address it is connected from, as DRF's NUM_PROXIES
+            return addresses[-min(settings.CLIENT_IP_PROXIES, len(addresses))]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def throttle_wait(scope, identity, rate):
+    """
+    This method counts an attempt of identity (e.g. an email) in scope.
+    rate is (attempts, seconds) allowed in a window.
+    returns seconds until identity may attempt again if it exceeded rate, else 0
+    """
+    attempts, window = rate
+    now = time.time()
+    window_start = int(now // window) * window
+    key = f"{THROTTLE_KEY_PREFIX}{scope}:{token_digest(identity)}:{window_start}"
+
+    cache.add(key, 0, window)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # expired since added
+        cache.set(key, 1, window)
+        count = 1
+
+    if count > attempts:
+        return window_start + window - now
+    return 0
+
+
+def credentials_throttle_wait(request, email, scope="login"):
+    """
+    returns seconds until client of request may attempt scope (e.g. login)
+    with email (as sent, which may be any JSON value) again, 0 if it may now
+    """
+    email_wait = throttle_wait(f"{scope}:email", str(email).strip().lower(), settings.LOGIN_THROTTLE_EMAIL_RATE)
+    ip_wait = throttle_wait(f"{scope}:ip", client_ip(request), settings.LOGIN_THROTTLE_IP_RATE)
+    return max(email_wait, ip_wait)
@@ -3,13 +3,14 @@
 """
 from django.urls import path, include
 # from django.conf.urls import handler500
-from django.conf import settings
-from django.views.decorators.cache import cache_page
 
 from todofehrist.views import UserView, activate_account, \
     UserLoginView, ReportView, UserResetPasswordView, \
-    TaskView, TaskUpdateView, TaskMediaFileView, SocialAuthLogin, UserLogoutView
+    TaskView, TaskUpdateView, TaskMediaFileView, SocialAuthLogin, UserLogoutView, TaskBulkView, \
+    TaskMediaUploadView, TaskMediaUploadCompleteView
 from todofehrist.exceptions import HTTPStatusCodeHandler
+# task, file & report endpoints are served by async views when settings.ASYNC_VIEWS is set
+from todofehrist.async_views import as_view
 
 urlpatterns = [
     # User Registration
@@ -30,18 +31,29 @@ urlpatterns = [
     path('oauth', SocialAuthLogin.as_view()),
 
     # GET - Fetch All Users Tasks, POST - Create a New Task, GET ?search - Search Tasks with string
-    path('tasks', TaskView.as_view()),
+    path('tasks', as_view(TaskView)),
+    # POST - Create/Update/Delete many Tasks in one request
+    path('tasks/bulk', as_view(TaskBulkView)),
     # GET - Fetch Task by ID, POST - Update Task by ID
-    path('tasks/<task_id>', TaskUpdateView.as_view()),
+    path('tasks/<task_id>', as_view(TaskUpdateView)),
 
     # POST - Upload Task File
-    path('tasks/<task_id>/files', TaskMediaFileView.as_view()),
+    path('tasks/<task_id>/files', as_view(TaskMediaFileView)),
+
+    # POST - Initiate Chunked Upload of a Task File
+    path('tasks/<task_id>/files/uploads', as_view(TaskMediaUploadView)),
+
+    # GET - Upload Status, PUT - Upload Chunk, DELETE - Abort Upload
+    path('tasks/<task_id>/files/uploads/<upload_id>', as_view(TaskMediaUploadView)),
+
+    # POST - Complete Chunked Upload
+    path('tasks/<task_id>/files/uploads/<upload_id>/complete', as_view(TaskMediaUploadCompleteView)),
 
     # DELETE - Remove Task File, GET - Download Task File
-    path('tasks/<task_id>/files/<file_id>', TaskMediaFileView.as_view()),
+    path('tasks/<task_id>/files/<file_id>', as_view(TaskMediaFileView)),
 
     # GET ?name= - Generate Report by Name
-    path('reports/', cache_page(settings.REPORT_CACHE_TIME)(ReportView.as_view())),
+    path('reports/', as_view(ReportView)),
 ]
 
 # handler500 = HTTPStatusCodeHandler.handler500
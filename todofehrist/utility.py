@@ -2,25 +2,27 @@
     Contains utility methods to support todofehrist.views
 """
 import logging
+import math
 
 from django.conf import settings
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
 from django.contrib.sites.shortcuts import get_current_site
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
-from django.db.models.functions import ExtractWeekDay, TruncDate
-from django.db.models import Count, Avg
+from django.db.models import Avg, Max, Min, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
 
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 
-from todofehrist.models import Task, UserLogin
-
-from google.oauth2 import id_token
-from google.auth.transport import requests
+from emumbaproject.db_router import user_routing
+from todofehrist.models import UserTaskStatistics, UserDailyTaskRollup
+from todofehrist.auth_tokens import resolve_token, user_from_entry
+from todofehrist.report_cache import cached_reports
+from todofehrist.mail_queue import enqueue_email
+from todofehrist.oauth import verify_google_token
 
 from todofehrist.models_utility import get_datetime_now
 
@@ -52,6 +54,8 @@ class BaseAPIView(APIView):
             response_data["payload"]["total"] = page_data.get("total")
             response_data["payload"]["from"] = page_data.get("from")
             response_data["payload"]["to"] = page_data.get("to")
+            response_data["payload"]["next"] = page_data.get("next")
+            response_data["payload"]["prev"] = page_data.get("prev")
 
         return response_data
 
@@ -83,6 +87,30 @@ class BaseAPIView(APIView):
         """
         return Response(cls.__base_response(*args, **kwargs), status=status.HTTP_404_NOT_FOUND)
 
+    @classmethod
+    def response_conflict(cls, *args, **kwargs):
+        """
+            Create Response payload with given params and return Django Response
+        """
+        return Response(cls.__base_response(*args, **kwargs), status=status.HTTP_409_CONFLICT)
+
+    @classmethod
+    def response_too_large(cls, *args, **kwargs):
+        """
+            Create Response payload with given params and return Django Response
+        """
+        return Response(cls.__base_response(*args, **kwargs), status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    @classmethod
+    def response_too_many_requests(cls, *args, retry_after=1, **kwargs):
+        """
+            Create Response payload with given params and return Django Response,
+            client may retry after retry_after seconds
+        """
+        response = Response(cls.__base_response(*args, **kwargs), status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response["Retry-After"] = str(math.ceil(retry_after))
+        return response
+
     @classmethod
     def response_internal_error(cls, *args, **kwargs):
         """
@@ -93,13 +121,12 @@ class BaseAPIView(APIView):
 
 def send_email(subject, body, to_):
     """
-    This method will send an email provided subject
-    body text and list of recipients
+    This method will queue an email provided subject
+    body text and list of recipients, it is sent by a
+    Celery worker (see todofehrist.mail_queue)
     """
 
-    new_email = EmailMessage(subject, body, to=to_)
-    new_email.content_subtype = 'html'
-    new_email.send()
+    enqueue_email(subject, to_, body=body)
 
 
 def account_token_gen():
@@ -119,14 +146,12 @@ def send_activation_email(app_user, request):
         - request
     """
     subject = 'ToDoFehrist - Activate Your Account'
-    body = render_to_string('email_verification.html', {
+    enqueue_email(subject, [app_user.email], template_name='email_verification.html', context={
         "domain": get_current_site(request).domain,
         "uid": urlsafe_base64_encode(force_bytes(app_user.pk)),
         "token": account_token_gen().make_token(app_user)
     })
 
-    send_email(subject, body, [app_user.email])
-
 
 def send_forgot_password_email(app_user):
     """
@@ -134,11 +159,36 @@ def send_forgot_password_email(app_user):
     when a user requests it.
     """
     subject = 'ToDoFehrist - Forgot Password Request'
-    body = render_to_string('forgot_password_email.html', {
+    enqueue_email(subject, [app_user.email], template_name='forgot_password_email.html', context={
         "token": account_token_gen().make_token(app_user)
     })
 
-    send_email(subject, body, [app_user.email])
+
+def token_error_response(token_entry):
+    """
+    returns unauthorized response for a missing or expired login token,
+    None if token_entry is valid
+    """
+    if token_entry is None:
+        return BaseAPIView.response_unauthorized(entity="Invalid Token", description="Resource Request",
+                                                 error="Resource Access Not Allowed. Login To Continue..")
+
+    if get_datetime_now() > token_entry.expire_at:
+        return BaseAPIView.response_unauthorized(entity="Invalid Token",
+                                                 description="Resource Request",
+                                                 error="Token Expired. "
+                                                       "Resource Access Not Allowed. Login To Continue..")
+    return None
+
+
+def authenticated_user(request, token_entry):
+    """
+    returns User of a valid token entry, marking request with its id
+    """
+    user = user_from_entry(token_entry)
+    # logged by emumbaproject.middleware.LoggingRequestResponse
+    getattr(request, "_request", request).todofehrist_user_id = user.id
+    return user
 
 
 def login_required(func_handler):
@@ -148,98 +198,124 @@ def login_required(func_handler):
     """
     def wrap(self, request, user=0, *args, **kwargs):
 
-        user = None
+        # already resolved when served by todofehrist.async_views.async_login_required
+        token_entry = getattr(getattr(request, "_request", request), "todofehrist_token_entry", None) \
+            or resolve_token(request.META.get('HTTP_AUTHORIZATION', ''))
 
-        try:
-            user_login = UserLogin.objects.get(token=request.META.get('HTTP_AUTHORIZATION', ''))
-            if get_datetime_now() > user_login.expire_at:
-                return BaseAPIView.response_unauthorized(entity="Invalid Token",
-                                                         description="Resource Request",
-                                                         error="Token Expired. "
-                                                               "Resource Access Not Allowed. Login To Continue..")
-            user = user_login.user
+        error_response = token_error_response(token_entry)
+        if error_response is not None:
+            return error_response
 
-        except UserLogin.DoesNotExist:
-            return BaseAPIView.response_unauthorized(entity="Invalid Token", description="Resource Request",
-                                                     error="Resource Access Not Allowed. Login To Continue..")
+        user = authenticated_user(request, token_entry)
 
-        return func_handler(self, request, user, *args, **kwargs)
+        # user's writes pin their reads to primary, see emumbaproject.db_router
+        with user_routing(user.id):
+            return func_handler(self, request, user, *args, **kwargs)
 
     return wrap
 
 
-def gen_report_tasks_status(user):
+class ReportSource:
     """
-    This method generates a report for a user stating its tasks summary.
+        Data of a user's reports, each source is queried at most once no matter
+        how many reports are generated from it: UserTaskStatistics row and one
+        aggregate query (filtered aggregates) over UserDailyTaskRollup rows.
     """
-    result = Task.objects.filter(user=user.id).values(
-        'completion_status').annotate(total=Count('completion_status')).order_by('total')
-    dict_ = {"total": 0, "complete": 0, "incomplete": 0}
 
-    for item in result:
-        if item['completion_status']:
-            dict_["complete"] = item['total']
-        else:
-            dict_["incomplete"] = item['total']
+    def __init__(self, user, date_from=None, date_to=None):
+        self.user = user
+        self.date_from = date_from
+        self.date_to = date_to
 
-    dict_['total'] = dict_["complete"] + dict_["incomplete"]
+    @property
+    def has_window(self):
+        """
+        returns True if reports are limited to a date window
+        """
+        return self.date_from is not None or self.date_to is not None
+
+    @cached_property
+    def statistics(self):
+        """
+        returns user's UserTaskStatistics object
+        """
+        return UserTaskStatistics.objects.for_user(self.user.id)
+
+    @cached_property
+    def rollup_totals(self):
+        """
+        returns aggregates of user's daily rollups in date window
+        """
+        rollups = UserDailyTaskRollup.objects.for_user(self.user.id, self.date_from, self.date_to,
+                                                       statistics=self.statistics)
+        max_completed = rollups.order_by().values('user').annotate(count=Max('completed_count')).values('count')
+
+        aggregates = {
+            "completion_avg": Avg('completed_count', filter=Q(completed_count__gt=0)),
+            "max_completed_count": Max('completed_count'),
+            # earliest day having max completions
+            "max_completed_date": Min('date', filter=Q(completed_count__gt=0,
+                                                       completed_count=Subquery(max_completed))),
+        }
+        for week_day, field in enumerate(UserTaskStatistics.WEEKDAY_FIELDS, start=1):
+            aggregates[field] = Coalesce(Sum('created_count', filter=Q(date__week_day=week_day)), 0)
+
+        return rollups.aggregate(**aggregates)
+
+
+def gen_report_tasks_status(source):
+    """
+    This method generates a report for a user stating its tasks summary.
+    """
+    dict_ = {"total": source.statistics.total_tasks,
+             "complete": source.statistics.complete_tasks,
+             "incomplete": source.statistics.incomplete_tasks}
 
     return {"tasks_summary": dict_}
 
 
-def gen_report_tasks_completion_avg(user):
+def gen_report_tasks_completion_avg(source):
     """
     This method returns average completion of user's tasks
     """
-    result = Task.objects.filter(user=user.id, completion_status=1).annotate(
-            date=TruncDate('completion_datetime')).values("date").annotate(
-            count=Count('id')).order_by("date").aggregate(day_wise_tasks_completion_avg=Avg('count'))
-
-    return result
+    return {"day_wise_tasks_completion_avg": source.rollup_totals["completion_avg"]}
 
 
-def gen_report_incomplete_tasks_count(user):
+def gen_report_incomplete_tasks_count(source):
     """
     This method will return count of incomplete/pending tasks by user.
     """
-    tasks_count = Task.objects.filter(user=user.id, completion_status=0).count()
-
-    return {"incomplete_tasks_count": tasks_count}
+    return {"incomplete_tasks_count": source.statistics.incomplete_tasks}
 
 
-def gen_report_max_completion_count_day_wise(user):
+def gen_report_max_completion_count_day_wise(source):
     """
-    This method will return daywise count of completed tasks by any user
+    This method will return date when user completed most tasks (earliest one in case of a tie)
     """
-
-    try:
-        result = Task.objects.filter(user=user.id, completion_status=1).annotate(
-            date=TruncDate('completion_datetime')).values("date").annotate(
-            count=Count('id')).order_by("date").first()
-    except KeyError:
-        result = {}
+    result = None
+    if source.rollup_totals["max_completed_date"] is not None:
+        result = {"date": source.rollup_totals["max_completed_date"],
+                  "count": source.rollup_totals["max_completed_count"]}
 
     return {"max_tasks_completion_date": result}
 
 
-def gen_report_max_created_count_day_wise(user):
+def gen_report_max_created_count_day_wise(source):
     """
     This method will return weekday wise data when user created more number of tasks
     than other days
     """
-    result = Task.objects.filter(user=user.id).annotate(
-        weekday=ExtractWeekDay('created_datetime')).values("weekday").annotate(
-            count=Count('id')).order_by("weekday")
-
     day_abbr = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
 
-    dict_ = {}
-    for weekday in day_abbr:
-        dict_[weekday] = 0
+    # whole history is in statistics row, a window needs rollups
+    if source.has_window:
+        counts = source.rollup_totals
+    else:
+        counts = {field: getattr(source.statistics, field) for field in UserTaskStatistics.WEEKDAY_FIELDS}
 
-    for item in result:
-        day_name = day_abbr[item['weekday'] - 1]  # ExtractWeekDay method counts 1 as Sunday
-        dict_[day_name] = item['count']
+    dict_ = {}
+    for day_name, field in zip(day_abbr, UserTaskStatistics.WEEKDAY_FIELDS):
+        dict_[day_name] = counts[field]
 
     return {"day_wise_tasks_creation": dict_}
 
@@ -252,23 +328,34 @@ reports_config_ = {"tasks-status": gen_report_tasks_status,
                    "max-created-count-day-wise": gen_report_max_created_count_day_wise
                    }
 
+ALL_REPORTS = "all"
 
-def reports_handler(report_name, user):
+
+def reports_handler(report_names, user, date_from=None, date_to=None):
     """
-    This method is responsible to return a generated report when requested by view.
+    This method is responsible to return generated reports when requested by view.
+    report_names is a list of names from reports_config_ (or ['all']), data of
+    all reports is combined in a single dict. Date based reports are limited
+    to tasks created/completed between date_from & date_to (inclusive) if given.
+    Reports are served from user's report cache (see todofehrist.report_cache).
     """
 
-    report_handler = reports_config_.get(report_name, None)
+    if ALL_REPORTS in report_names:
+        report_names = list(reports_config_)
 
-    error = None
-    report_data = None
+    if not report_names or any(name not in reports_config_ for name in report_names):
+        return None, 'InValidReportName'
 
-    if report_handler:
-        report_data = report_handler(user)
-    else:
-        error = 'InValidReportName'
+    report_names = list(dict.fromkeys(report_names))
+
+    def generate():
+        source = ReportSource(user, date_from, date_to)
+        report_data = {}
+        for report_name in report_names:
+            report_data.update(reports_config_[report_name](source))
+        return report_data
 
-    return report_data, error
+    return cached_reports(user.id, report_names, date_from, date_to, generate), None
 
 
 def authenticate_oauth_token(provider, token):
@@ -278,8 +365,8 @@ def authenticate_oauth_token(provider, token):
         return idinfo
 
     try:
-        # Specify the CLIENT_ID of the app that accesses the backend:
-        idinfo = id_token.verify_oauth2_token(token, requests.Request(), settings.GOOGLE_OAUTH_CLIENT_ID)
+        # verified for settings.GOOGLE_OAUTH_CLIENT_ID, against cached certificates
+        idinfo = verify_google_token(token)
     except Exception as exception_:
         # Invalid token
         logging.exception(exception_)
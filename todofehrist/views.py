@@ -2,19 +2,35 @@
     This file contains all todofehrist app views.
 """
 import logging
-from django.http import HttpResponse, FileResponse
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.dateparse import parse_date
 from django.utils.http import urlsafe_base64_decode
 from django.core.paginator import Paginator, EmptyPage
+from django.core.exceptions import ValidationError
+from django.db import transaction
 
 from rest_framework import status
 
+from emumbaproject.db_router import replica_reads
+
 from todofehrist.serializers import UserSerializer, UserLoginSerializer, \
-    TaskSerializer, TaskMediaFilesSerializer, UserRestPasswordSerializer
-from todofehrist.models import User, Task, TaskMediaFiles, UserLogin
+    TaskSerializer, TaskMediaFilesSerializer, UserRestPasswordSerializer, TaskMediaUploadSerializer
+from todofehrist.models import User, Task, TaskMediaFiles, UserLogin, TaskMediaUpload
 from todofehrist.utility import send_activation_email, account_token_gen, \
     login_required, reports_handler, send_forgot_password_email, authenticate_oauth_token, BaseAPIView
 
 from todofehrist.serializers import SocialAuthSerializer
+from todofehrist.pagination import KeysetPaginator, InvalidCursor
+from todofehrist.search import search_tasks
+from todofehrist.bulk import apply_task_operations, TaskQuotaExceeded
+from todofehrist.media import download_response, upload_limits_error, attach_known_blob, create_upload, \
+    parse_content_range, write_chunk, complete_upload, lock_task_files, UploadError, UploadOffsetMismatch, \
+    UploadTooLarge, UploadIncomplete
+from todofehrist.password_hashing import set_password, verify_password, PasswordHashingBusy
+from todofehrist.throttling import credentials_throttle_wait
+from todofehrist.auth_tokens import invalidate_token, revoke_token, revoke_user_tokens, \
+    signed_token_mode, make_signed_token
 
 
 class UserView(BaseAPIView):
@@ -27,11 +43,19 @@ class UserView(BaseAPIView):
             User Sign Up Handler
         """
 
+        wait = credentials_throttle_wait(request, request.data.get('email', ''), scope="signup")
+        if wait:
+            return self.response_too_many_requests(entity="profile", description="Sign Up", retry_after=wait,
+                                                   error="Too many sign up attempts, try again later.")
+
         serializer = UserSerializer(data=request.data)
         if not serializer.is_valid():
             return self.response_invalid(entity="profile", descripton="Sign Up", error=serializer.errors)
 
-        user = serializer.save()
+        try:
+            user = serializer.save()
+        except PasswordHashingBusy as exception_:
+            return self.response_too_many_requests(entity="profile", description="Sign Up", error=str(exception_))
         logging.info("New User created and stored successfully.")
 
         send_activation_email(user, request)
@@ -75,10 +99,15 @@ class UserLoginView(BaseAPIView):
             User Login Handler
         """
 
+        wait = credentials_throttle_wait(request, request.data.get('email', ''))
+        if wait:
+            return self.response_too_many_requests(entity="user", description="Login User", retry_after=wait,
+                                                   error="Too many login attempts, try again later.")
+
         user = None
 
         try:
-            user = User.objects.get(email=request.data.get('email', ''), is_oauth=0)
+            user = User.objects.get(email=str(request.data.get('email', '')), is_oauth=0)
 
         except User.DoesNotExist:
             return self.response_not_found(entity="user",
@@ -88,17 +117,29 @@ class UserLoginView(BaseAPIView):
             return self.response_invalid(entity="user", description="Login User",
                                          error="Email Address isn't verified yet. Check your email for verification link.")
 
-        if not user.check_password(request.data.get('password', '')):
+        try:
+            password_valid = verify_password(user, request.data.get('password', ''))
+        except PasswordHashingBusy as exception_:
+            return self.response_too_many_requests(entity="user", description="Login User", error=str(exception_))
+
+        if not password_valid:
             return self.response_not_found({}, entity="user", description="Login User",
                                            error="Email/Password pair isn't valid.")
 
+        if signed_token_mode():
+            return self.response_success(data={"token": make_signed_token(user)}, entity="user",
+                                         description="User Login")
+
         token = account_token_gen().make_token(user)
 
         try:
             user_login = UserLogin.objects.get(user=user.id)
 
+            old_token = user_login.token
             user_login.token = token
             user_login.save()
+            # invalidated only once rotation is committed, else a concurrent request could cache it again
+            transaction.on_commit(lambda: invalidate_token(old_token))
 
             return self.response_success(data={"token": token}, entity="user", description="User Login")
 
@@ -124,8 +165,7 @@ class UserLogoutView(BaseAPIView):
         """
         Logs out a user
         """
-        user_login = UserLogin.objects.get(user=user.id)
-        user_login.delete()
+        revoke_token(request.META.get('HTTP_AUTHORIZATION', ''))
 
         return self.response_success(entity="user", description="User Logout")
 
@@ -160,12 +200,19 @@ class SocialAuthLogin(BaseAPIView):
                 email_address=social_user_info["email"])
             user.save()
 
+        if signed_token_mode():
+            return self.response_success(data={"token": make_signed_token(user)}, entity="user",
+                                         description="Social OAuth")
+
         token = account_token_gen().make_token(user)
 
         try:
             user_login = UserLogin.objects.get(user=user.id)
+            old_token = user_login.token
             user_login.token = token
             user_login.save()
+            # invalidated only once rotation is committed, else a concurrent request could cache it again
+            transaction.on_commit(lambda: invalidate_token(old_token))
             return self.response_success(data={"token": token}, entity="user", description="Social OAuth")
         except UserLogin.DoesNotExist:
             serializer_ = UserLoginSerializer(data={"user": user.id, "token": token})
@@ -190,7 +237,7 @@ class UserResetPasswordView(BaseAPIView):
         user = None
 
         try:
-            user = User.objects.get(email=request.data.get('email', ''), is_oauth=0)
+            user = User.objects.get(email=str(request.data.get('email', '')), is_oauth=0)
 
         except User.DoesNotExist:
             return self.response_not_found(entity="user", description="Forgot Password",
@@ -206,6 +253,11 @@ class UserResetPasswordView(BaseAPIView):
             Verify token to allow reset password option
         """
 
+        wait = credentials_throttle_wait(request, request.data.get('email', ''), scope="reset")
+        if wait:
+            return self.response_too_many_requests(entity="user", description="Reset Password", retry_after=wait,
+                                                   error="Too many password reset attempts, try again later.")
+
         user = None
         serializer_obj = UserRestPasswordSerializer(data=request.data.copy())
 
@@ -213,7 +265,7 @@ class UserResetPasswordView(BaseAPIView):
             return self.response_invalid(entity="user", description="Reset Password", error=serializer_obj.errors)
 
         try:
-            user = User.objects.get(email=request.data.get('email', ''), is_oauth=0)
+            user = User.objects.get(email=str(request.data.get('email', '')), is_oauth=0)
 
         except User.DoesNotExist:
             return self.response_not_found(entity="user", description="Reset Password",
@@ -222,8 +274,13 @@ class UserResetPasswordView(BaseAPIView):
         if account_token_gen().check_token(user, request.data.get('reset_token', '')):
             password_ = request.data.get('new_password', None)
             if password_:
-                user.set_password(raw_password=password_)
+                try:
+                    set_password(user, password_)
+                except PasswordHashingBusy as exception_:
+                    return self.response_too_many_requests(entity="user", description="Reset Password",
+                                                           error=str(exception_))
                 user.save()
+                revoke_user_tokens(user)
                 return self.response_success(entity="user", description="Reset Password")
             else:
                 return self.response_invalid(entity="user", description="Reset Password",
@@ -240,41 +297,61 @@ class TaskView(BaseAPIView):
     """
 
     @login_required
+    @replica_reads()
     def get(self, request, user):
         """
-
+            List user's tasks (optionally matching ?search), paginated by ?cursor.
+            ?page_num based pagination is kept for older clients.
         """
 
         search_term = request.GET.get('search', None)
+        page_size = int(request.GET.get("page_size", "5"))
 
-        page_num = int(self.request.GET.get("page_num", "1"))
-        page_size = int(self.request.GET.get("page_size", "5"))
-
+        # files of all tasks in a page are fetched in one query, see TaskSerializer.get_files
+        tasks = Task.objects.filter(user=user.id).prefetch_related("taskmediafiles_set")
+        ordering = ("-pk",)
+        description = "All Tasks"
         if search_term:
-            tasks = Task.objects.filter(user=user.id, title__contains=search_term)
+            tasks = search_tasks(tasks, user.id, search_term)
+            ordering = ("-rank", "-pk")
+            description = "Relevant Tasks"
 
-            try:
-                paginator = Paginator(tasks, page_size)
-                serializer_ = TaskSerializer(paginator.page(page_num), many=True, context={'request': request})
+        if "page_num" in request.GET:
+            return self._get_page(request, tasks, page_size, description, search_term)
+
+        try:
+            page = KeysetPaginator(tasks, page_size, ordering).page(request.GET.get("cursor"))
+        except InvalidCursor as exception_:
+            return self.response_invalid(entity="tasks", description=description, error=str(exception_))
 
-                page_data = {"total": paginator.count, "to": 1, "from": 1}
-                return self.response_success(data=serializer_.data, entity="tasks",
-                                             description="Relevant Tasks", page_data=page_data)
+        serializer_ = TaskSerializer(page.items, many=True, context={'request': request})
 
-            except EmptyPage:
-                return self.response_invalid(entity="tasks", description="Relevant Tasks", error="No Tasks Found.")
+        include_total = request.GET.get("total", "false").lower() in ("true", "1")
+        page_data = {"total": tasks.count() if include_total else None,
+                     "from": page.start_index, "to": page.end_index,
+                     "next": page.next_cursor, "prev": page.prev_cursor}
+        return self.response_success(data=serializer_.data, entity="tasks", description=description,
+                                     page_data=page_data)
 
-        tasks = Task.objects.filter(user=user.id)
+    def _get_page(self, request, tasks, page_size, description, search_term):
+        """
+            Offset based pagination via ?page_num (COUNT + OFFSET query per page)
+        """
+        page_num = int(request.GET.get("page_num", "1"))
 
         try:
             paginator = Paginator(tasks, page_size)
-            serializer_ = TaskSerializer(paginator.page(page_num), many=True, context={'request': request})
-
-            page_data = {"total": paginator.count, "to": 1, "from": 1}
-            return self.response_success(data=serializer_.data, entity="tasks", description="All Tasks",
-                                         page_data=page_data)
+            page = paginator.page(page_num)
         except EmptyPage:
-            return self.response_not_found(entity="tasks", description="All Tasks", error="No Tasks Found.")
+            if search_term:
+                return self.response_invalid(entity="tasks", description=description, error="No Tasks Found.")
+            return self.response_not_found(entity="tasks", description=description, error="No Tasks Found.")
+
+        serializer_ = TaskSerializer(page, many=True, context={'request': request})
+
+        page_data = {"total": paginator.count, "from": page.start_index(), "to": page.end_index()}
+        return self.response_success(data=serializer_.data, entity="tasks", description=description,
+                                     page_data=page_data)
 
     @login_required
     def post(self, request, user):
@@ -295,6 +372,43 @@ class TaskView(BaseAPIView):
             return self.response_invalid(entity="task", description="Create New Task", error=str(exception_))
 
 
+class TaskBulkView(BaseAPIView):
+    """
+        View Handler to Create/Update/Delete many Tasks in one request.
+    """
+
+    @login_required
+    def post(self, request, user):
+        """
+            Applies a list of operations, e.g.
+            {"operations": [{"op": "create", "data": {...}},
+                            {"op": "update", "id": 1, "data": {...}},
+                            {"op": "delete", "id": 2}]}
+            Either all operations are applied or none.
+        """
+        operations = request.data.get("operations")
+
+        if not isinstance(operations, list) or not operations:
+            return self.response_invalid(entity="results", description="Bulk Tasks",
+                                         error="'operations' must be a non empty list.")
+
+        if len(operations) > settings.TASK_BULK_MAX_OPERATIONS:
+            return self.response_invalid(entity="results", description="Bulk Tasks",
+                                         error=f"At most {settings.TASK_BULK_MAX_OPERATIONS} "
+                                               f"operations are allowed per request.")
+
+        try:
+            results, valid = apply_task_operations(user, operations)
+        except TaskQuotaExceeded as exception_:
+            return self.response_invalid(entity="results", description="Bulk Tasks", error=str(exception_))
+
+        if not valid:
+            return self.response_invalid(data=results, entity="results", description="Bulk Tasks",
+                                         error="Invalid operations, no operation is applied.")
+
+        return self.response_success(data=results, entity="results", description="Bulk Tasks")
+
+
 class TaskUpdateView(BaseAPIView):
     """
         View Handler to Fetch/Update/Delete a Task
@@ -373,14 +487,8 @@ class TaskMediaFileView(BaseAPIView):
             return self.response_not_found(entity="file", description="Download File",
                                            error=f"File with id {file_id} doesn't exist or belong to you.")
 
-        file_handle = task_file.file.open()
-
-        # send file
-        response = FileResponse(file_handle, content_type='bytes')
-        response['Content-Length'] = task_file.file.size
-        response['Content-Disposition'] = 'attachment; filename="%s"' % task_file.file.name
-
-        return response
+        # send file (or hand it over to front proxy)
+        return download_response(request, task_file)
 
     @login_required
     def post(self, request, user, task_id):
@@ -430,18 +538,162 @@ class TaskMediaFileView(BaseAPIView):
         return self.response_success(entity="file", description="Delete File")
 
 
+class TaskMediaUploadView(BaseAPIView):
+    """
+        View handler for chunked (resumable) uploads of Task Media files
+    """
+
+    @staticmethod
+    def _get_upload(user, task_id, upload_id):
+        try:
+            return TaskMediaUpload.objects.get(id=upload_id, task=task_id, task__user=user.id)
+        except (TaskMediaUpload.DoesNotExist, ValidationError):
+            return None
+
+    @login_required
+    def post(self, request, user, task_id):
+        """
+            Initiate an upload, {"name": "file name", "size": size in bytes, "sha256": optional hex digest}
+            responds with 'file' instead of 'upload' if file's content is already stored
+        """
+        if not Task.objects.filter(id=task_id, user=user.id).exists():
+            return self.response_not_found(entity="upload", description="Initiate Upload",
+                                           error=f"Task with id {task_id} doesn't exist or belong to you.")
+
+        serializer_ = TaskMediaUploadSerializer(data=request.data)
+        if not serializer_.is_valid():
+            return self.response_invalid(entity="upload", description="Initiate Upload", error=serializer_.errors)
+
+        size = serializer_.validated_data["size"]
+        with transaction.atomic():
+            lock_task_files(task_id)
+            error = upload_limits_error(user, task_id, size)
+            if error:
+                return self.response_too_large(entity="upload", description="Initiate Upload", error=error)
+
+            task_file = None
+            if serializer_.validated_data.get("sha256"):
+                task_file = attach_known_blob(user, task_id, serializer_.validated_data["name"], size,
+                                              serializer_.validated_data["sha256"])
+        if task_file is not None:
+            return self.response_success(data=TaskMediaFilesSerializer(task_file).data, entity="file",
+                                         description="Initiate Upload")
+
+        upload = create_upload(task_id, serializer_.validated_data["name"], size)
+
+        return self.response_success(data=TaskMediaUploadSerializer(upload).data, entity="upload",
+                                     description="Initiate Upload")
+
+    @login_required
+    def get(self, request, user, task_id, upload_id):
+        """
+            Upload status, 'received' is the offset to resume upload from
+        """
+        upload = self._get_upload(user, task_id, upload_id)
+        if upload is None:
+            return self.response_not_found(entity="upload", description="Upload Status",
+                                           error=f"Upload with id {upload_id} doesn't exist or belong to you.")
+
+        return self.response_success(data=TaskMediaUploadSerializer(upload).data, entity="upload",
+                                     description="Upload Status")
+
+    @login_required
+    def put(self, request, user, task_id, upload_id):
+        """
+            Upload a chunk, raw bytes in body with 'Content-Range: bytes start-end/size' header
+        """
+        upload = self._get_upload(user, task_id, upload_id)
+        if upload is None:
+            return self.response_not_found(entity="upload", description="Upload Chunk",
+                                           error=f"Upload with id {upload_id} doesn't exist or belong to you.")
+
+        try:
+            start, length = parse_content_range(request.META.get("HTTP_CONTENT_RANGE"), upload.size)
+            write_chunk(upload, request, start, length)
+        except UploadOffsetMismatch as exception_:
+            return self.response_conflict(data=TaskMediaUploadSerializer(upload).data, entity="upload",
+                                          description="Upload Chunk", error=str(exception_))
+        except UploadTooLarge as exception_:
+            return self.response_too_large(entity="upload", description="Upload Chunk", error=str(exception_))
+        except UploadError as exception_:
+            return self.response_invalid(entity="upload", description="Upload Chunk", error=str(exception_))
+
+        return self.response_success(data=TaskMediaUploadSerializer(upload).data, entity="upload",
+                                     description="Upload Chunk")
+
+    @login_required
+    def delete(self, request, user, task_id, upload_id):
+        """
+            Abort an upload
+        """
+        upload = self._get_upload(user, task_id, upload_id)
+        if upload is None:
+            return self.response_not_found(entity="upload", description="Abort Upload",
+                                           error=f"Upload with id {upload_id} doesn't exist or belong to you.")
+
+        upload.delete()
+
+        return self.response_success(entity="upload", description="Abort Upload")
+
+
+class TaskMediaUploadCompleteView(BaseAPIView):
+    """
+        View handler to complete a chunked upload into a Task Media file
+    """
+
+    @login_required
+    def post(self, request, user, task_id, upload_id):
+        """
+            Complete an upload after all of its bytes are received
+        """
+        upload = TaskMediaUploadView._get_upload(user, task_id, upload_id)
+        if upload is None:
+            return self.response_not_found(entity="file", description="Complete Upload",
+                                           error=f"Upload with id {upload_id} doesn't exist or belong to you.")
+
+        with transaction.atomic():
+            lock_task_files(task_id)
+            error = upload_limits_error(user, task_id, upload.size)
+            if error:
+                return self.response_too_large(entity="file", description="Complete Upload", error=error)
+
+            try:
+                task_file = complete_upload(upload)
+            except UploadIncomplete as exception_:
+                return self.response_invalid(entity="file", description="Complete Upload", error=str(exception_))
+
+        return self.response_success(data=TaskMediaFilesSerializer(task_file).data, entity="file",
+                                     description="Complete Upload")
+
+
 class ReportView(BaseAPIView):
     """
         View Handler for Reports
     """
 
     @login_required
+    @replica_reads()
     def get(self, request, user):
         """
-
+            Generate reports, ?name=report-name&from=YYYY-MM-DD&to=YYYY-MM-DD
+            'name' can be comma separated names (or repeated) or 'all', data of
+            all requested reports is combined in one payload.
+            ('from' & 'to' are optional and apply to date based reports)
         """
-        report_name = request.GET.get('name')
-        report_data, error = reports_handler(report_name, user)
+        report_names = [name for value in request.GET.getlist('name') for name in value.split(',') if name]
+
+        dates = {}
+        for param in ('from', 'to'):
+            value = request.GET.get(param)
+            try:
+                dates[param] = parse_date(value) if value else None
+            except ValueError:
+                dates[param] = None
+            if value and dates[param] is None:
+                return self.response_invalid(entity="report", description="Report Data",
+                                             error=f"'{param}' must be a date in YYYY-MM-DD format.")
+
+        report_data, error = reports_handler(report_names, user, dates['from'], dates['to'])
         if report_data:
             return self.response_success(data=report_data, entity="report", description="Report Data")
 